@@ -2,31 +2,66 @@
 from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import os
 
 db = SQLAlchemy()
 
-def create_app():
-    """Create and configure the Flask application."""
+def create_app(config_overrides=None):
+    """
+    Create and configure the Flask application.
+    
+    Creating an app has no side effects on the database or filesystem, so
+    every server worker can call it cheaply; schema setup is done once by
+    ``flask init-db`` (see app.schema).
+    
+    Args:
+        config_overrides (dict): Settings applied on top of Config, before
+            any extension reads them (used by tests)
+    """
     app = Flask(__name__)
     
+    # Encode JSON responses with orjson when available
+    from app.serialization import FastJSONProvider
+    app.json = FastJSONProvider(app)
+    
+    # Stream multipart file parts straight into the upload folder
+    from app.storage import IngestRequest
+    app.request_class = IngestRequest
+    
     # Load configuration
     from app.config import Config
     app.config.from_object(Config)
+    if config_overrides:
+        app.config.update(config_overrides)
     
     # Initialize extensions
+    from app.database import engine_options, install_sqlite_pragmas
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, app.config)
     CORS(app)
     
+    from app.blobstore import create_backend
+    app.extensions['storage_backend'] = create_backend(app.config)
+    
+    from app.cache import create_cache, create_preview_cache
+    app.extensions['document_cache'] = create_cache(app.config)
+    app.extensions['preview_cache'] = create_preview_cache(app.config)
+    
+    from app.metrics import init_metrics
+    init_metrics(app)
+    
+    from app.admission import AdmissionController
+    app.extensions['upload_admission'] = AdmissionController.from_config(
+        app.config, app.extensions.get('metrics'))
+    
     # Register blueprints
     from app.routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
-        # Create uploads directory
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Register CLI commands
+    from app.commands import register_commands
+    register_commands(app)
     
     # Error handlers
     @app.errorhandler(404)
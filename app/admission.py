@@ -0,0 +1,180 @@
+"""Admission control that bounds concurrent uploads, so bursts cannot saturate the disk."""
+import functools
+import math
+import threading
+import time
+from collections import deque, namedtuple
+from flask import current_app, jsonify, request
+
+# An admitted upload: its declared size and when it was admitted
+Ticket = namedtuple('Ticket', ['size', 'admitted_at'])
+
+class AdmissionRejected(Exception):
+    """Raised when an upload is refused; carries the HTTP status and Retry-After seconds."""
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Admit uploads while both the concurrency and in-flight byte limits allow.
+
+    Uploads that do not fit wait in a bounded FIFO queue. When the queue is
+    full they are rejected at once (429); when they wait longer than
+    queue_timeout they are rejected (503). Either way the client gets a
+    Retry-After estimated from recent upload durations. A single upload
+    larger than max_bytes is admitted once nothing else is in flight.
+
+    Only uploads pass through the controller, so downloads and metadata
+    reads are never queued behind them.
+    """
+
+    def __init__(self, max_concurrent=None, max_bytes=None, queue_size=0, queue_timeout=10.0, metrics=None):
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.metrics = metrics
+        self._condition = threading.Condition()
+        self._waiters = deque()
+        self._active = 0
+        self._active_bytes = 0
+        self._admitted = 0
+        self._rejected = {'queue_full': 0, 'timeout': 0}
+        self._peak_queued = 0
+        # Moving average of how long an upload holds its slot, for Retry-After
+        self._hold_time = 1.0
+
+    @classmethod
+    def from_config(cls, config, metrics=None):
+        """Build a controller, or return None if no limit is configured."""
+        if config['UPLOAD_MAX_CONCURRENT'] is None and config['UPLOAD_MAX_INFLIGHT_BYTES'] is None:
+            return None
+        return cls(config['UPLOAD_MAX_CONCURRENT'], config['UPLOAD_MAX_INFLIGHT_BYTES'],
+                   config['UPLOAD_QUEUE_SIZE'], config['UPLOAD_QUEUE_TIMEOUT'], metrics)
+
+    def _fits(self, size):
+        if self.max_concurrent is not None and self._active >= self.max_concurrent:
+            return False
+        return self.max_bytes is None or self._active_bytes == 0 or self._active_bytes + size <= self.max_bytes
+
+    def _retry_after(self):
+        # Time for everything queued ahead to go through at the recent pace
+        slots = self.max_concurrent or max(self._active, 1)
+        return max(1, min(60, math.ceil(self._hold_time * (len(self._waiters) + 1) / slots)))
+
+    def _reject(self, reason, status):
+        self._rejected[reason] += 1
+        if self.metrics is not None:
+            self.metrics.uploads_rejected.inc(reason=reason)
+        raise AdmissionRejected(reason, status, self._retry_after())
+
+    def _update_gauges(self):
+        if self.metrics is not None:
+            self.metrics.uploads_active.set(self._active)
+            self.metrics.uploads_active_bytes.set(self._active_bytes)
+            self.metrics.uploads_queued.set(len(self._waiters))
+
+    def acquire(self, size):
+        """
+        Wait for room to run an upload of size bytes.
+
+        Returns:
+            A Ticket to pass to release().
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait times out.
+        """
+        started = time.monotonic()
+        with self._condition:
+            if not self._waiters and self._fits(size):
+                return self._admit(size, started)
+            if len(self._waiters) >= self.queue_size:
+                self._reject('queue_full', 429)
+
+            token = object()
+            self._waiters.append(token)
+            self._peak_queued = max(self._peak_queued, len(self._waiters))
+            self._update_gauges()
+            deadline = started + self.queue_timeout
+            try:
+                while not (self._waiters[0] is token and self._fits(size)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('timeout', 503)
+                    self._condition.wait(remaining)
+            finally:
+                self._waiters.remove(token)
+                self._update_gauges()
+                # The next waiter may fit now that this one has left the head
+                self._condition.notify_all()
+            return self._admit(size, started)
+
+    def _admit(self, size, started):
+        now = time.monotonic()
+        self._active += 1
+        self._active_bytes += size
+        self._admitted += 1
+        self._update_gauges()
+        if self.metrics is not None:
+            self.metrics.upload_admission_wait.observe(now - started)
+        return Ticket(size, now)
+
+    def release(self, ticket):
+        """Free an admitted upload's slot and bytes."""
+        with self._condition:
+            self._active -= 1
+            self._active_bytes -= ticket.size
+            self._hold_time = 0.8 * self._hold_time + 0.2 * (time.monotonic() - ticket.admitted_at)
+            self._update_gauges()
+            self._condition.notify_all()
+
+    def stats(self):
+        """Return limits, current load and counters."""
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_inflight_bytes': self.max_bytes,
+                'queue_size': self.queue_size,
+                'active': self._active,
+                'active_bytes': self._active_bytes,
+                'queued': len(self._waiters),
+                'peak_queued': self._peak_queued,
+                'admitted': self._admitted,
+                'rejected': dict(self._rejected)
+            }
+
+def get_admission():
+    """Return the current application's admission controller, or None if disabled."""
+    return current_app.extensions.get('upload_admission')
+
+def admit_upload(view):
+    """
+    Run an upload view only once the admission controller lets it in.
+
+    The request's Content-Length is counted against the in-flight byte
+    limit (MAX_CONTENT_LENGTH if the length is not declared). Admission is
+    decided before the body is read, so rejected uploads cost no disk I/O.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        controller = get_admission()
+        if controller is None:
+            return view(*args, **kwargs)
+        size = request.content_length
+        if size is None:
+            size = current_app.config['MAX_CONTENT_LENGTH'] or 0
+        try:
+            ticket = controller.acquire(size)
+        except AdmissionRejected as e:
+            message = ('Too many uploads in progress' if e.reason == 'queue_full'
+                       else 'Upload capacity is exhausted')
+            return jsonify({'error': f'{message}; retry later'}), e.status, {'Retry-After': str(e.retry_after)}
+        try:
+            return view(*args, **kwargs)
+        finally:
+            controller.release(ticket)
+    return wrapper
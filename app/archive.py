@@ -0,0 +1,141 @@
+"""Streaming ZIP archives of stored documents."""
+import io
+import os
+import zipfile
+from app.storage import COPY_CHUNK_SIZE, decode_stream
+
+# Columns read for each archived document
+ARCHIVE_COLUMNS = ('id', 'filename', 'original_filename', 'file_size', 'file_type',
+                   'storage_codec', 'upload_timestamp', 'file_missing_at')
+
+# Earliest timestamp a ZIP entry can hold (DOS date format)
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable sink whose contents are drained as response chunks.
+
+    zipfile detects that it cannot seek and writes sizes and CRCs in data
+    descriptors after each entry, so nothing is ever rewritten in place.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def unique_entry_name(name, used):
+    """
+    Return name, or "name (n).ext" if an earlier entry already took it.
+
+    Comparison ignores case, since many extractors run on case-insensitive
+    filesystems.
+
+    Args:
+        name (str): The document's original filename
+        used (set): Lower-cased names already in the archive; updated
+    """
+    name = name.replace('/', '_').replace('\\', '_') or 'document'
+    stem, dot, ext = name.rpartition('.')
+    if not dot or not stem:
+        stem, ext = name, ''
+    candidate, counter = name, 1
+    while candidate.lower() in used:
+        candidate = f'{stem} ({counter}).{ext}' if ext else f'{stem} ({counter})'
+        counter += 1
+    used.add(candidate.lower())
+    return candidate
+
+def _set_compress_level(info, level):
+    # ZipFile.open() only applies the archive's level to entries given by name.
+    # The per-entry level is public since Python 3.13; before that, streamed
+    # writes (unlike writestr()) have no public way to set it.
+    if hasattr(zipfile.ZipInfo, 'compress_level'):
+        info.compress_level = level
+    else:
+        info._compresslevel = level
+
+def _entry_info(name, document, stored_types, compression_level):
+    timestamp = document.upload_timestamp.timetuple()[:6]
+    info = zipfile.ZipInfo(name, date_time=max(timestamp, ZIP_EPOCH))
+    # Formats that are already compressed gain nothing from deflate
+    info.compress_type = zipfile.ZIP_STORED if document.file_type in stored_types else zipfile.ZIP_DEFLATED
+    _set_compress_level(info, compression_level)
+    info.external_attr = 0o644 << 16
+    # The logical size, so zipfile switches to ZIP64 headers for large files
+    info.file_size = document.file_size
+    return info
+
+def stream_archive(entries, backend, stored_types, compression_level=6):
+    """
+    Yield a ZIP archive of documents as it is built.
+
+    Each file is read in COPY_CHUNK_SIZE pieces and every piece is handed
+    to the client as soon as it is encoded, so memory use does not depend
+    on the number or size of the documents. Files stored gzip-compressed
+    are decoded, so entries hold the original bytes.
+
+    Args:
+        entries: Iterable of (entry name, document row)
+        backend: Storage backend holding the files
+        stored_types (set): File types written without compression
+        compression_level (int): zlib level for deflated entries
+
+    Yields:
+        Chunks of the archive.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True,
+                         compresslevel=compression_level) as archive:
+        for name, document in entries:
+            info = _entry_info(name, document, stored_types, compression_level)
+            source = decode_stream(backend.open(document.filename), document.storage_codec)
+            with source, archive.open(info, 'w') as target:
+                while True:
+                    chunk = source.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    # The central directory is written when the archive closes
+    yield buffer.drain()
+
+def archive_entries(rows):
+    """
+    Pair document rows with unique entry names, leaving out files marked missing.
+
+    The reconciliation scan's marks are trusted, so the backend is not
+    asked about each file before the archive starts.
+
+    Args:
+        rows: Document rows with the ARCHIVE_COLUMNS
+
+    Returns:
+        Tuple of (entries list, ids of documents whose file is missing).
+    """
+    entries, missing, used = [], [], set()
+    for row in rows:
+        if row.file_missing_at is not None:
+            missing.append(row.id)
+            continue
+        entries.append((unique_entry_name(row.original_filename, used), row))
+    return entries, missing
+
+def archive_filename(entries):
+    """Name the download after its only document, or generically."""
+    if len(entries) == 1:
+        return os.path.splitext(entries[0][0])[0] + '.zip'
+    return 'documents.zip'
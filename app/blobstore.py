@@ -0,0 +1,225 @@
+"""Storage backends holding blob bytes: the local filesystem or an S3-compatible object store."""
+import heapq
+import os
+from collections import namedtuple
+from flask import current_app
+
+# What a backend reports about a stored object; modified is a POSIX timestamp
+BlobStat = namedtuple('BlobStat', ['size', 'modified'], defaults=(None,))
+
+# Where the reconciliation scan moves files no document refers to
+QUARANTINE_DIR = '.quarantine'
+
+class StorageBackend:
+    """
+    Interface for the store blob files live in, addressed by blob filename.
+
+    Uploads are always received, hashed and compressed in the local upload
+    folder first; put() then hands the finished file to the backend.
+    Implementations must be safe to share between threads and picklable,
+    so extraction worker processes can read blobs too.
+    """
+
+    def put(self, key, source_path):
+        """Move a complete local file into the store under key; the source file is consumed."""
+        raise NotImplementedError
+
+    def open(self, key, start=0, stop=None):
+        """
+        Open stored bytes start..stop (exclusive) for one sequential read.
+
+        Callers read at most stop - start bytes.
+
+        Raises:
+            FileNotFoundError: If nothing is stored under key.
+        """
+        raise NotImplementedError
+
+    def open_seekable(self, key):
+        """
+        Open stored bytes for random access, for parsers that seek.
+
+        Raises:
+            FileNotFoundError: If nothing is stored under key.
+        """
+        raise NotImplementedError
+
+    def stat(self, key):
+        """Return a BlobStat, or None if nothing is stored under key."""
+        raise NotImplementedError
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def delete(self, key):
+        """Remove a stored object; missing objects are ignored."""
+        raise NotImplementedError
+
+    def presigned_url(self, key, expires_in, filename=None, content_type=None):
+        """
+        Return a time-limited URL clients can download key from directly.
+
+        Returns:
+            The URL, or None if the backend cannot serve clients itself.
+        """
+        return None
+
+    def iter_keys(self, start_after=''):
+        """
+        Yield every stored key after start_after in ascending (byte) order.
+
+        Keys starting with a dot (temp files, partial uploads, quarantine)
+        are not blob files and are skipped.
+        """
+        raise NotImplementedError
+
+    def quarantine(self, key):
+        """Move a stored object aside under QUARANTINE_DIR; return False if it is already gone."""
+        raise NotImplementedError
+
+    def local_path(self, key, verify=True):
+        """
+        Return the file's path if it is on the local filesystem, else None.
+
+        With verify=False the expected path is returned without checking
+        it exists, for callers that trust the database's record of it.
+        """
+        return None
+
+class LocalBackend(StorageBackend):
+    """
+    Blobs kept in the upload folder.
+
+    Files fan out into directories named by filename prefixes (see
+    UPLOAD_SHARD_DEPTH); files still in the original flat layout are
+    found until the layout migration moves them.
+    """
+
+    def __init__(self, root, shard_depth=2, shard_width=2):
+        self.root = root
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['UPLOAD_FOLDER'], config['UPLOAD_SHARD_DEPTH'], config['UPLOAD_SHARD_WIDTH'])
+
+    def shard_dirs(self, key):
+        """Return the fan-out directories for a key (hex prefixes)."""
+        if len(key) <= self.shard_depth * self.shard_width:
+            return []
+        return [key[level * self.shard_width:(level + 1) * self.shard_width] for level in range(self.shard_depth)]
+
+    def path(self, key):
+        """Return where a key lives in the sharded layout."""
+        return os.path.join(self.root, *self.shard_dirs(key), key)
+
+    def legacy_path(self, key):
+        """Return a key's location in the original flat layout."""
+        return os.path.join(self.root, key)
+
+    def local_path(self, key, verify=True):
+        path = self.path(key)
+        if not verify or os.path.exists(path):
+            return path
+        flat = self.legacy_path(key)
+        if flat != path and os.path.exists(flat):
+            return flat
+        # The migration may have moved it between the two checks
+        return path if os.path.exists(path) else None
+
+    def _open(self, key):
+        # Try the sharded path first, so the common case costs no extra stat
+        try:
+            return open(self.path(key), 'rb')
+        except FileNotFoundError:
+            pass
+        path = self.local_path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        return open(path, 'rb')
+
+    def put(self, key, source_path):
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source_path, destination)
+
+    def open(self, key, start=0, stop=None):
+        f = self._open(key)
+        if start:
+            f.seek(start)
+        return f
+
+    def open_seekable(self, key):
+        return self._open(key)
+
+    def stat(self, key):
+        path = self.local_path(key)
+        if path is None:
+            return None
+        try:
+            result = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return BlobStat(result.st_size, result.st_mtime)
+
+    def delete(self, key):
+        for path in (self.path(key), self.legacy_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _list(self, directory, dirs):
+        """Return the sorted names of a directory's subdirectories (or files), skipping dot-names."""
+        try:
+            with os.scandir(directory) as entries:
+                return sorted(entry.name for entry in entries
+                              if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False) == dirs)
+        except FileNotFoundError:
+            return []  # Removed since its parent was listed
+
+    def _walk_shards(self, directory, names, depth, start_after, prefix=''):
+        for name in names:
+            shard_prefix = prefix + name
+            # Whole subtrees before the resume point are skipped unlisted
+            if shard_prefix < start_after[:len(shard_prefix)]:
+                continue
+            path = os.path.join(directory, name)
+            if depth < self.shard_depth:
+                yield from self._walk_shards(path, self._list(path, dirs=True), depth + 1, start_after, shard_prefix)
+            else:
+                yield from (key for key in self._list(path, dirs=False) if key > start_after)
+
+    def iter_keys(self, start_after=''):
+        # Shard directories are key prefixes, so walking them in sorted order
+        # yields keys in order; files still in the flat layout are merged in
+        flat = [key for key in self._list(self.root, dirs=False) if key > start_after]
+        shards = self._list(self.root, dirs=True) if self.shard_depth else []
+        return heapq.merge(flat, self._walk_shards(self.root, shards, 1, start_after))
+
+    def quarantine(self, key):
+        path = self.local_path(key)
+        if path is None:
+            return False
+        destination = os.path.join(self.root, QUARANTINE_DIR, key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            os.replace(path, destination)
+        except FileNotFoundError:
+            return False
+        return True
+
+def create_backend(config):
+    """Build the backend named by STORAGE_BACKEND."""
+    backend = config['STORAGE_BACKEND']
+    if backend == 'local':
+        return LocalBackend.from_config(config)
+    if backend == 's3':
+        from app.s3 import S3Backend
+        return S3Backend.from_config(config)
+    raise ValueError(f'Unknown STORAGE_BACKEND: {backend}')
+
+def get_backend():
+    """Return the current application's storage backend."""
+    return current_app.extensions['storage_backend']
@@ -0,0 +1,245 @@
+"""Read cache for document metadata and listing pages."""
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models import Blob, Document
+from app.serialization import json_default
+
+def _entry_size(value):
+    return len(value) if isinstance(value, (str, bytes)) else len(json.dumps(value, default=json_default))
+
+class MemoryCache:
+    """
+    Bounded in-process LRU cache with a per-entry TTL.
+
+    Bounded by entry count and, if max_bytes is set, by the total
+    JSON-encoded size of the values.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = _entry_size(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def incr(self, key):
+        # Counters live outside the LRU so they are never evicted
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+            if self.max_bytes is not None:
+                stats.update(bytes=self._bytes, max_bytes=self.max_bytes)
+            return stats
+
+class RedisCache:
+    """Cache shared by every worker, backed by Redis."""
+
+    def __init__(self, client, ttl=300, prefix='docapi:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        self._count(raw is not None)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value, default=json_default), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+    def stats(self):
+        # Evictions are reported by Redis itself (INFO stats: evicted_keys)
+        info = self.client.info('stats')
+        with self._lock:
+            return {
+                'backend': 'redis',
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': info.get('evicted_keys', 0),
+                'expirations': info.get('expired_keys', 0)
+            }
+
+def create_cache(config):
+    """Build the cache backend named by CACHE_BACKEND, or None if disabled."""
+    backend = config['CACHE_BACKEND']
+    if not backend:
+        return None
+    if backend == 'memory':
+        return MemoryCache(max_entries=config['CACHE_MAX_ENTRIES'], ttl=config['CACHE_TTL'])
+    if backend == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']), ttl=config['CACHE_TTL'])
+    raise ValueError(f'Unknown CACHE_BACKEND: {backend}')
+
+def create_preview_cache(config):
+    """
+    Build the cache for extracted page text, or None if caching is disabled.
+
+    In memory it is bounded by PREVIEW_CACHE_MAX_BYTES; with Redis, by the
+    server's maxmemory eviction policy.
+    """
+    backend = config['CACHE_BACKEND']
+    if not backend:
+        return None
+    if backend == 'memory':
+        return MemoryCache(max_entries=config['CACHE_MAX_ENTRIES'], ttl=config['PREVIEW_CACHE_TTL'],
+                           max_bytes=config['PREVIEW_CACHE_MAX_BYTES'])
+    if backend == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']), ttl=config['PREVIEW_CACHE_TTL'],
+                          prefix='docapi:preview:')
+    raise ValueError(f'Unknown CACHE_BACKEND: {backend}')
+
+def get_cache():
+    """Return the current application's cache, or None if caching is disabled."""
+    return current_app.extensions.get('document_cache')
+
+def get_preview_cache():
+    """Return the current application's preview cache, or None if caching is disabled."""
+    return current_app.extensions.get('preview_cache')
+
+def document_key(document_id):
+    return f'document:{document_id}'
+
+def blob_key(content_hash):
+    return f'blob:{content_hash}'
+
+def preview_key(content_hash, unit, start, end):
+    # Keyed by content, so duplicate uploads share entries and they never go stale
+    return f'preview:{content_hash}:{unit}:{start}-{end}'
+
+def list_key(cache, query_string):
+    """Key for a listing page; bumping the generation invalidates every page."""
+    generation = cache.counter('documents:generation')
+    return f'documents:{generation}:{query_string}'
+
+def invalidate(document_ids=(), content_hashes=(), lists=False):
+    """Drop cached entries made stale by a committed write."""
+    cache = get_cache()
+    if cache is None:
+        return
+    for document_id in document_ids:
+        cache.delete(document_key(document_id))
+    for content_hash in content_hashes:
+        cache.delete(blob_key(content_hash))
+    if lists:
+        cache.incr('documents:generation')
+
+def mark_stale(session, document_ids=(), content_hashes=()):
+    """
+    Invalidate entries when the session commits, for rows changed by bulk statements.
+
+    ORM changes are tracked automatically; UPDATE statements bypass that.
+    """
+    changes = session.info.setdefault('cache_changes', {'documents': set(), 'blobs': set()})
+    changes['documents'].update(document_ids)
+    changes['blobs'].update(content_hashes)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    objects = list(session.new) + list(session.dirty) + list(session.deleted)
+    mark_stale(session,
+               [obj.id for obj in objects if isinstance(obj, Document)],
+               [obj.content_hash for obj in objects if isinstance(obj, Blob)])
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    changes = session.info.pop('cache_changes', None)
+    if changes and has_app_context():
+        invalidate(changes['documents'], changes['blobs'], lists=bool(changes['documents']))
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('cache_changes', None)
@@ -0,0 +1,90 @@
+"""Flask CLI commands."""
+import time
+import click
+from flask.cli import with_appcontext
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create or upgrade the database schema and the upload folder."""
+    from app.schema import init_schema
+    try:
+        previous, current = init_schema()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if previous == current:
+        click.echo(f'Schema is up to date (version {current})')
+    elif previous is None:
+        click.echo(f'Created schema version {current}')
+    else:
+        click.echo(f'Upgraded schema from version {previous} to {current}')
+
+@click.command('reindex')
+@click.option('--rebuild', is_flag=True, help='Discard the existing index and extract everything again.')
+@click.option('--workers', type=int, default=None, help='Extraction processes (default: CPU count).')
+@with_appcontext
+def reindex_command(rebuild, workers):
+    """Build the full-text search index for stored documents."""
+    from app.search import reindex, search_available
+    if not search_available():
+        raise click.ClickException('Full-text search requires SQLite with FTS5')
+    indexed, failed = reindex(rebuild=rebuild, workers=workers)
+    click.echo(f'Indexed {indexed} blob(s), {failed} extraction failure(s)')
+
+@click.command('migrate-layout')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Files moved per batch.')
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches.')
+@with_appcontext
+def migrate_layout_command(batch_size, pause):
+    """Move flat upload files into the sharded directory layout."""
+    from app.storage import migrate_layout
+    try:
+        moved = migrate_layout(batch_size=batch_size, pause=pause,
+                               progress=lambda total: click.echo(f'Moved {total} file(s)...'))
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Migration complete: {moved} file(s) moved')
+
+@click.command('reconcile')
+@click.option('--batch-size', type=int, default=None, help='Keys listed per batch (default: RECONCILE_BATCH_SIZE).')
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--watch', is_flag=True, help='Keep running, starting a new pass every RECONCILE_INTERVAL seconds.')
+@with_appcontext
+def reconcile_command(batch_size, pause, watch):
+    """Compare stored files with the database, marking missing files and quarantining orphans."""
+    from flask import current_app
+    from app.reconcile import reconcile
+    while True:
+        totals = reconcile(batch_size=batch_size, pause=pause,
+                           progress=lambda totals: click.echo(f"Checked {totals['files']} file(s)..."))
+        click.echo(f"Pass complete: {totals['files']} file(s) and {totals['documents']} legacy document(s) "
+                   f"checked, {totals['missing']} missing, {totals['restored']} restored, "
+                   f"{totals['quarantined']} quarantined, {totals['temp_removed']} stale temp file(s) removed")
+        if not watch:
+            return
+        time.sleep(current_app.config['RECONCILE_INTERVAL'])
+
+@click.command('expire-uploads')
+@with_appcontext
+def expire_uploads_command():
+    """Delete resumable upload sessions that were abandoned."""
+    from app.resumable import expire_sessions
+    removed = expire_sessions()
+    click.echo(f'Removed {removed} expired upload session(s)')
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Recompute the per-type document counters from the documents table."""
+    from app.stats import rebuild_stats
+    stats = rebuild_stats()
+    click.echo(f"Counted {stats['total_documents']} document(s), {stats['total_bytes']} byte(s)")
+
+def register_commands(app):
+    """Register CLI commands on the application."""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(reindex_command)
+    app.cli.add_command(migrate_layout_command)
+    app.cli.add_command(reconcile_command)
+    app.cli.add_command(expire_uploads_command)
+    app.cli.add_command(rebuild_stats_command)
@@ -1,18 +1,143 @@
 """Application configuration."""
 import os
 
+def _env_bool(name, default):
+    """Read a boolean flag from the environment."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
 class Config:
-    """Configuration class for Flask app."""
+    """Configuration class for Flask app.
+    
+    Deployment-specific settings can be overridden with environment
+    variables of the same name (DATABASE_URL for the database URI).
+    """
     
     # Database configuration
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///documents.db'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///documents.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool (server databases such as PostgreSQL/MySQL)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # Seconds
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # Seconds
+    
+    # SQLite pragmas applied to every connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # Milliseconds
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # Bytes
+    
+    # Group commit coalesces concurrent upload inserts into shared transactions
+    DB_GROUP_COMMIT = _env_bool('DB_GROUP_COMMIT', False)
+    DB_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('DB_GROUP_COMMIT_MAX_BATCH', 64))
+    DB_GROUP_COMMIT_MAX_DELAY = float(os.environ.get('DB_GROUP_COMMIT_MAX_DELAY', 0.005))  # Seconds
+    
     # Upload configuration
-    UPLOAD_FOLDER = 'uploads'
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    # Stored files fan out into nested directories named by filename prefixes,
+    # e.g. ab/cd/abcd1234... for depth 2, width 2 (depth 0 keeps a flat folder)
+    UPLOAD_SHARD_DEPTH = int(os.environ.get('UPLOAD_SHARD_DEPTH', 2))
+    UPLOAD_SHARD_WIDTH = int(os.environ.get('UPLOAD_SHARD_WIDTH', 2))
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'pdf', 'txt', 'docx'}
+    # New files of these types are stored gzip-compressed and served with
+    # Content-Encoding: gzip to clients that accept it. DOCX and most PDFs
+    # are already deflate-compressed internally, so they gain little.
+    STORAGE_COMPRESSION = _env_bool('STORAGE_COMPRESSION', True)
+    COMPRESS_FILE_TYPES = {'txt'}
+    COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+    COMPRESSION_MIN_SAVING = 0.1  # Keep the raw file unless compression saves at least 10%
+    MAX_BATCH_FILES = 1000  # Files accepted by a single batch upload
+    BATCH_WRITE_WORKERS = 8  # Threads finalizing files in a batch upload
+    
+    # Resumable uploads send a large file as a series of chunks, each of
+    # which must fit within MAX_CONTENT_LENGTH
+    RESUMABLE_MAX_SIZE = int(os.environ.get('RESUMABLE_MAX_SIZE', 1024 * 1024 * 1024))  # 1GB total
+    RESUMABLE_SESSION_TTL = int(os.environ.get('RESUMABLE_SESSION_TTL', 24 * 60 * 60))  # Seconds idle
+    RESUMABLE_CHUNK_SIZE = 64 * 1024  # Bytes per read when appending a chunk
+    
+    # Where blob files are kept: 'local' (UPLOAD_FOLDER) or 's3' (any
+    # S3-compatible store; UPLOAD_FOLDER still stages incoming uploads)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://s3.amazonaws.com')
+    S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+    S3_BUCKET = os.environ.get('S3_BUCKET', '')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')  # Prepended to every object key
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID', '')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY', '')
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 10))  # Idle keep-alive connections per process
+    S3_TIMEOUT = 30  # Seconds
+    S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024  # Larger files are uploaded in parallel parts
+    S3_MULTIPART_PART_SIZE = 8 * 1024 * 1024  # S3 requires at least 5MB for all but the last part
+    S3_MULTIPART_CONCURRENCY = 4  # Parts in flight per upload
+    S3_READ_BLOCK_SIZE = 1024 * 1024  # Bytes per ranged GET when a parser seeks within an object
+    
+    # Background reconciliation ("flask reconcile") of stored files against
+    # the database; downloads trust the missing-file marks it keeps
+    RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', 1000))  # Keys listed per batch
+    # Unreferenced files younger than this may belong to an upload still registering them
+    RECONCILE_ORPHAN_GRACE = int(os.environ.get('RECONCILE_ORPHAN_GRACE', 60 * 60))  # Seconds
+    RECONCILE_INTERVAL = int(os.environ.get('RECONCILE_INTERVAL', 60 * 60))  # Seconds between passes with --watch
+    
+    # Download configuration
+    # 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) lets the
+    # reverse proxy serve file bytes; None streams them from Flask
+    DOWNLOAD_OFFLOAD = None
+    DOWNLOAD_OFFLOAD_PREFIX = '/protected-uploads/'  # nginx internal location for UPLOAD_FOLDER
+    # Redirect downloads to presigned URLs when the storage backend has them (S3)
+    DOWNLOAD_REDIRECT = _env_bool('DOWNLOAD_REDIRECT', False)
+    DOWNLOAD_REDIRECT_EXPIRES = 300  # Seconds a presigned URL stays valid
+    # ZIP downloads of several documents are streamed as they are built;
+    # types already compressed internally are stored rather than deflated
+    MAX_ARCHIVE_DOCUMENTS = int(os.environ.get('MAX_ARCHIVE_DOCUMENTS', 1000))
+    ARCHIVE_STORED_TYPES = {'pdf', 'docx'}
+    
+    # Cache configuration
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')  # 'memory', 'redis' (shared across workers) or ''
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))  # Seconds
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    # Extracted page text is cached separately, bounded by total size
+    PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    PREVIEW_CACHE_TTL = int(os.environ.get('PREVIEW_CACHE_TTL', 24 * 60 * 60))  # Content never changes
+    PREVIEW_MAX_PARAGRAPHS = 200  # DOCX paragraphs returned by one preview request
+    
+    # Metrics are served in Prometheus text format at /api/metrics
+    METRICS_ENABLED = _env_bool('METRICS_ENABLED', True)
+    # Directory where each process writes its metrics for the others to sum
+    # (the production server sets one up for its workers if unset)
+    METRICS_DIR = os.environ.get('METRICS_DIR') or None
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # Seconds
+    # Requests slower than this many seconds dump a cProfile to PROFILE_DIR
+    # (None disables profiling, which otherwise slows every request)
+    PROFILE_SLOW_REQUESTS = float(os.environ['PROFILE_SLOW_REQUESTS']) if os.environ.get('PROFILE_SLOW_REQUESTS') else None
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    
+    # Batch metadata lookups
+    MAX_METADATA_BATCH = 5000  # IDs accepted by one request
+    METADATA_BATCH_CHUNK_SIZE = 500  # IDs per IN query (below SQLite's bound-parameter limit)
+    
+    # Upload admission control, per process (None disables a limit); keep
+    # UPLOAD_MAX_CONCURRENT + UPLOAD_QUEUE_SIZE below SERVER_THREADS so
+    # downloads and metadata reads always find a free thread
+    UPLOAD_MAX_CONCURRENT = int(os.environ['UPLOAD_MAX_CONCURRENT']) if os.environ.get('UPLOAD_MAX_CONCURRENT') else None
+    UPLOAD_MAX_INFLIGHT_BYTES = int(os.environ['UPLOAD_MAX_INFLIGHT_BYTES']) if os.environ.get('UPLOAD_MAX_INFLIGHT_BYTES') else None
+    UPLOAD_QUEUE_SIZE = int(os.environ.get('UPLOAD_QUEUE_SIZE', 4))  # Uploads allowed to wait for a slot
+    UPLOAD_QUEUE_TIMEOUT = float(os.environ.get('UPLOAD_QUEUE_TIMEOUT', 10))  # Seconds before a waiting upload gets 503
+    
+    # Rows fetched per round trip when streaming an export
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
     
     # Pagination defaults
     DEFAULT_PAGE_SIZE = 10
-    MAX_PAGE_SIZE = 100
\ No newline at end of file
+    MAX_PAGE_SIZE = 100
+    
+    # Production server (python -m app.server)
+    SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', os.cpu_count() or 1))  # Processes
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))  # Request threads per process
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))  # Seconds to drain on stop/reload
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""Database engine configuration and group commit."""
+import queue
+import threading
+from concurrent.futures import Future
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from app import db
+
+def engine_options(config):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    SQLite keeps SQLAlchemy's default pool (pragmas are applied per
+    connection); server databases get a sized queue pool.
+    """
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'sqlite':
+        return options
+
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    options.setdefault('pool_pre_ping', True)
+    return options
+
+def install_sqlite_pragmas(engine, config):
+    """Apply WAL, busy timeout, synchronous and mmap pragmas to every new SQLite connection."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+class GroupCommitter:
+    """
+    Coalesce concurrent write units into shared transactions.
+
+    Request threads submit a callable that performs their inserts on
+    db.session. A single writer thread runs up to max_batch of them, each
+    inside a savepoint so one failure does not affect the others, and then
+    commits once. This turns N concurrent fsyncs into one.
+    """
+
+    def __init__(self, app, max_batch=64, max_delay=0.005):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, work):
+        """
+        Run work() in the next group transaction and wait for the commit.
+
+        The caller's session is closed first so its pooled connection is
+        free for the writer thread while the caller waits.
+
+        Returns:
+            The value returned by work().
+
+        Raises:
+            The exception raised by work() or by the commit.
+        """
+        db.session.close()
+        future = Future()
+        self._queue.put((work, future))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get(timeout=self.max_delay))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self.app.app_context():
+                    self._commit_batch(batch)
+            except Exception as e:
+                # Never leave a submitter waiting on a dead writer thread
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit_batch(self, batch):
+        if db.engine.dialect.name == 'sqlite':
+            # Take the write lock up front: a deferred transaction that reads
+            # before writing fails instantly if another writer commits meanwhile
+            db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+
+        results = []
+        for work, future in batch:
+            try:
+                with db.session.begin_nested():
+                    results.append((future, work(), None))
+            except Exception as e:
+                results.append((future, None, e))
+
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for future, _, _ in results:
+                future.set_exception(e)
+            return
+        finally:
+            db.session.remove()
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_committer_lock = threading.Lock()
+
+def get_group_committer(app):
+    """Return the app's group committer, starting it on first use, or None if disabled."""
+    if not app.config['DB_GROUP_COMMIT']:
+        return None
+    committer = app.extensions.get('group_committer')
+    if committer is None:
+        with _committer_lock:
+            committer = app.extensions.get('group_committer')
+            if committer is None:
+                committer = GroupCommitter(
+                    app,
+                    max_batch=app.config['DB_GROUP_COMMIT_MAX_BATCH'],
+                    max_delay=app.config['DB_GROUP_COMMIT_MAX_DELAY']
+                )
+                app.extensions['group_committer'] = committer
+    return committer
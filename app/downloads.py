@@ -0,0 +1,263 @@
+"""Helpers for serving stored documents over HTTP."""
+import mimetypes
+import os
+import uuid
+from flask import Response, current_app, redirect, request, send_file
+from werkzeug.http import dump_options_header, http_date, is_resource_modified, quote_etag
+from app.blobstore import get_backend
+from app.storage import CODEC_GZIP, decode_stream
+
+# Size of each read when streaming byte ranges
+READ_CHUNK_SIZE = 64 * 1024
+
+# Requests asking for more ranges than this are answered with the full file
+MAX_BYTE_RANGES = 32
+
+def _last_modified(document):
+    return document.upload_timestamp.replace(microsecond=0)
+
+def _sends_gzip(document):
+    """Whether the stored gzip bytes are sent as they are, which is never for a range request."""
+    return (document.storage_codec == CODEC_GZIP and request.accept_encodings['gzip'] > 0
+            and _resolve_ranges(document.file_size) is None)
+
+def _etag(document):
+    """Return the validator of the representation being sent; each coding needs its own."""
+    if _sends_gzip(document):
+        return f'{document.content_hash}-gzip'
+    return document.content_hash
+
+def _validator_headers(document):
+    return {
+        'ETag': quote_etag(_etag(document)),
+        'Last-Modified': http_date(_last_modified(document))
+    }
+
+def not_modified(document):
+    """
+    Check conditional request headers against a document's stored validators.
+
+    Only database state is consulted, so a cached copy can be revalidated
+    without touching the file.
+
+    Returns:
+        A 304 response, or None if the document must be sent.
+    """
+    if not document.content_hash:
+        return None
+    if is_resource_modified(request.environ, etag=_etag(document),
+                            last_modified=_last_modified(document)):
+        return None
+    return Response(status=304, headers=_validator_headers(document))
+
+def _if_range_matches(document):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        # Ranges are only served from the original bytes
+        return if_range.etag == document.content_hash
+    if if_range.date is not None:
+        return if_range.date.replace(tzinfo=None) >= _last_modified(document)
+    return True
+
+def _resolve_ranges(size):
+    """
+    Turn the Range header into absolute (start, stop) pairs for size bytes.
+
+    Returns:
+        None to send the whole file, or a list of ranges (empty if none
+        of them can be satisfied).
+    """
+    http_range = request.range
+    if http_range is None or http_range.units != 'bytes' or len(http_range.ranges) > MAX_BYTE_RANGES:
+        return None
+
+    resolved = []
+    for start, stop in http_range.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append((start, stop))
+    return resolved
+
+def _open_range(backend, key, start, stop, codec=None):
+    if codec is None:
+        return backend.open(key, start, stop)
+    # Seeking a gzip stream decompresses and discards up to start
+    f = decode_stream(backend.open(key), codec)
+    f.seek(start)
+    return f
+
+def _read_range(f, start, stop):
+    """Stream stop - start bytes from a file opened at start, closing it afterwards."""
+    with f:
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _stream_response(f, start, stop, **kwargs):
+    """Stream an opened file's range; the file is closed even if the body is never read."""
+    response = Response(_read_range(f, start, stop), **kwargs)
+    response.call_on_close(f.close)
+    return response
+
+def _multipart_ranges(first, backend, key, ranges, size, mimetype, boundary, codec=None):
+    # The first range is opened by the caller, so a missing file is still a 404
+    for index, (start, stop) in enumerate(ranges):
+        yield _part_header(boundary, mimetype, start, stop, size)
+        f = first if index == 0 else _open_range(backend, key, start, stop, codec)
+        yield from _read_range(f, start, stop)
+    yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+def _part_header(boundary, mimetype, start, stop, size):
+    return (
+        f'\r\n--{boundary}\r\n'
+        f'Content-Type: {mimetype}\r\n'
+        f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+    ).encode('ascii')
+
+def _offload_response(file_path, mimetype, headers):
+    """Hand the file to the reverse proxy instead of streaming it from Python."""
+    mode = current_app.config['DOWNLOAD_OFFLOAD']
+    if mode == 'x-accel-redirect':
+        prefix = current_app.config['DOWNLOAD_OFFLOAD_PREFIX'].rstrip('/')
+        relative_path = os.path.relpath(file_path, current_app.config['UPLOAD_FOLDER'])
+        headers['X-Accel-Redirect'] = f"{prefix}/{relative_path.replace(os.sep, '/')}"
+    elif mode == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(file_path)
+    else:
+        raise ValueError(f'Unknown DOWNLOAD_OFFLOAD mode: {mode}')
+    return Response(status=200, mimetype=mimetype, headers=headers)
+
+def _redirect_response(backend, document, mimetype):
+    """Send the client to a presigned backend URL, or return None if the backend has none."""
+    url = backend.presigned_url(document.filename, current_app.config['DOWNLOAD_REDIRECT_EXPIRES'],
+                                filename=document.original_filename, content_type=mimetype)
+    if url is None:
+        return None
+    response = redirect(url, code=302)
+    # The URL expires, so the redirect itself must not be cached
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def send_document(document):
+    """
+    Build the download response for a document.
+
+    Documents with a content hash get a strong ETag, byte-range support
+    (including multipart/byteranges) and optional offload: a redirect to a
+    presigned backend URL (DOWNLOAD_REDIRECT) or a reverse proxy header
+    (DOWNLOAD_OFFLOAD). Older rows without a hash are sent whole.
+
+    Compressed documents are sent as stored, with Content-Encoding and an
+    ETag of their own, to clients that accept gzip. Other clients, and range
+    requests (which address the original bytes), get a streaming
+    decompression instead.
+
+    Files are trusted to exist unless the reconciliation scan marked them
+    missing, so the backend is not asked first; opening the file is the
+    only check.
+
+    Raises:
+        FileNotFoundError: If the document's file is missing from the backend.
+    """
+    backend = get_backend()
+    key = document.filename
+    mimetype = mimetypes.guess_type(document.original_filename)[0] or 'application/octet-stream'
+
+    if document.file_missing_at is not None:
+        raise FileNotFoundError(key)
+
+    if not document.content_hash:
+        stat = backend.stat(key)
+        if stat is None:
+            raise FileNotFoundError(key)
+        local_path = backend.local_path(key)
+        if local_path is not None:
+            return send_file(local_path, as_attachment=True, download_name=document.original_filename)
+        headers = {
+            'Content-Disposition': dump_options_header('attachment', {'filename': document.original_filename}),
+            'Content-Length': str(stat.size)
+        }
+        return _stream_response(backend.open(key), 0, stat.size, mimetype=mimetype, headers=headers)
+
+    headers = _validator_headers(document)
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Content-Disposition'] = dump_options_header(
+        'attachment', {'filename': document.original_filename}
+    )
+
+    codec = document.storage_codec
+    size = document.file_size
+    ranges = None
+    if codec is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    if _sends_gzip(document):
+        # Send the stored bytes as they are
+        headers['Content-Encoding'] = 'gzip'
+        codec = None
+        size = document.stored_size
+    elif _if_range_matches(document):
+        ranges = _resolve_ranges(size)
+
+    # The object store serves the stored bytes without our encoding headers,
+    # so only uncompressed documents are redirected; the client resends Range
+    if document.storage_codec is None and current_app.config['DOWNLOAD_REDIRECT']:
+        response = _redirect_response(backend, document, mimetype)
+        if response is not None:
+            return response
+
+    local_path = backend.local_path(key, verify=False)
+
+    # A proxy sends the file without our Content-Encoding and ETag, so only
+    # uncompressed documents are offloaded; the rest stay in Python
+    if current_app.config['DOWNLOAD_OFFLOAD'] and document.storage_codec is None and local_path is not None:
+        # The proxy needs the file's actual place, which differs during a layout migration
+        local_path = backend.local_path(key)
+        if local_path is None:
+            raise FileNotFoundError(key)
+        return _offload_response(local_path, mimetype, headers)
+
+    if ranges is None:
+        if codec is None and local_path is not None:
+            try:
+                response = send_file(local_path, mimetype=mimetype, conditional=False)
+            except FileNotFoundError:
+                # Not yet moved out of the flat layout
+                local_path = backend.local_path(key)
+                if local_path is None:
+                    raise
+                response = send_file(local_path, mimetype=mimetype, conditional=False)
+            response.headers.update(headers)
+            return response
+        headers['Content-Length'] = str(size)
+        return _stream_response(_open_range(backend, key, 0, size, codec), 0, size,
+                                mimetype=mimetype, headers=headers)
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        return _stream_response(_open_range(backend, key, start, stop, codec), start, stop, status=206,
+                                mimetype=mimetype, headers=headers)
+
+    boundary = uuid.uuid4().hex
+    headers['Content-Length'] = str(
+        sum(len(_part_header(boundary, mimetype, start, stop, size)) + stop - start
+            for start, stop in ranges)
+        + len(f'\r\n--{boundary}--\r\n')
+    )
+    first = _open_range(backend, key, *ranges[0], codec)
+    response = Response(_multipart_ranges(first, backend, key, ranges, size, mimetype, boundary, codec), status=206,
+                        content_type=f'multipart/byteranges; boundary={boundary}', headers=headers)
+    response.call_on_close(first.close)
+    return response
@@ -0,0 +1,70 @@
+"""Streaming bulk export of document metadata."""
+import csv
+import io
+import json
+from sqlalchemy import tuple_
+from app import db
+from app.models import Document
+
+# Columns exported for each document, in CSV column order
+EXPORT_FIELDS = ('id', 'filename', 'original_filename', 'file_size', 'file_type',
+                 'content_hash', 'upload_timestamp')
+
+def export_query(since=None, since_id=None):
+    """
+    Build the export query, oldest first so a sync can resume from its last row.
+
+    Args:
+        since (datetime): Only export documents uploaded after this time
+        since_id (int): With ``since``, also export documents uploaded at
+            exactly ``since`` whose id is greater; alone, export ids above it
+
+    Returns:
+        Select over the plain export columns (no ORM objects are built).
+    """
+    columns = [getattr(Document, field) for field in EXPORT_FIELDS]
+    query = db.select(*columns).order_by(Document.upload_timestamp, Document.id)
+    if since is not None and since_id is not None:
+        query = query.where(tuple_(Document.upload_timestamp, Document.id) > tuple_(since, since_id))
+    elif since is not None:
+        query = query.where(Document.upload_timestamp > since)
+    elif since_id is not None:
+        query = query.where(Document.id > since_id)
+    return query
+
+def _row_dict(row):
+    data = row._asdict()
+    data['upload_timestamp'] = data['upload_timestamp'].isoformat()
+    return data
+
+def iter_export_batches(query, batch_size):
+    """
+    Yield lists of result rows, batch_size at a time.
+
+    yield_per streams rows from a server-side cursor where the driver
+    supports one, so memory stays flat regardless of table size.
+    """
+    result = db.session.execute(query, execution_options={'yield_per': batch_size})
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+def ndjson_chunks(batches):
+    """Encode each batch of rows as newline-delimited JSON."""
+    for rows in batches:
+        yield ''.join(json.dumps(_row_dict(row), separators=(',', ':')) + '\n' for row in rows)
+
+def csv_chunks(batches):
+    """Encode batches of rows as CSV, starting with a header line."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            data = _row_dict(row)
+            writer.writerow(data[field] for field in EXPORT_FIELDS)
+        yield buffer.getvalue()
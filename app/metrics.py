@@ -0,0 +1,407 @@
+"""Request, SQL and I/O metrics in Prometheus text format, plus slow-request profiling."""
+import atexit
+import cProfile
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Seconds; the Prometheus client's default buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value)
+                    for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, snapshot):
+        with self._lock:
+            for key, value in snapshot:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+class Gauge:
+    """Value that can go up and down, without labels."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+    def samples(self):
+        return [(self.name, '', self._value)]
+
+    def snapshot(self):
+        return self._value
+
+    def merge(self, snapshot):
+        self._value += snapshot
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(tuple(labels[name] for name in self.labels), ([0], 0.0))
+            return sum(counts)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.labels, key, [('le', _format_value(bound))])
+                    samples.append((f'{self.name}_bucket', labels, cumulative))
+                samples.append((f'{self.name}_sum', _format_labels(self.labels, key), total))
+                samples.append((f'{self.name}_count', _format_labels(self.labels, key), cumulative))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+
+    def merge(self, snapshot):
+        with self._lock:
+            for key, counts, total in snapshot:
+                if len(counts) != len(self.buckets):
+                    # Written by a release with other buckets
+                    continue
+                key = tuple(key)
+                merged, merged_total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+                self._values[key] = ([a + b for a, b in zip(merged, counts)], merged_total + total)
+
+class Metrics:
+    """The application's metric families."""
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            'docapi_http_request_duration_seconds', 'Time to produce a response, by route.',
+            labels=('method', 'route', 'status'))
+        self.request_queries = Histogram(
+            'docapi_http_request_sql_queries', 'SQL statements executed per request, by route.',
+            labels=('route',), buckets=QUERY_COUNT_BUCKETS)
+        self.request_sql_duration = Histogram(
+            'docapi_http_request_sql_duration_seconds', 'Time spent in SQL per request, by route.',
+            labels=('route',))
+        self.sql_statements = Counter(
+            'docapi_sql_statements_total', 'SQL statements executed, including background work.')
+        self.sql_duration = Counter(
+            'docapi_sql_duration_seconds_total', 'Time spent executing SQL statements.')
+        self.bytes_received = Counter(
+            'docapi_http_request_bytes_total', 'Request body bytes received, by route.',
+            labels=('route',))
+        self.bytes_sent = Counter(
+            'docapi_http_response_bytes_total', 'Response body bytes sent, by route.',
+            labels=('route',))
+        self.file_save_duration = Histogram(
+            'docapi_file_save_duration_seconds',
+            'Time spent hashing, writing and storing uploaded file content, excluding network waits.')
+        self.profiles_written = Counter(
+            'docapi_profiles_written_total', 'cProfile dumps written for slow requests.')
+        self.uploads_active = Gauge(
+            'docapi_uploads_active', 'Uploads admitted and in progress.')
+        self.uploads_active_bytes = Gauge(
+            'docapi_uploads_active_bytes', 'Declared bytes of the uploads in progress.')
+        self.uploads_queued = Gauge(
+            'docapi_uploads_queued', 'Uploads waiting for admission.')
+        self.uploads_rejected = Counter(
+            'docapi_uploads_rejected_total', 'Uploads refused by admission control, by reason.',
+            labels=('reason',))
+        self.upload_admission_wait = Histogram(
+            'docapi_upload_admission_wait_seconds', 'Time uploads waited for admission.')
+
+    def families(self):
+        return [value for value in vars(self).values() if isinstance(value, (Counter, Gauge, Histogram))]
+
+    def snapshot(self):
+        """Return every metric's values as JSON-serializable data."""
+        return {family.name: family.snapshot() for family in self.families()}
+
+    def merge(self, snapshot, gauges=True):
+        """Add the values of a snapshot to these metrics, skipping gauges unless gauges is True."""
+        for family in self.families():
+            if family.name in snapshot and (gauges or family.kind != 'gauge'):
+                family.merge(snapshot[family.name])
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for family in self.families():
+            lines.append(f'# HELP {family.name} {family.documentation}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            for name, labels, value in family.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics-{pid}.json')
+
+def write_snapshot(metrics, directory):
+    """Write this process's metrics to directory, replacing its previous snapshot."""
+    path = _snapshot_path(directory, os.getpid())
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(metrics.snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def aggregate(metrics, directory):
+    """
+    Combine this process's metrics with the snapshots the other processes wrote to directory.
+
+    Counters and histograms of processes that have exited are kept, so
+    totals never go backwards across a reload; their gauges, which
+    describe load that ended with them, are dropped.
+
+    Returns:
+        A new Metrics instance holding the sums.
+    """
+    combined = Metrics()
+    combined.merge(metrics.snapshot())
+    for name in os.listdir(directory):
+        match = re.fullmatch(r'metrics-(\d+)\.json', name)
+        if match is None or int(match.group(1)) == os.getpid():
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        combined.merge(snapshot, gauges=_process_alive(int(match.group(1))))
+    return combined
+
+def _start_snapshot_writer(metrics, directory, interval):
+    """Write this process's snapshot every interval seconds and once more at exit."""
+    os.makedirs(directory, exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(metrics, directory)
+            except OSError:
+                logger.exception('Failed to write metrics snapshot')
+
+    threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+    atexit.register(write_snapshot, metrics, directory)
+
+def get_metrics():
+    """Return the current application's metrics, or None if disabled."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('metrics')
+
+@contextmanager
+def timed(histogram_name, already_spent=0.0):
+    """
+    Observe the duration of a block in the named histogram, if metrics are enabled.
+
+    Args:
+        histogram_name (str): Attribute of the Metrics instance
+        already_spent (float): Seconds of the same work done before the block, added to its duration
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = get_metrics()
+        if metrics is not None:
+            getattr(metrics, histogram_name).observe(already_spent + time.perf_counter() - started)
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _counting_iterable(iterable, metrics, route):
+    sent = 0
+    try:
+        for chunk in iterable:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.bytes_sent.inc(sent, route=route)
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+def install_query_hooks(engine, metrics):
+    """Count SQL statements and their time, globally and for the current request."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append((cursor, time.perf_counter()))
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()[1]
+        metrics.sql_statements.inc()
+        metrics.sql_duration.inc(elapsed)
+        if has_request_context() and 'request_started' in g:
+            g.sql_queries = g.get('sql_queries', 0) + 1
+            g.sql_time = g.get('sql_time', 0.0) + elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # A failed statement gets no after_cursor_execute; drop its start time
+        if context.connection is None or context.execution_context is None:
+            return
+        started = context.connection.info.get('query_start')
+        if started and started[-1][0] is context.execution_context.cursor:
+            started.pop()
+
+def _safe_name(value):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', value).strip('_') or 'root'
+
+def _dump_profile(profiler, route, elapsed):
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    filename = (f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{request.method}-"
+                f"{_safe_name(route)}-{int(elapsed * 1000)}ms.prof")
+    profiler.dump_stats(os.path.join(directory, filename))
+
+def init_metrics(app):
+    """
+    Record per-request metrics and, if PROFILE_SLOW_REQUESTS is set, profile slow requests.
+
+    Metrics are kept per process. With METRICS_DIR set, each process also
+    writes them there every METRICS_FLUSH_INTERVAL seconds, so whichever
+    worker is scraped can report the totals of all of them.
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    from app import db
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+    with app.app_context():
+        install_query_hooks(db.engine, metrics)
+    if app.config['METRICS_DIR']:
+        _start_snapshot_writer(metrics, app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_time = 0.0
+        if app.config['PROFILE_SLOW_REQUESTS'] is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:
+                # Another profiler is already active in this thread
+                pass
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        route = _route()
+
+        metrics.request_duration.observe(elapsed, method=request.method, route=route,
+                                         status=str(response.status_code))
+        metrics.request_queries.observe(g.sql_queries, route=route)
+        metrics.request_sql_duration.observe(g.sql_time, route=route)
+        if request.content_length:
+            metrics.bytes_received.inc(request.content_length, route=route)
+        if request.method != 'HEAD':
+            if response.content_length is not None:
+                metrics.bytes_sent.inc(response.content_length, route=route)
+            elif response.is_streamed:
+                # Generated bodies are counted as the server sends them
+                response.response = _counting_iterable(response.response, metrics, route)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= app.config['PROFILE_SLOW_REQUESTS']:
+                try:
+                    _dump_profile(profiler, route, elapsed)
+                    metrics.profiles_written.inc()
+                except OSError:
+                    app.logger.exception('Failed to write request profile')
+        return response
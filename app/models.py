@@ -6,13 +6,56 @@ class Document(db.Model):
     """Document model for storing file metadata."""
     
     __tablename__ = 'documents'
+    __table_args__ = (
+        # Backs keyset pagination, which seeks on (upload_timestamp, id)
+        db.Index('ix_documents_upload_timestamp_id', 'upload_timestamp', 'id'),
+        # Listing filters: type (then date order), size ranges and filename prefixes
+        db.Index('ix_documents_file_type_upload_timestamp_id', 'file_type', 'upload_timestamp', 'id'),
+        db.Index('ix_documents_file_size_id', 'file_size', 'id'),
+        db.Index('ix_documents_original_filename_id', 'original_filename', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(255), nullable=False, unique=True)
+    filename = db.Column(db.String(255), nullable=False, index=True)  # Stored (blob) filename
     original_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)  # Size in bytes
     file_type = db.Column(db.String(10), nullable=False)  # pdf, txt, docx
+    content_hash = db.Column(db.String(64), db.ForeignKey('blobs.content_hash'), nullable=True, index=True)  # SHA-256 hex digest
     upload_timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Copied from the blob so downloads need no join; NULL codec means stored as uploaded
+    storage_codec = db.Column(db.String(16), nullable=True)
+    stored_size = db.Column(db.Integer, nullable=True)  # Bytes on disk
+    page_count = db.Column(db.Integer, nullable=True)  # PDF pages or DOCX paragraphs; NULL for other types
+    # Set by the reconciliation scan when the stored file is gone, so downloads need not check
+    file_missing_at = db.Column(db.DateTime, nullable=True)
+    
+    blob = db.relationship('Blob')
+    
+    # Keys of to_dict(), in order; also the fields a projection may request
+    FIELDS = ('id', 'filename', 'original_filename', 'file_size', 'file_type', 'content_hash',
+              'storage_codec', 'stored_size', 'page_count', 'upload_timestamp')
+    
+    @classmethod
+    def columns_for(cls, fields):
+        """Return the columns needed to serialize the given fields (always including id)."""
+        names = set(fields) | {'id'}
+        if 'stored_size' in names:
+            names.add('file_size')
+        return [getattr(cls, name) for name in cls.FIELDS if name in names]
+    
+    @staticmethod
+    def row_to_dict(row, fields):
+        """
+        Build the to_dict() fields named in fields from a row selected with columns_for().
+        
+        upload_timestamp stays a datetime; the app's JSON provider encodes
+        it in the same ISO 8601 form as to_dict().
+        """
+        values = row._mapping
+        data = {field: values[field] for field in fields}
+        if data.get('stored_size', 0) is None:
+            data['stored_size'] = values['file_size']
+        return data
     
     def to_dict(self):
         """Convert document to dictionary."""
@@ -22,8 +65,107 @@ class Document(db.Model):
             'original_filename': self.original_filename,
             'file_size': self.file_size,
             'file_type': self.file_type,
+            'content_hash': self.content_hash,
+            'storage_codec': self.storage_codec,
+            'stored_size': self.stored_size if self.stored_size is not None else self.file_size,
+            'page_count': self.page_count,
             'upload_timestamp': self.upload_timestamp.isoformat()
         }
     
     def __repr__(self):
-        return f'<Document {self.original_filename}>'
\ No newline at end of file
+        return f'<Document {self.original_filename}>'
+
+class Blob(db.Model):
+    """Content-addressed file shared by every document with the same bytes."""
+    
+    __tablename__ = 'blobs'
+    
+    content_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 hex digest
+    filename = db.Column(db.String(255), nullable=False, unique=True)
+    size = db.Column(db.Integer, nullable=False)  # Size in bytes
+    codec = db.Column(db.String(16), nullable=True)  # e.g. 'gzip'; NULL means stored as uploaded
+    stored_size = db.Column(db.Integer, nullable=True)  # Bytes on disk
+    page_count = db.Column(db.Integer, nullable=True)  # Counted once when the content is stored
+    ref_count = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    missing_at = db.Column(db.DateTime, nullable=True)  # When the reconciliation scan found the file gone
+    
+    def storage_info(self):
+        """Describe how much disk space deduplication and compression save for this blob."""
+        stored_size = self.stored_size if self.stored_size is not None else self.size
+        return {
+            'deduplicated': self.ref_count > 1,
+            'references': self.ref_count,
+            'bytes_saved': self.size * (self.ref_count - 1),
+            'codec': self.codec,
+            'stored_size': stored_size,
+            'compression_saved': self.size - stored_size
+        }
+    
+    def __repr__(self):
+        return f'<Blob {self.content_hash[:12]} refs={self.ref_count}>'
+
+class DocumentStats(db.Model):
+    """Running document count and byte total per file type, kept in step with inserts."""
+    
+    __tablename__ = 'document_stats'
+    
+    file_type = db.Column(db.String(10), primary_key=True)
+    document_count = db.Column(db.BigInteger, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DocumentStats {self.file_type} {self.document_count}>'
+
+class UploadSession(db.Model):
+    """In-progress resumable upload whose bytes are appended in chunks."""
+    
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(32), primary_key=True)  # Random hex token
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(10), nullable=False)
+    upload_length = db.Column(db.BigInteger, nullable=False)  # Declared total size in bytes
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def to_dict(self, offset):
+        """Convert session to dictionary, given the bytes received so far."""
+        return {
+            'id': self.id,
+            'original_filename': self.original_filename,
+            'upload_length': self.upload_length,
+            'upload_offset': offset,
+            'expires_at': self.expires_at.isoformat()
+        }
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.original_filename}>'
+
+class SchemaVersion(db.Model):
+    """Single row recording which schema version the database was set up for."""
+    
+    __tablename__ = 'schema_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
+
+class ReconcileState(db.Model):
+    """Single row checkpointing the storage reconciliation scan, so it resumes where it stopped."""
+    
+    __tablename__ = 'reconcile_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    phase = db.Column(db.String(16), nullable=False, default='files')  # 'files', then 'legacy'
+    cursor = db.Column(db.String(255), nullable=True)  # Last stored key listed
+    hash_cursor = db.Column(db.String(64), nullable=True)  # Last blob hash compared with the listing
+    document_cursor = db.Column(db.Integer, nullable=True)  # Last unhashed document checked
+    pass_started_at = db.Column(db.DateTime, nullable=True)
+    passes_completed = db.Column(db.Integer, nullable=False, default=0)
+    last_completed_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<ReconcileState {self.phase} {self.cursor}>'
@@ -0,0 +1,101 @@
+"""Page-level text previews of PDF and DOCX documents."""
+import zipfile
+from contextlib import closing
+from xml.etree import ElementTree
+
+# WordprocessingML element names
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_BODY, _PARAGRAPH, _TEXT, _TAB = f'{_W}body', f'{_W}p', f'{_W}t', f'{_W}tab'
+_BREAKS = {f'{_W}br', f'{_W}cr'}
+
+def _paragraph_text(element):
+    parts = []
+    for node in element.iter():
+        if node.tag == _TEXT:
+            parts.append(node.text or '')
+        elif node.tag == _TAB:
+            parts.append('\t')
+        elif node.tag in _BREAKS:
+            parts.append('\n')
+    return ''.join(parts)
+
+def iter_docx_paragraphs(f):
+    """
+    Yield the text of a DOCX file's body paragraphs, in order.
+
+    word/document.xml is parsed incrementally and each paragraph is freed
+    once read, so stopping early skips the rest of the file. Paragraphs
+    inside tables are not counted, matching python-docx's
+    ``Document.paragraphs``.
+
+    Args:
+        f: Seekable binary file holding the DOCX package
+    """
+    with zipfile.ZipFile(f) as package, package.open('word/document.xml') as xml:
+        parents = []
+        for event, element in ElementTree.iterparse(xml, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if parents and parents[-1].tag == _BODY:
+                if element.tag == _PARAGRAPH:
+                    yield _paragraph_text(element)
+                parents[-1].remove(element)
+
+def count_pages(f, file_type):
+    """
+    Count the preview units of a document: PDF pages or DOCX paragraphs.
+
+    A PDF's count is read from its page tree without parsing any page.
+
+    Args:
+        f: Seekable binary file with the document's original bytes
+        file_type (str): pdf, docx or another type
+
+    Returns:
+        The count, or None for types without previews.
+    """
+    if file_type == 'pdf':
+        from PyPDF2 import PdfReader
+        return len(PdfReader(f).pages)
+    if file_type == 'docx':
+        return sum(1 for _ in iter_docx_paragraphs(f))
+    return None
+
+def pdf_page_text(f, number):
+    """
+    Extract the text of one PDF page, without touching the others.
+
+    Args:
+        f: Seekable binary file with the PDF
+        number (int): 1-based page number
+
+    Returns:
+        Tuple of (text, page count).
+
+    Raises:
+        IndexError: If the page does not exist.
+    """
+    from PyPDF2 import PdfReader
+    reader = PdfReader(f)
+    page_count = len(reader.pages)
+    if not 1 <= number <= page_count:
+        raise IndexError(number)
+    return reader.pages[number - 1].extract_text() or '', page_count
+
+def docx_paragraphs(f, start, end):
+    """
+    Return the text of DOCX paragraphs start..end (1-based, inclusive).
+
+    Parsing stops after paragraph ``end``. The list is shorter than
+    requested if the document ends first.
+    """
+    paragraphs = []
+    with closing(iter_docx_paragraphs(f)) as texts:
+        for number, text in enumerate(texts, start=1):
+            if number >= start:
+                paragraphs.append(text)
+            if number >= end:
+                break
+    return paragraphs
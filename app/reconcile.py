@@ -0,0 +1,246 @@
+"""Background reconciliation of the storage backend against the database."""
+import logging
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+from flask import current_app
+from app import db
+from app.blobstore import get_backend
+from app.models import Blob, Document, ReconcileState
+
+logger = logging.getLogger(__name__)
+
+# Keys of content-addressed blobs (SHA-256 hex digests); other keys are legacy files
+_HASH_KEY = re.compile(r'[0-9a-f]{64}')
+
+# Temp files uploads stream into (see IngestFile); they outlive only a crashed upload
+_TEMP_UPLOAD = re.compile(r'\.upload-[0-9a-f]{32}\.part')
+
+def _load_state():
+    state = db.session.get(ReconcileState, 1)
+    if state is None:
+        state = ReconcileState(id=1, phase='files', passes_completed=0)
+        db.session.add(state)
+    if state.pass_started_at is None:
+        state.pass_started_at = datetime.utcnow()
+    return state
+
+def _set_missing(content_hashes, missing_at):
+    """Mark blobs, and the documents sharing them, as missing (or present again with None)."""
+    db.session.execute(db.update(Blob).where(Blob.content_hash.in_(content_hashes)).values(missing_at=missing_at))
+    db.session.execute(db.update(Document).where(Document.content_hash.in_(content_hashes))
+                       .values(file_missing_at=missing_at))
+
+def _scan_files(state, backend, batch_size, counts):
+    """
+    Compare the next batch of stored keys with the blobs table.
+
+    The listing and the blob hashes are both walked in ascending order, so
+    every blob between the last hash compared and the last one listed must
+    have been in the listing; those that were not are missing. Blobs
+    created after the listing started are left for the next pass, as their
+    files may not have been listed yet.
+
+    Returns:
+        Tuple of (phase finished, keys no row refers to).
+    """
+    listed_at = datetime.utcnow()
+    keys = list(islice(backend.iter_keys(state.cursor or ''), batch_size))
+    exhausted = len(keys) < batch_size
+    hashes = [key for key in keys if _HASH_KEY.fullmatch(key)]
+
+    rows = []
+    if hashes or exhausted:
+        query = db.select(Blob.content_hash, Blob.created_at, Blob.missing_at).where(
+            Blob.content_hash > (state.hash_cursor or ''))
+        if not exhausted:
+            query = query.where(Blob.content_hash <= hashes[-1])
+        rows = db.session.execute(query.order_by(Blob.content_hash).limit(batch_size)).all()
+
+    if len(rows) == batch_size:
+        # More unlisted blobs than fit in a batch: stop this one at the last compared
+        bound = rows[-1].content_hash
+        keys = [key for key in keys if key <= bound]
+        hashes = [key for key in hashes if key <= bound]
+        state.cursor = max(state.cursor or '', bound)
+        state.hash_cursor = bound
+        exhausted = False
+    else:
+        if keys:
+            state.cursor = keys[-1]
+        if hashes:
+            state.hash_cursor = hashes[-1]
+
+    blobs = {row.content_hash: row for row in rows}
+    listed = set(hashes)
+    missing = [row.content_hash for row in rows
+               if row.content_hash not in listed and row.missing_at is None and row.created_at < listed_at]
+    restored = [key for key in hashes if key in blobs and blobs[key].missing_at is not None]
+    for content_hash in missing:
+        logger.warning('Stored file of blob %s is missing', content_hash)
+    if missing:
+        _set_missing(missing, listed_at)
+    if restored:
+        _set_missing(restored, None)
+
+    unknown = [key for key in keys if key not in blobs]
+    referenced = set(db.session.execute(
+        db.select(Document.filename).where(Document.filename.in_(unknown))
+    ).scalars()) if unknown else set()
+
+    counts.update(files=len(keys), missing=len(missing), restored=len(restored))
+    return exhausted, [key for key in unknown if key not in referenced]
+
+def _scan_legacy(state, backend, batch_size, counts):
+    """
+    Check the files of documents stored before content hashing, in id order.
+
+    They are few and absent from the blobs table, so each is looked up
+    in the backend directly.
+
+    Returns:
+        True once every such document has been checked.
+    """
+    rows = db.session.execute(
+        db.select(Document.id, Document.filename, Document.file_missing_at)
+        .where(Document.content_hash.is_(None), Document.id > (state.document_cursor or 0))
+        .order_by(Document.id).limit(batch_size)
+    ).all()
+    now = datetime.utcnow()
+    for row in rows:
+        exists = backend.exists(row.filename)
+        if exists == (row.file_missing_at is None):
+            continue
+        if not exists:
+            logger.warning('Stored file of document %d is missing', row.id)
+        db.session.execute(db.update(Document).where(Document.id == row.id)
+                           .values(file_missing_at=None if exists else now))
+        counts['restored' if exists else 'missing'] += 1
+    if rows:
+        state.document_cursor = rows[-1].id
+    counts['documents'] += len(rows)
+    return len(rows) < batch_size
+
+def _quarantine_orphan(backend, key, orphan_grace):
+    """Move an unreferenced file aside once it is older than any upload still registering it."""
+    stat = backend.stat(key)
+    if stat is None or stat.modified is None or time.time() - stat.modified < orphan_grace:
+        return False
+    # An upload of the same content may have registered it since the batch was read
+    if db.session.execute(db.select(Document.id).where(Document.filename == key).limit(1)).first():
+        return False
+    if db.session.get(Blob, key) is not None:
+        return False
+    if not backend.quarantine(key):
+        return False
+    logger.info('Quarantined unreferenced stored file %s', key)
+    return True
+
+def _remove_stale_temp_files(orphan_grace):
+    """
+    Delete upload temp files left behind by a crash, once older than any upload still writing.
+
+    They live in the local upload folder whatever the storage backend, and
+    are never listed as stored keys.
+
+    Returns:
+        Number of files removed.
+    """
+    cutoff = time.time() - orphan_grace
+    removed = 0
+    try:
+        entries = list(os.scandir(current_app.config['UPLOAD_FOLDER']))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not _TEMP_UPLOAD.fullmatch(entry.name):
+            continue
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            os.remove(entry.path)
+        except FileNotFoundError:
+            # The upload finished meanwhile
+            continue
+        logger.info('Removed stale upload temp file %s', entry.name)
+        removed += 1
+    return removed
+
+def reconcile_batch(batch_size=None, orphan_grace=None):
+    """
+    Run one batch of the reconciliation scan and checkpoint its progress.
+
+    A pass lists every stored key, marking blobs whose file is gone as
+    missing (and clearing the mark when a file reappears) and moving
+    files no document refers to into the quarantine; it then checks the
+    documents stored before content hashing, and finally deletes upload
+    temp files left by crashes. The checkpoint is committed
+    after every batch, so the scan can be stopped at any time and resumes
+    where it left off.
+
+    Args:
+        batch_size (int): Keys listed (or rows checked) per batch; defaults to RECONCILE_BATCH_SIZE
+        orphan_grace (int): Seconds an unreferenced file is left alone; defaults to RECONCILE_ORPHAN_GRACE
+
+    Returns:
+        Tuple of (Counter of files, documents, missing, restored,
+        quarantined and temp_removed, whether this batch completed the pass).
+    """
+    config = current_app.config
+    batch_size = batch_size or config['RECONCILE_BATCH_SIZE']
+    orphan_grace = config['RECONCILE_ORPHAN_GRACE'] if orphan_grace is None else orphan_grace
+    backend = get_backend()
+    counts = Counter()
+    orphans = []
+    completed = False
+
+    state = _load_state()
+    if state.phase == 'files':
+        finished, orphans = _scan_files(state, backend, batch_size, counts)
+        if finished:
+            state.phase = 'legacy'
+    elif _scan_legacy(state, backend, batch_size, counts):
+        state.phase = 'files'
+        state.cursor = state.hash_cursor = state.document_cursor = None
+        state.pass_started_at = None
+        state.passes_completed += 1
+        state.last_completed_at = datetime.utcnow()
+        completed = True
+    db.session.commit()
+
+    # Checked afresh, after the commit, against rows written meanwhile
+    for key in orphans:
+        if _quarantine_orphan(backend, key, orphan_grace):
+            counts['quarantined'] += 1
+    db.session.commit()
+
+    if completed:
+        counts['temp_removed'] = _remove_stale_temp_files(orphan_grace)
+    return counts, completed
+
+def reconcile(batch_size=None, pause=0.0, orphan_grace=None, progress=None):
+    """
+    Run reconciliation batches until the current pass completes.
+
+    Args:
+        batch_size (int): Keys listed (or rows checked) per batch
+        pause (float): Seconds to sleep between batches to limit I/O load
+        orphan_grace (int): Seconds an unreferenced file is left alone
+        progress: Optional callable receiving the running totals after each batch
+
+    Returns:
+        Counter of files, documents, missing, restored, quarantined and temp_removed.
+    """
+    totals = Counter()
+    while True:
+        counts, completed = reconcile_batch(batch_size, orphan_grace)
+        totals.update(counts)
+        if progress is not None:
+            progress(totals)
+        if completed:
+            return totals
+        if pause:
+            time.sleep(pause)
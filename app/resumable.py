@@ -0,0 +1,146 @@
+"""Resumable (tus-style) chunked uploads."""
+import fcntl
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import UploadSession
+
+# Partial uploads live beside the blob store so finalizing is a rename
+SESSION_DIR = '.resumable'
+
+class UploadConflict(Exception):
+    """Raised when a chunk does not start at the current offset or another chunk is in flight."""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+def session_path(session_id):
+    """Return the path of a session's partial file."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], SESSION_DIR, f'{session_id}.part')
+
+def current_offset(session):
+    """Return how many bytes of a session have been received."""
+    try:
+        return os.path.getsize(session_path(session.id))
+    except FileNotFoundError:
+        return 0
+
+def _expiry():
+    return datetime.utcnow() + timedelta(seconds=current_app.config['RESUMABLE_SESSION_TTL'])
+
+def create_session(original_filename, file_type, upload_length):
+    """Start a resumable upload, sweeping a few expired sessions first."""
+    expire_sessions(limit=100)
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        original_filename=original_filename,
+        file_type=file_type,
+        upload_length=upload_length,
+        expires_at=_expiry()
+    )
+    path = session_path(session.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'xb').close()
+
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+def get_active_session(session_id):
+    """Return a session that has not expired, or None."""
+    session = db.session.get(UploadSession, session_id)
+    if session is None or session.expires_at < datetime.utcnow():
+        return None
+    return session
+
+@contextmanager
+def locked_part_file(session, mode='ab'):
+    """
+    Open a session's partial file holding its exclusive per-session lock.
+
+    Raises:
+        UploadConflict: If another request holds the lock.
+    """
+    with open(session_path(session.id), mode) as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict('Another request is writing to this upload', current_offset(session))
+        yield f
+
+def append_chunk(session, offset, stream):
+    """
+    Append a request body to a session at the given offset.
+
+    The body is copied in RESUMABLE_CHUNK_SIZE reads and never held in
+    memory. Bytes written before a dropped connection are kept, so the
+    client can resume from the new offset.
+
+    Returns:
+        The new offset.
+
+    Raises:
+        UploadConflict: If offset is not the current end of the file or
+            another request is appending to the same session.
+        ValueError: If the body would exceed the declared upload length.
+    """
+    chunk_size = current_app.config['RESUMABLE_CHUNK_SIZE']
+    with locked_part_file(session) as f:
+        position = f.seek(0, os.SEEK_END)
+        if position != offset:
+            raise UploadConflict('Upload-Offset does not match the current offset', position)
+
+        remaining = session.upload_length - position
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                if len(chunk) > remaining:
+                    f.write(chunk[:remaining])
+                    raise ValueError('Chunk exceeds the declared Upload-Length')
+                f.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            f.flush()
+            os.fsync(f.fileno())
+            position = f.tell()
+
+    session.expires_at = _expiry()
+    db.session.commit()
+    return position
+
+def discard_session(session):
+    """Delete a session and its partial file."""
+    try:
+        os.remove(session_path(session.id))
+    except FileNotFoundError:
+        pass
+    db.session.delete(session)
+    db.session.commit()
+
+def expire_sessions(limit=None):
+    """
+    Remove sessions past their expiry time.
+
+    Args:
+        limit (int): Maximum sessions to remove (all if None)
+
+    Returns:
+        Number of sessions removed.
+    """
+    query = db.select(UploadSession).where(UploadSession.expires_at < datetime.utcnow())
+    if limit is not None:
+        query = query.limit(limit)
+
+    expired = db.session.execute(query).scalars().all()
+    for session in expired:
+        try:
+            os.remove(session_path(session.id))
+        except FileNotFoundError:
+            pass
+        db.session.delete(session)
+    db.session.commit()
+    return len(expired)
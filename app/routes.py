@@ -1,14 +1,88 @@
 """API routes."""
-from flask import Blueprint, request, jsonify, send_file, current_app
-from werkzeug.utils import secure_filename
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from werkzeug.http import dump_options_header
 from app import db
-from app.models import Document
-from app.utils import allowed_file, generate_unique_filename, get_file_size, validate_pagination_params, sanitize_filename
+from app.models import Blob, Document, UploadSession
+from app.storage import prepare_blob, prepare_blob_from_path, register_blob, store_blobs
+from app.storage import ingest_elapsed, open_stored
+from app.blobstore import get_backend
+from app.resumable import UploadConflict, create_session, get_active_session, append_chunk
+from app.resumable import current_offset, discard_session, locked_part_file, session_path
+from app.database import get_group_committer
+from app.downloads import not_modified, send_document
+from app.export import export_query, iter_export_batches, ndjson_chunks, csv_chunks
+from app.archive import ARCHIVE_COLUMNS, archive_entries, archive_filename, stream_archive
+from app.search import index_blob, search_available, search_documents
+from app.metrics import aggregate, get_metrics, timed
+from app.admission import admit_upload, get_admission
+from app.stats import get_stats
+from app.cache import get_cache, get_preview_cache, document_key, blob_key, list_key, preview_key
+from app.preview import docx_paragraphs, pdf_page_text
+from app.utils import allowed_file, validate_pagination_params, safe_original_filename
+from app.utils import validate_limit, encode_cursor, decode_cursor, parse_utc_datetime
+from sqlalchemy import func, tuple_
+from urllib.parse import urlencode
+import base64
+import binascii
 import os
+import sys
 
 api_bp = Blueprint('api', __name__)
 
+def _record_document(stored, safe_original, file_type, session_id=None):
+    """
+    Register stored content and insert its Document row, then index new text.
+    
+    Uses the group committer when DB_GROUP_COMMIT is enabled. When
+    session_id is given, that resumable upload session is deleted in the
+    same transaction, so it survives any failure to record the document.
+    
+    Returns:
+        Tuple of (document dict, storage info dict).
+    """
+    def record():
+        blob, created = register_blob(stored)
+        
+        # Create database record
+        document = Document(
+            filename=blob.filename,
+            original_filename=safe_original,
+            file_size=blob.size,
+            file_type=file_type,
+            content_hash=blob.content_hash,
+            storage_codec=blob.codec,
+            stored_size=blob.stored_size,
+            page_count=blob.page_count
+        )
+        db.session.add(document)
+        db.session.flush()
+        
+        if session_id is not None:
+            deleted = db.session.execute(db.delete(UploadSession).where(UploadSession.id == session_id))
+            if deleted.rowcount != 1:
+                raise RuntimeError('Upload session was already completed')
+        return document.to_dict(), blob.storage_info(), created
+    
+    committer = get_group_committer(current_app._get_current_object())
+    if committer is not None:
+        document_data, storage, created = committer.submit(record)
+    else:
+        document_data, storage, created = record()
+        db.session.commit()
+    
+    # Index the text of new content; duplicates are already indexed
+    if created:
+        try:
+            index_blob(db.session.get(Blob, stored.content_hash), file_type)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Failed to index document %s', document_data['id'])
+    
+    return document_data, storage
+
 @api_bp.route('/documents', methods=['POST'])
+@admit_upload
 def upload_document():
     """
     Upload a document.
@@ -32,99 +106,766 @@ def upload_document():
             'error': 'Invalid file type. Allowed types: PDF, TXT, DOCX'
         }), 400
     
-    file_path = None
     try:
         # Sanitize and secure the original filename
         original_filename = file.filename
-        safe_original = secure_filename(sanitize_filename(original_filename))
+        safe_original = safe_original_filename(original_filename)
+        file_type = original_filename.rsplit('.', 1)[1].lower()
         
-        # If sanitization results in empty or just extension, use a default
-        if not safe_original or safe_original.startswith('.'):
-            ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'txt'
-            safe_original = f'document.{ext}'
+        # Write new content under its hash; duplicates reuse the existing blob.
+        # Hashing and writing mostly happened while the body streamed in.
+        with timed('file_save_duration', already_spent=ingest_elapsed(file)):
+            stored = prepare_blob(file, file_type)
         
-        # Generate unique filename for storage
-        unique_filename = generate_unique_filename(original_filename)
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+        document_data, storage = _record_document(stored, safe_original, file_type)
         
-        # Save file
-        file.save(file_path)
+        return jsonify({
+            'message': 'Document uploaded successfully',
+            'document': document_data,
+            'storage': storage
+        }), 201
         
-        # Get file metadata
-        file_size = get_file_size(file_path)
-        file_type = original_filename.rsplit('.', 1)[1].lower()
+    except Exception as e:
+        # A blob file this upload wrote is left for the reconciliation scan:
+        # a concurrent upload of the same content may be about to register it
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@api_bp.route('/documents/batch', methods=['POST'])
+@admit_upload
+def upload_documents_batch():
+    """
+    Upload many documents in one request.
+    
+    Every part named ``files`` is validated and stored independently, then
+    all Document rows are inserted in a single transaction. Invalid files
+    are reported without failing the rest of the batch.
+    
+    Returns:
+        JSON response with a result per file, in request order.
+    """
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    if len(files) > current_app.config['MAX_BATCH_FILES']:
+        return jsonify({
+            'error': f"Too many files. Maximum per batch: {current_app.config['MAX_BATCH_FILES']}"
+        }), 400
+    
+    results = [{'index': index, 'original_filename': file.filename} for index, file in enumerate(files)]
+    accepted = []
+    for index, file in enumerate(files):
+        if file.filename == '':
+            results[index].update(status=400, error='No file selected')
+        elif not allowed_file(file.filename):
+            results[index].update(status=400, error='Invalid file type. Allowed types: PDF, TXT, DOCX')
+        else:
+            accepted.append(index)
+    
+    new_blobs = []
+    try:
+        stored = store_blobs([files[index] for index in accepted],
+                             max_workers=current_app.config['BATCH_WRITE_WORKERS'])
         
-        # Create database record
-        document = Document(
-            filename=unique_filename,
-            original_filename=safe_original,
-            file_size=file_size,
-            file_type=file_type
-        )
+        documents = {}
+        for index, outcome in zip(accepted, stored):
+            if isinstance(outcome, Exception):
+                results[index].update(status=500, error=f'Upload failed: {str(outcome)}')
+                continue
+            blob, created = outcome
+            if created:
+                new_blobs.append((blob, files[index].filename.rsplit('.', 1)[1].lower()))
+            documents[index] = Document(
+                filename=blob.filename,
+                original_filename=safe_original_filename(files[index].filename),
+                file_size=blob.size,
+                file_type=files[index].filename.rsplit('.', 1)[1].lower(),
+                content_hash=blob.content_hash,
+                storage_codec=blob.codec,
+                stored_size=blob.stored_size,
+                page_count=blob.page_count
+            )
         
-        db.session.add(document)
+        db.session.add_all(documents.values())
+        db.session.flush()
+        # Serialize before commit so the rows are not reloaded one by one
+        serialized = {index: document.to_dict() for index, document in documents.items()}
+        db.session.commit()
+        
+    except Exception as e:
+        # Files written for blobs that were never committed are left for the
+        # reconciliation scan, as concurrent uploads may share them
+        db.session.rollback()
+        return jsonify({'error': f'Batch upload failed: {str(e)}'}), 500
+    
+    # Index the text of new content in one follow-up transaction
+    try:
+        for blob, file_type in new_blobs:
+            index_blob(blob, file_type)
         db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Failed to index batch upload')
+    
+    for index, document in serialized.items():
+        results[index].update(status=201, document=document)
+    
+    succeeded = len(serialized)
+    if succeeded == len(files):
+        status = 201
+    elif succeeded:
+        status = 207
+    else:
+        status = 400 if all(result['status'] == 400 for result in results) else 500
+    
+    return jsonify({
+        'message': f'{succeeded} of {len(files)} documents uploaded successfully',
+        'succeeded': succeeded,
+        'failed': len(files) - succeeded,
+        'results': results
+    }), status
+
+# Version of the tus resumable upload protocol the upload session endpoints follow
+TUS_VERSION = '1.0.0'
+
+def _tus_headers(**headers):
+    headers = {name.replace('_', '-'): str(value) for name, value in headers.items()}
+    headers['Tus-Resumable'] = TUS_VERSION
+    return headers
+
+def _parse_upload_metadata(header):
+    """Decode a tus Upload-Metadata header ("key base64value, ...") into a dict."""
+    metadata = {}
+    for pair in header.split(','):
+        parts = pair.strip().split(' ', 1)
+        if not parts[0]:
+            continue
+        value = parts[1] if len(parts) > 1 else ''
+        metadata[parts[0]] = base64.b64decode(value, validate=True).decode('utf-8')
+    return metadata
+
+@api_bp.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start a resumable upload.
+    
+    Accepts either a JSON body with ``filename`` and ``size`` or the tus
+    ``Upload-Length`` and ``Upload-Metadata`` (with a ``filename`` key) headers.
+    
+    Returns:
+        JSON response with the session, and its URL in the Location header.
+    """
+    try:
+        if 'Upload-Length' in request.headers:
+            filename = _parse_upload_metadata(request.headers.get('Upload-Metadata', '')).get('filename', '')
+            size = int(request.headers['Upload-Length'])
+        else:
+            data = request.get_json(silent=True) or {}
+            filename = data.get('filename') or ''
+            size = int(data.get('size'))
+    except (TypeError, ValueError, binascii.Error):
+        return jsonify({'error': 'A filename and an integer size are required'}), 400
+    
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+    
+    if not allowed_file(filename):
+        return jsonify({
+            'error': 'Invalid file type. Allowed types: PDF, TXT, DOCX'
+        }), 400
+    
+    max_size = current_app.config['RESUMABLE_MAX_SIZE']
+    if size < 0 or size > max_size:
+        return jsonify({'error': f'Upload size must be between 0 and {max_size} bytes'}), 413
+    
+    session = create_session(safe_original_filename(filename), filename.rsplit('.', 1)[1].lower(), size)
+    
+    return jsonify({
+        'message': 'Upload session created',
+        'upload': session.to_dict(0)
+    }), 201, _tus_headers(Location=f'{request.base_url}/{session.id}', Upload_Offset=0,
+                          Tus_Max_Size=max_size)
+
+@api_bp.route('/uploads/<session_id>', methods=['GET'])
+def get_upload(session_id):
+    """
+    Report how much of a resumable upload has been received.
+    
+    HEAD requests get the same headers without a body.
+    
+    Returns:
+        JSON response with the session and its current offset.
+    """
+    session = get_active_session(session_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    offset = current_offset(session)
+    return jsonify({'upload': session.to_dict(offset)}), 200, _tus_headers(
+        Upload_Offset=offset, Upload_Length=session.upload_length, Cache_Control='no-store'
+    )
+
+@api_bp.route('/uploads/<session_id>', methods=['PATCH'])
+@admit_upload
+def append_upload(session_id):
+    """
+    Append a chunk to a resumable upload.
+    
+    The body must be sent as ``application/offset+octet-stream`` with an
+    ``Upload-Offset`` header equal to the bytes received so far.
+    
+    Returns:
+        Empty 204 response carrying the new Upload-Offset.
+    """
+    session = get_active_session(session_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    if request.mimetype != 'application/offset+octet-stream':
+        return jsonify({'error': 'Content-Type must be application/offset+octet-stream'}), 415
+    
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'An integer Upload-Offset header is required'}), 400
+    
+    try:
+        offset = append_chunk(session, offset, request.stream)
+    except UploadConflict as e:
+        return jsonify({'error': str(e), 'upload_offset': e.offset}), 409, _tus_headers(Upload_Offset=e.offset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+    
+    return '', 204, _tus_headers(Upload_Offset=offset)
+
+@api_bp.route('/uploads/<session_id>/complete', methods=['POST'])
+@admit_upload
+def complete_upload(session_id):
+    """
+    Turn a fully received resumable upload into a document.
+    
+    Returns:
+        JSON response with document metadata, as for a regular upload.
+    """
+    session = get_active_session(session_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    path = session_path(session.id)
+    original_filename, file_type = session.original_filename, session.file_type
+    try:
+        # Holding the session lock keeps chunks (and other completes) out meanwhile
+        with locked_part_file(session, 'rb') as f:
+            offset = os.fstat(f.fileno()).st_size
+            if offset != session.upload_length:
+                return jsonify({
+                    'error': 'Upload is incomplete',
+                    'upload_offset': offset,
+                    'upload_length': session.upload_length
+                }), 409
+            
+            # The staged link becomes the blob itself, or is dropped if the content
+            # exists; the part file stays until the session row is gone
+            staged = f'{path}.staged'
+            if os.path.exists(staged):
+                os.remove(staged)
+            os.link(path, staged)
+            document_data, storage = _record_document(
+                prepare_blob_from_path(staged, file_type), original_filename, file_type, session_id=session.id)
+            os.remove(path)
         
         return jsonify({
             'message': 'Document uploaded successfully',
-            'document': document.to_dict()
+            'document': document_data,
+            'storage': storage
         }), 201
         
+    except FileNotFoundError:
+        db.session.rollback()
+        return jsonify({'error': 'Upload not found'}), 404
+    except UploadConflict as e:
+        return jsonify({'error': str(e), 'upload_offset': e.offset}), 409, _tus_headers(Upload_Offset=e.offset)
     except Exception as e:
         db.session.rollback()
-        # Clean up file if database operation fails
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
+@api_bp.route('/uploads/<session_id>', methods=['DELETE'])
+def cancel_upload(session_id):
+    """
+    Abandon a resumable upload and delete the bytes received so far.
+    
+    Returns:
+        Empty 204 response.
+    """
+    session = get_active_session(session_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    discard_session(session)
+    return '', 204, _tus_headers()
+
+# Sort options for listings: column, and whether it is descending
+SORTS = {
+    '-upload_timestamp': (Document.upload_timestamp, True),
+    'upload_timestamp': (Document.upload_timestamp, False),
+    '-file_size': (Document.file_size, True),
+    'file_size': (Document.file_size, False),
+    'original_filename': (Document.original_filename, False),
+    '-original_filename': (Document.original_filename, True),
+}
+DEFAULT_SORT = '-upload_timestamp'
+
+def _parse_datetime_arg(name):
+    value = request.args.get(name)
+    return parse_utc_datetime(value) if value else None
+
+def _prefix_upper_bound(prefix):
+    """Return the smallest string above every string starting with prefix, or None if there is none."""
+    # The highest code point cannot be incremented; carry into the character before it
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return None
+    return stem[:-1] + chr(ord(stem[-1]) + 1)
+
+def _parse_size_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    size = int(value)
+    if size < 0:
+        raise ValueError(name)
+    return size
+
+def _document_filters():
+    """
+    Build filter conditions from the listing's query parameters.
+    
+    Returns:
+        List of SQL conditions.
+    
+    Raises:
+        ValueError: With a message describing an invalid parameter.
+    """
+    conditions = []
+    
+    file_type = request.args.get('file_type')
+    if file_type:
+        types = [value.strip().lower() for value in file_type.split(',') if value.strip()]
+        if not types:
+            raise ValueError('file_type must name at least one type')
+        conditions.append(Document.file_type.in_(types) if len(types) > 1 else Document.file_type == types[0])
+    
+    try:
+        min_size, max_size = _parse_size_arg('min_size'), _parse_size_arg('max_size')
+    except ValueError:
+        raise ValueError('min_size and max_size must be non-negative integers')
+    if min_size is not None:
+        conditions.append(Document.file_size >= min_size)
+    if max_size is not None:
+        conditions.append(Document.file_size <= max_size)
+    
+    try:
+        uploaded_after, uploaded_before = _parse_datetime_arg('uploaded_after'), _parse_datetime_arg('uploaded_before')
+    except ValueError:
+        raise ValueError('uploaded_after and uploaded_before must be ISO 8601 timestamps')
+    if uploaded_after is not None:
+        conditions.append(Document.upload_timestamp >= uploaded_after)
+    if uploaded_before is not None:
+        conditions.append(Document.upload_timestamp < uploaded_before)
+    
+    prefix = request.args.get('filename_prefix')
+    if prefix:
+        # A range instead of LIKE, so the original_filename index is used
+        # (SQLite's LIKE is case-insensitive and cannot use a binary index)
+        conditions.append(Document.original_filename >= prefix)
+        upper = _prefix_upper_bound(prefix)
+        if upper is not None:
+            conditions.append(Document.original_filename < upper)
+    
+    return conditions
+
+def _parse_fields(fields):
+    """
+    Validate a sparse fieldset given as a comma-separated string or a list.
+    
+    Returns:
+        List of Document fields (all of them if fields is None).
+    
+    Raises:
+        ValueError: If a field is unknown or the list is empty.
+    """
+    if fields is None:
+        return list(Document.FIELDS)
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not isinstance(fields, list) or not fields or not set(fields) <= set(Document.FIELDS):
+        raise ValueError(f"Invalid fields. Allowed: {', '.join(Document.FIELDS)}")
+    return fields
+
+def _sort_order(sort):
+    column, descending = SORTS[sort]
+    if descending:
+        return column.desc(), Document.id.desc()
+    return column.asc(), Document.id.asc()
+
 @api_bp.route('/documents', methods=['GET'])
 def list_documents():
     """
     List all documents with pagination.
     
+    Two modes are supported. Passing ``cursor`` or ``limit`` selects keyset
+    pagination, which seeks on ``(sort column, id)`` and stays fast on
+    deep pages. Otherwise the classic ``page``/``per_page`` mode is used.
+    
     Query Parameters:
         page (int): Page number (default: 1)
         per_page (int): Items per page (default: 10, max: 100)
+        cursor (str): Opaque cursor returned as ``next_cursor`` (cursor mode)
+        limit (int): Items per page (cursor mode, default: 10, max: 100)
+        count (str): ``exact`` or ``estimate`` to include ``total_items``
+            (cursor mode only, omitted by default)
+        sort (str): One of SORTS (default: ``-upload_timestamp``, newest first)
+        file_type (str): Comma-separated file types to include
+        min_size, max_size (int): Inclusive size range in bytes
+        uploaded_after, uploaded_before (str): ISO 8601 timestamps; the range
+            includes ``uploaded_after`` and excludes ``uploaded_before``
+        filename_prefix (str): Case-sensitive prefix of the original filename
+        fields (str): Comma-separated document fields to return (default: all)
+    
+    Rows are selected as plain column tuples (only the columns the fields
+    need) rather than ORM objects.
     
     Returns:
         JSON response with paginated document list.
     """
+    cache = get_cache()
+    if cache is not None:
+        key = list_key(cache, urlencode(sorted(request.args.items(multi=True))))
+        cached = cache.get(key)
+        if cached is not None:
+            return jsonify(cached), 200
+    
+    sort = request.args.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        return jsonify({'error': f"Invalid sort. Use one of: {', '.join(SORTS)}"}), 400
+    
+    try:
+        conditions = _document_filters()
+        fields = _parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if 'cursor' in request.args or 'limit' in request.args:
+        response, status = _list_documents_by_cursor(sort, conditions, fields)
+    else:
+        response, status = _list_documents_by_page(sort, conditions, fields)
+    
+    if cache is not None and status == 200:
+        cache.set(key, response)
+    return jsonify(response), status
+
+def _list_documents_by_page(sort, conditions, fields):
+    """List documents using page/per_page offset pagination."""
     try:
         # Get pagination parameters
         page = request.args.get('page', 1)
         per_page = request.args.get('per_page', current_app.config['DEFAULT_PAGE_SIZE'])
         page, per_page = validate_pagination_params(page, per_page)
         
-        # Query documents with pagination
-        pagination = db.paginate(
-            db.select(Document).order_by(Document.upload_timestamp.desc()),
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Query the page as column tuples, plus the total for page counts
+        rows = db.session.execute(
+            db.select(*Document.columns_for(fields)).where(*conditions)
+            .order_by(*_sort_order(sort)).limit(per_page).offset((page - 1) * per_page)
+        ).all()
+        total = db.session.execute(
+            db.select(func.count()).select_from(Document).where(*conditions)
+        ).scalar()
+        total_pages = -(-total // per_page)
         
-        documents = [doc.to_dict() for doc in pagination.items]
+        documents = [Document.row_to_dict(row, fields) for row in rows]
         
-        return jsonify({
+        return {
             'documents': documents,
             'pagination': {
                 'page': page,
                 'per_page': per_page,
-                'total_items': pagination.total,
-                'total_pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
+                'total_items': total,
+                'total_pages': total_pages,
+                'has_next': page < total_pages,
+                'has_prev': page > 1
+            }
+        }, 200
+        
+    except Exception as e:
+        return {'error': f'Failed to retrieve documents: {str(e)}'}, 500
+
+def _list_documents_by_cursor(sort, conditions, fields):
+    """List documents using keyset pagination in the requested order."""
+    count_mode = request.args.get('count')
+    if count_mode not in (None, 'exact', 'estimate'):
+        return {'error': "Invalid count mode. Use 'exact' or 'estimate'"}, 400
+    
+    column, descending = SORTS[sort]
+    cursor = request.args.get('cursor')
+    position = None
+    if cursor:
+        try:
+            value, last_id, cursor_sort = decode_cursor(cursor)
+            if (cursor_sort or DEFAULT_SORT) != sort:
+                raise ValueError('Invalid cursor')
+            if column is Document.upload_timestamp:
+                value = parse_utc_datetime(value)
+            elif column is Document.file_size and not isinstance(value, int):
+                raise ValueError('Invalid cursor')
+            elif column is Document.original_filename and not isinstance(value, str):
+                raise ValueError('Invalid cursor')
+            position = (value, last_id)
+        except (TypeError, ValueError):
+            return {'error': 'Invalid cursor'}, 400
+    
+    try:
+        limit = validate_limit(request.args.get('limit'))
+        
+        # The sort column is selected too, to build the next cursor
+        columns = Document.columns_for(set(fields) | {column.key})
+        query = db.select(*columns).where(*conditions).order_by(*_sort_order(sort))
+        if position is not None:
+            key = tuple_(column, Document.id)
+            query = query.where(key < tuple_(*position) if descending else key > tuple_(*position))
+        
+        # Fetch one extra row to learn whether another page exists
+        rows = db.session.execute(query.limit(limit + 1)).all()
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        
+        next_cursor = None
+        if has_next:
+            last = rows[-1]
+            next_cursor = encode_cursor(last._mapping[column.key], last.id,
+                                        None if sort == DEFAULT_SORT else sort)
+        
+        pagination = {
+            'limit': limit,
+            'has_next': has_next,
+            'next_cursor': next_cursor
+        }
+        
+        if count_mode == 'exact' or (count_mode == 'estimate' and conditions):
+            # Filtered counts are always exact; the estimate only bounds the whole table
+            pagination['total_items'] = db.session.execute(
+                db.select(func.count()).select_from(Document).where(*conditions)
+            ).scalar()
+        elif count_mode == 'estimate':
+            # Bounded by the primary key index; exact unless rows were deleted
+            low, high = db.session.execute(
+                db.select(func.min(Document.id), func.max(Document.id))
+            ).one()
+            pagination['total_items'] = (high - low + 1) if high is not None else 0
+            pagination['total_is_estimate'] = True
+        
+        return {
+            'documents': [Document.row_to_dict(row, fields) for row in rows],
+            'pagination': pagination
+        }, 200
+        
+    except Exception as e:
+        return {'error': f'Failed to retrieve documents: {str(e)}'}, 500
+
+@api_bp.route('/documents/stats', methods=['GET'])
+def document_stats():
+    """
+    Report document counts and total bytes, overall and per file type.
+    
+    Served from counters updated with every insert, so the cost does not
+    grow with the table.
+    
+    Returns:
+        JSON response with the aggregate statistics.
+    """
+    try:
+        return jsonify(get_stats()), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to retrieve stats: {str(e)}'}), 500
+
+@api_bp.route('/documents/export', methods=['GET'])
+def export_documents():
+    """
+    Stream the metadata of every matching document.
+    
+    Rows are read through a streaming cursor and written as they arrive,
+    oldest first, so the response can cover the whole table without
+    pagination. To sync incrementally, pass the ``upload_timestamp`` and
+    ``id`` of the last exported row as ``since`` and ``since_id``.
+    
+    Query Parameters:
+        format (str): ``ndjson`` (default) or ``csv``
+        since (str): ISO 8601 timestamp; only later uploads are exported
+        since_id (int): Only documents after this id (at ``since``, if given)
+    
+    Returns:
+        Streaming NDJSON or CSV response.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': "Invalid format. Use 'ndjson' or 'csv'"}), 400
+    
+    try:
+        since = request.args.get('since')
+        since = parse_utc_datetime(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'Invalid since timestamp. Use ISO 8601'}), 400
+    
+    since_id = request.args.get('since_id')
+    if since_id is not None:
+        try:
+            since_id = int(since_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid since_id'}), 400
+    
+    batches = iter_export_batches(export_query(since, since_id),
+                                  current_app.config['EXPORT_BATCH_SIZE'])
+    if export_format == 'csv':
+        body, mimetype = csv_chunks(batches), 'text/csv'
+    else:
+        body, mimetype = ndjson_chunks(batches), 'application/x-ndjson'
+    
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=documents.{export_format}',
+        'Cache-Control': 'no-store'
+    })
+
+@api_bp.route('/documents/archive', methods=['GET', 'POST'])
+def download_archive():
+    """
+    Download several documents as one ZIP archive, streamed as it is built.
+    
+    Documents are chosen by ``ids`` or by the listing filters. Entries are
+    named by original filename, with " (1)", " (2)"... added to repeats.
+    Already-compressed types (ARCHIVE_STORED_TYPES) are stored as is and
+    the rest deflated; the archive is never held in memory or on disk.
+    
+    Query Parameters:
+        ids (str): Comma-separated document IDs (or a JSON ``ids`` list in a POST body)
+        file_type, min_size, max_size, uploaded_after, uploaded_before,
+        filename_prefix: Filters, as for listing, when no ids are given
+    
+    Returns:
+        Streaming application/zip response, or JSON error message.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object with an ids list'}), 400
+        ids = data.get('ids')
+        if not isinstance(ids, list):
+            return jsonify({'error': 'No ids provided'}), 400
+    else:
+        ids = request.args.get('ids')
+        ids = ids.split(',') if ids else None
+    
+    try:
+        conditions = _document_filters() if ids is None else []
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not ids and not conditions:
+        return jsonify({'error': 'Provide ids or at least one filter'}), 400
+    
+    max_documents = current_app.config['MAX_ARCHIVE_DOCUMENTS']
+    columns = [getattr(Document, column) for column in ARCHIVE_COLUMNS]
+    try:
+        if ids is not None:
+            try:
+                ids = list(dict.fromkeys(int(document_id) for document_id in ids))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Document ids must be integers'}), 400
+            if len(ids) > max_documents:
+                return jsonify({'error': f'Too many documents. Maximum per archive: {max_documents}'}), 400
+            
+            chunk_size = current_app.config['METADATA_BATCH_CHUNK_SIZE']
+            found = {}
+            for start in range(0, len(ids), chunk_size):
+                for row in db.session.execute(
+                    db.select(*columns).where(Document.id.in_(ids[start:start + chunk_size]))
+                ):
+                    found[row.id] = row
+            
+            missing = [document_id for document_id in ids if document_id not in found]
+            if missing:
+                return jsonify({'error': 'Document not found', 'missing': missing}), 404
+            rows = [found[document_id] for document_id in ids]
+        else:
+            rows = db.session.execute(
+                db.select(*columns).where(*conditions)
+                .order_by(Document.upload_timestamp, Document.id)
+                .limit(max_documents + 1)
+            ).all()
+            if len(rows) > max_documents:
+                return jsonify({'error': f'Too many documents match. Maximum per archive: {max_documents}'}), 400
+            if not rows:
+                return jsonify({'error': 'No documents match'}), 404
+        
+        entries, missing = archive_entries(rows)
+        if missing:
+            return jsonify({'error': 'Document file not found', 'missing': missing}), 404
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to prepare archive: {str(e)}'}), 500
+    
+    body = stream_archive(entries, get_backend(), current_app.config['ARCHIVE_STORED_TYPES'],
+                          current_app.config['COMPRESSION_LEVEL'])
+    return Response(stream_with_context(body), mimetype='application/zip', headers={
+        'Content-Disposition': dump_options_header('attachment', {'filename': archive_filename(entries)}),
+        'Cache-Control': 'no-store'
+    })
+
+@api_bp.route('/documents/search', methods=['GET'])
+def search():
+    """
+    Full-text search over document content.
+    
+    Query Parameters:
+        q (str): Search terms (all terms must match)
+        page (int): Page number (default: 1)
+        per_page (int): Items per page (default: 10, max: 100)
+    
+    Returns:
+        JSON response with ranked documents and snippets.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'No search query provided'}), 400
+    
+    if not search_available():
+        return jsonify({'error': 'Full-text search is not available on this database'}), 501
+    
+    try:
+        page, per_page = validate_pagination_params(
+            request.args.get('page', 1),
+            request.args.get('per_page', current_app.config['DEFAULT_PAGE_SIZE'])
+        )
+        
+        return jsonify({
+            'query': query,
+            'documents': search_documents(query, page, per_page),
+            'pagination': {
+                'page': page,
+                'per_page': per_page
             }
         }), 200
         
     except Exception as e:
-        return jsonify({'error': f'Failed to retrieve documents: {str(e)}'}), 500
+        return jsonify({'error': f'Search failed: {str(e)}'}), 500
 
 @api_bp.route('/documents/<int:document_id>', methods=['GET'])
 def get_document(document_id):
     """
     Retrieve a specific document by ID.
     
+    Supports conditional requests (If-None-Match / If-Modified-Since),
+    single and multiple byte ranges, and proxy offload when
+    DOWNLOAD_OFFLOAD is configured.
+    
     Args:
         document_id (int): Document ID
     
@@ -138,22 +879,85 @@ def get_document(document_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
-        # Check if file exists
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], document.filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'Document file not found'}), 404
+        # Revalidate cached copies from stored metadata alone
+        response = not_modified(document)
+        if response is not None:
+            return response
         
         # Return file
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=document.original_filename
-        )
+        return send_document(document)
         
+    except FileNotFoundError:
+        return jsonify({'error': 'Document file not found'}), 404
     except Exception as e:
         return jsonify({'error': f'Failed to retrieve document: {str(e)}'}), 500
 
+@api_bp.route('/documents/metadata:batch', methods=['GET', 'POST'])
+def get_documents_metadata_batch():
+    """
+    Retrieve the metadata of many documents in one request.
+    
+    IDs are resolved with chunked ``IN`` queries that select only the
+    requested fields. Results follow the request order (repeated IDs are
+    repeated); unknown IDs get ``{"id": ..., "error": "Document not found"}``.
+    
+    Query Parameters (GET) or JSON body (POST):
+        ids: Comma-separated string (GET) or list (POST) of document IDs
+        fields: Optional comma-separated string or list of fields to return
+    
+    Returns:
+        JSON response with one result per requested ID.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object with an ids list'}), 400
+        ids, fields = data.get('ids'), data.get('fields')
+    else:
+        ids, fields = request.args.get('ids'), request.args.get('fields')
+        ids = ids.split(',') if ids else None
+    
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'error': 'No ids provided'}), 400
+    
+    max_ids = current_app.config['MAX_METADATA_BATCH']
+    if len(ids) > max_ids:
+        return jsonify({'error': f'Too many ids. Maximum per request: {max_ids}'}), 400
+    
+    try:
+        ids = [int(document_id) for document_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Document ids must be integers'}), 400
+    
+    try:
+        fields = _parse_fields(fields)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        columns = Document.columns_for(fields)
+        unique_ids = list(dict.fromkeys(ids))
+        chunk_size = current_app.config['METADATA_BATCH_CHUNK_SIZE']
+        found = {}
+        for start in range(0, len(unique_ids), chunk_size):
+            rows = db.session.execute(
+                db.select(*columns).where(Document.id.in_(unique_ids[start:start + chunk_size]))
+            ).all()
+            for row in rows:
+                found[row.id] = Document.row_to_dict(row, fields)
+        
+        results = [found.get(document_id, {'id': document_id, 'error': 'Document not found'})
+                   for document_id in ids]
+        
+        return jsonify({
+            'documents': results,
+            'found': sum(1 for document_id in ids if document_id in found),
+            'missing': [document_id for document_id in unique_ids if document_id not in found]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to retrieve metadata: {str(e)}'}), 500
+
 @api_bp.route('/documents/<int:document_id>/metadata', methods=['GET'])
 def get_document_metadata(document_id):
     """
@@ -162,17 +966,231 @@ def get_document_metadata(document_id):
     Args:
         document_id (int): Document ID
     
+    Query Parameters:
+        fields (str): Comma-separated document fields to return (default: all)
+    
     Returns:
         JSON response with document metadata.
     """
     try:
-        # Query document using session.get()
-        document = db.session.get(Document, document_id)
+        fields = _parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    cache = get_cache()
+    try:
+        document_data = cache.get(document_key(document_id)) if cache is not None else None
         
-        if not document:
-            return jsonify({'error': 'Document not found'}), 404
+        if document_data is None:
+            # Select the columns as a plain row; no ORM object is needed
+            row = db.session.execute(
+                db.select(*Document.columns_for(Document.FIELDS)).where(Document.id == document_id)
+            ).first()
+            
+            if row is None:
+                return jsonify({'error': 'Document not found'}), 404
+            
+            document_data = Document.row_to_dict(row, Document.FIELDS)
+            if cache is not None:
+                cache.set(document_key(document_id), document_data)
         
-        return jsonify({'document': document.to_dict()}), 200
+        response = {'document': {field: document_data[field] for field in fields}}
+        content_hash = document_data['content_hash']
+        if content_hash:
+            storage = cache.get(blob_key(content_hash)) if cache is not None else None
+            if storage is None:
+                # The cached document may outlive a blob discarded since
+                blob = db.session.get(Blob, content_hash)
+                storage = blob.storage_info() if blob is not None else None
+                if cache is not None and storage is not None:
+                    cache.set(blob_key(content_hash), storage)
+            if storage is not None:
+                response['storage'] = storage
+        
+        return jsonify(response), 200
         
     except Exception as e:
-        return jsonify({'error': f'Failed to retrieve metadata: {str(e)}'}), 500
\ No newline at end of file
+        return jsonify({'error': f'Failed to retrieve metadata: {str(e)}'}), 500
+
+def _preview_document(document_id, file_type):
+    """
+    Load the columns a text preview needs, or an error response.
+    
+    Returns:
+        Tuple of (row, None) or (None, error response tuple).
+    """
+    row = db.session.execute(
+        db.select(Document.id, Document.filename, Document.file_type, Document.content_hash,
+                  Document.storage_codec, Document.page_count)
+        .where(Document.id == document_id)
+    ).first()
+    if row is None:
+        return None, (jsonify({'error': 'Document not found'}), 404)
+    if row.file_type != file_type:
+        return None, (jsonify({'error': f'This preview is only available for {file_type.upper()} documents'}), 400)
+    return row, None
+
+def _cached_preview(row, unit, start, end, extract):
+    """
+    Return preview data from the cache, or run extract(file) and cache its result.
+    
+    The stored file is only opened on a cache miss.
+    
+    Raises:
+        FileNotFoundError: If the file is missing from the storage backend.
+    """
+    cache = get_preview_cache()
+    key = preview_key(row.content_hash or f'document-{row.id}', unit, start, end)
+    data = cache.get(key) if cache is not None else None
+    if data is None:
+        with open_stored(row.filename, row.storage_codec) as f:
+            data = extract(f)
+        if cache is not None:
+            cache.set(key, data)
+    return data
+
+@api_bp.route('/documents/<int:document_id>/pages/<int:page>/text', methods=['GET'])
+def get_page_text(document_id, page):
+    """
+    Extract the text of one page of a PDF.
+    
+    Only the requested page is parsed, and results are cached by content
+    and page, so previews of large files stay fast.
+    
+    Args:
+        document_id (int): Document ID
+        page (int): 1-based page number
+    
+    Returns:
+        JSON response with the page text and the document's page count.
+    """
+    try:
+        row, error = _preview_document(document_id, 'pdf')
+        if error is not None:
+            return error
+        
+        if page < 1 or (row.page_count is not None and page > row.page_count):
+            return jsonify({'error': 'Page not found', 'page_count': row.page_count}), 404
+        
+        def extract(f):
+            text, page_count = pdf_page_text(f, page)
+            return {'text': text, 'page_count': page_count}
+        
+        try:
+            data = _cached_preview(row, 'page', page, page, extract)
+        except IndexError:
+            return jsonify({'error': 'Page not found'}), 404
+        except FileNotFoundError:
+            return jsonify({'error': 'Document file not found'}), 404
+        
+        return jsonify({
+            'document_id': document_id,
+            'page': page,
+            'page_count': data['page_count'],
+            'text': data['text']
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to extract page text: {str(e)}'}), 500
+
+@api_bp.route('/documents/<int:document_id>/paragraphs/text', methods=['GET'])
+def get_paragraphs_text(document_id):
+    """
+    Extract the text of a range of DOCX paragraphs.
+    
+    The document is parsed only up to the last requested paragraph, and
+    results are cached by content and range.
+    
+    Args:
+        document_id (int): Document ID
+    
+    Query Parameters:
+        start (int): First paragraph, 1-based (default: 1)
+        end (int): Last paragraph, inclusive (default: PREVIEW_MAX_PARAGRAPHS from start)
+    
+    Returns:
+        JSON response with the paragraph texts and the document's paragraph count.
+    """
+    max_paragraphs = current_app.config['PREVIEW_MAX_PARAGRAPHS']
+    try:
+        start = int(request.args.get('start', 1))
+        end = int(request.args.get('end', start + max_paragraphs - 1))
+    except ValueError:
+        return jsonify({'error': 'start and end must be integers'}), 400
+    if start < 1 or end < start:
+        return jsonify({'error': 'start must be at least 1 and end at least start'}), 400
+    if end - start + 1 > max_paragraphs:
+        return jsonify({'error': f'Too many paragraphs. Maximum per request: {max_paragraphs}'}), 400
+    
+    try:
+        row, error = _preview_document(document_id, 'docx')
+        if error is not None:
+            return error
+        
+        if row.page_count is not None:
+            if start > row.page_count:
+                return jsonify({'error': 'Paragraph not found', 'paragraph_count': row.page_count}), 404
+            end = min(end, row.page_count)
+        
+        try:
+            paragraphs = _cached_preview(row, 'paragraphs', start, end,
+                                         lambda f: docx_paragraphs(f, start, end))
+        except FileNotFoundError:
+            return jsonify({'error': 'Document file not found'}), 404
+        
+        if not paragraphs:
+            return jsonify({'error': 'Paragraph not found', 'paragraph_count': row.page_count}), 404
+        
+        return jsonify({
+            'document_id': document_id,
+            'start': start,
+            'end': start + len(paragraphs) - 1,
+            'paragraph_count': row.page_count,
+            'paragraphs': paragraphs
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to extract paragraph text: {str(e)}'}), 500
+
+@api_bp.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Report cache counters for sizing the metadata and preview caches.
+    
+    Returns:
+        JSON response with hit/miss/eviction counters.
+    """
+    cache, preview_cache = get_cache(), get_preview_cache()
+    return jsonify({
+        'cache': cache.stats() if cache is not None else None,
+        'preview_cache': preview_cache.stats() if preview_cache is not None else None
+    }), 200
+
+@api_bp.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """
+    Report upload admission limits, load and rejections for tuning the limits.
+    
+    Returns:
+        JSON response with the controller's counters, or null when disabled.
+    """
+    controller = get_admission()
+    return jsonify({'admission': controller.stats() if controller is not None else None}), 200
+
+@api_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Expose request, SQL and I/O metrics for Prometheus to scrape.
+    
+    With METRICS_DIR set, the values are summed over the worker processes.
+    
+    Returns:
+        Prometheus text exposition format.
+    """
+    registry = get_metrics()
+    if registry is None:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    if current_app.config['METRICS_DIR']:
+        # Report the totals of every worker, not just the one scraped
+        registry = aggregate(registry, current_app.config['METRICS_DIR'])
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
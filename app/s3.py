@@ -0,0 +1,465 @@
+"""S3-compatible object storage backend with pooled connections and parallel multipart uploads."""
+import hashlib
+import hmac
+import http.client
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+from app.blobstore import QUARANTINE_DIR, BlobStat, StorageBackend
+
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+_S3_NS = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+class S3Error(Exception):
+    """Error response from the object store."""
+
+    def __init__(self, status, code, message):
+        super().__init__(f'{status} {code}: {message}')
+        self.status = status
+        self.code = code
+
+def _findtext(element, name, default=None):
+    # Responses may or may not use the S3 XML namespace
+    text = element.findtext(f'{_S3_NS}{name}')
+    return text if text is not None else element.findtext(name, default)
+
+def _findall(element, name):
+    return element.findall(f'{_S3_NS}{name}') or element.findall(name)
+
+def _quote(value, safe='-_.~'):
+    return quote(str(value), safe=safe)
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+def signing_key(secret_key, date, region, service='s3'):
+    """Derive the Signature Version 4 key for a day, region and service."""
+    key = _hmac(f'AWS4{secret_key}'.encode('utf-8'), date)
+    key = _hmac(key, region)
+    key = _hmac(key, service)
+    return _hmac(key, 'aws4_request')
+
+def canonical_request(method, path, query, headers, payload_hash):
+    """
+    Build a Signature Version 4 canonical request.
+
+    Args:
+        path (str): Unencoded request path
+        query (dict): Unencoded query parameters
+        headers (dict): Headers to sign, lower-case names
+
+    Returns:
+        Tuple of (canonical request, signed header list).
+    """
+    canonical_query = '&'.join(
+        f'{_quote(name)}={_quote(value)}'
+        for name, value in sorted((str(name), str(value)) for name, value in query.items())
+    )
+    names = sorted(headers)
+    canonical_headers = ''.join(f'{name}:{" ".join(str(headers[name]).split())}\n' for name in names)
+    signed_headers = ';'.join(names)
+    return '\n'.join([method, _quote(path, safe='/-_.~'), canonical_query,
+                      canonical_headers, signed_headers, payload_hash]), signed_headers
+
+def sign(secret_key, region, timestamp, request, service='s3'):
+    """Sign a canonical request made at timestamp (YYYYMMDDTHHMMSSZ)."""
+    scope = f'{timestamp[:8]}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256', timestamp, scope, hashlib.sha256(request.encode('utf-8')).hexdigest()
+    ])
+    key = signing_key(secret_key, timestamp[:8], region, service)
+    return hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest(), scope
+
+def _timestamp(now=None):
+    return (now or datetime.now(timezone.utc)).strftime('%Y%m%dT%H%M%SZ')
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections to one host, reused across requests and threads.
+
+    Up to maxsize idle connections are kept; extra ones opened under load
+    are closed when released rather than blocking callers.
+    """
+
+    def __init__(self, scheme, host, port, maxsize=10, timeout=30):
+        self.connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self):
+        """Return (connection, reused)."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.created += 1
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, connection, reusable=True):
+        if reusable:
+            with self._lock:
+                if len(self._idle) < self.maxsize:
+                    self._idle.append(connection)
+                    return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+class _PooledResponse(io.RawIOBase):
+    """Streaming response body that returns its connection to the pool once fully read."""
+
+    def __init__(self, response, connection, pool):
+        self._response = response
+        self._connection = connection
+        self._pool = pool
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._response.readinto(buffer)
+
+    def close(self):
+        if self._connection is not None:
+            # http.client closes the response after its last byte; an
+            # unfinished body leaves the connection unusable
+            finished = self._response.isclosed()
+            self._response.close()
+            self._pool.release(self._connection, reusable=finished and not self._response.will_close)
+            self._connection = None
+        super().close()
+
+class S3Client:
+    """
+    Minimal S3 REST client using Signature Version 4 and path-style URLs.
+
+    Works with AWS S3 and compatible stores (MinIO, Ceph RGW, R2...).
+    """
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1',
+                 max_connections=10, timeout=30):
+        parts = urlsplit(endpoint_url)
+        self.endpoint_url = endpoint_url
+        self.scheme = parts.scheme or 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.scheme == 'https' else 80)
+        default_port = (self.scheme == 'https' and self.port == 443) or (self.scheme == 'http' and self.port == 80)
+        self.netloc = self.host if default_port else f'{self.host}:{self.port}'
+        self.base_path = parts.path.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.pool = ConnectionPool(self.scheme, self.host, self.port, max_connections, timeout)
+
+    def __getstate__(self):
+        # Connections cannot cross process boundaries; workers open their own
+        state = self.__dict__.copy()
+        del state['pool']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pool = ConnectionPool(self.scheme, self.host, self.port, self.max_connections, self.timeout)
+
+    def object_path(self, key):
+        return f'{self.base_path}/{self.bucket}/{key}'
+
+    def _signed_headers(self, method, path, query, headers, payload_hash):
+        timestamp = _timestamp()
+        headers = {name.lower(): value for name, value in headers.items()}
+        headers.update({'host': self.netloc, 'x-amz-date': timestamp, 'x-amz-content-sha256': payload_hash})
+        request, signed_headers = canonical_request(method, path, query, headers, payload_hash)
+        signature, scope = sign(self.secret_key, self.region, timestamp, request)
+        headers['authorization'] = (f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+                                    f'SignedHeaders={signed_headers}, Signature={signature}')
+        return headers
+
+    def request(self, method, key, query=None, headers=None, body=b'', stream=False):
+        """
+        Send a signed request, retrying once if a pooled connection went stale.
+
+        Returns:
+            (status, headers, body bytes), or (status, headers, stream) with
+            stream=True for successful responses.
+
+        Raises:
+            FileNotFoundError: On 404 for an object key.
+            S3Error: On any other error status.
+        """
+        query = query or {}
+        path = self.object_path(key)
+        url = _quote(path, safe='/-_.~')
+        if query:
+            url += '?' + '&'.join(f'{_quote(name)}={_quote(value)}' if value != '' else _quote(name)
+                                  for name, value in query.items())
+        payload_hash = hashlib.sha256(body).hexdigest() if body else EMPTY_SHA256
+
+        for attempt in range(2):
+            connection, reused = self.pool.acquire()
+            try:
+                connection.request(method, url, body=body or None,
+                                   headers=self._signed_headers(method, path, query, headers or {}, payload_hash))
+                response = connection.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            break
+
+        if stream and response.status < 300:
+            return response.status, response.headers, _PooledResponse(response, connection, self.pool)
+
+        data = response.read()
+        self.pool.release(connection, reusable=not response.will_close)
+        if response.status >= 300:
+            if response.status == 404 and method in ('GET', 'HEAD') and 'uploadId' not in query:
+                raise FileNotFoundError(key)
+            code, message = 'Error', data.decode('utf-8', errors='replace')[:200]
+            if data:
+                try:
+                    root = ElementTree.fromstring(data)
+                    code, message = _findtext(root, 'Code', code), _findtext(root, 'Message', message)
+                except ElementTree.ParseError:
+                    pass
+            raise S3Error(response.status, code, message)
+        return response.status, response.headers, data
+
+    def presigned_url(self, key, expires_in, query=None, now=None):
+        """Return a URL that GETs key without credentials until it expires."""
+        timestamp = _timestamp(now)
+        path = self.object_path(key)
+        query = dict(query or {})
+        query.update({
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f'{self.access_key}/{timestamp[:8]}/{self.region}/s3/aws4_request',
+            'X-Amz-Date': timestamp,
+            'X-Amz-Expires': str(int(expires_in)),
+            'X-Amz-SignedHeaders': 'host',
+        })
+        request, _ = canonical_request('GET', path, query, {'host': self.netloc}, UNSIGNED_PAYLOAD)
+        signature, _ = sign(self.secret_key, self.region, timestamp, request)
+        query['X-Amz-Signature'] = signature
+        return (f'{self.scheme}://{self.netloc}{_quote(path, safe="/-_.~")}?'
+                + '&'.join(f'{_quote(name)}={_quote(value)}' for name, value in sorted(query.items())))
+
+class _RangeReader(io.RawIOBase):
+    """
+    Seekable view of an object read in block-aligned ranged GETs.
+
+    The last few blocks are kept, so parsers that step backwards from the
+    end of a file (as PDF readers do) do not fetch the same bytes again.
+    """
+
+    def __init__(self, client, key, size, block_size, max_blocks=4):
+        self._client = client
+        self._key = key
+        self._size = size
+        self._block_size = block_size
+        self._max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self._position = offset
+        return offset
+
+    def _block(self, index):
+        data = self._blocks.get(index)
+        if data is not None:
+            self._blocks.move_to_end(index)
+            return data
+        start = index * self._block_size
+        stop = min(start + self._block_size, self._size)
+        _, _, data = self._client.request('GET', self._key, headers={'Range': f'bytes={start}-{stop - 1}'})
+        self._blocks[index] = data
+        if len(self._blocks) > self._max_blocks:
+            self._blocks.popitem(last=False)
+        return data
+
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+        index, offset = divmod(self._position, self._block_size)
+        data = self._block(index)[offset:offset + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+class S3Backend(StorageBackend):
+    """
+    Blobs kept in an S3-compatible bucket under an optional key prefix.
+
+    Large files are uploaded as multipart uploads whose parts are sent in
+    parallel over the pooled connections.
+    """
+
+    def __init__(self, client, prefix='', multipart_threshold=16 * 1024 * 1024,
+                 part_size=8 * 1024 * 1024, concurrency=4, read_block_size=1024 * 1024):
+        self.client = client
+        self.prefix = prefix
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.read_block_size = read_block_size
+
+    @classmethod
+    def from_config(cls, config):
+        client = S3Client(config['S3_ENDPOINT_URL'], config['S3_BUCKET'], config['S3_ACCESS_KEY_ID'],
+                          config['S3_SECRET_ACCESS_KEY'], region=config['S3_REGION'],
+                          max_connections=config['S3_MAX_POOL_CONNECTIONS'], timeout=config['S3_TIMEOUT'])
+        return cls(client, prefix=config['S3_PREFIX'],
+                   multipart_threshold=config['S3_MULTIPART_THRESHOLD'],
+                   part_size=config['S3_MULTIPART_PART_SIZE'],
+                   concurrency=config['S3_MULTIPART_CONCURRENCY'],
+                   read_block_size=config['S3_READ_BLOCK_SIZE'])
+
+    def _key(self, key):
+        return f'{self.prefix}{key}'
+
+    def put(self, key, source_path):
+        size = os.path.getsize(source_path)
+        if size <= self.multipart_threshold:
+            with open(source_path, 'rb') as f:
+                self.client.request('PUT', self._key(key), body=f.read(),
+                                    headers={'Content-Type': 'application/octet-stream'})
+        else:
+            self._multipart_upload(self._key(key), source_path, size)
+        os.remove(source_path)
+
+    def _multipart_upload(self, key, source_path, size):
+        _, _, data = self.client.request('POST', key, query={'uploads': ''},
+                                         headers={'Content-Type': 'application/octet-stream'})
+        upload_id = _findtext(ElementTree.fromstring(data), 'UploadId')
+
+        def upload_part(number):
+            offset = (number - 1) * self.part_size
+            with open(source_path, 'rb') as f:
+                f.seek(offset)
+                body = f.read(self.part_size)
+            _, headers, _ = self.client.request('PUT', key, query={'partNumber': number, 'uploadId': upload_id},
+                                                body=body)
+            return number, headers['ETag']
+
+        part_count = (size + self.part_size - 1) // self.part_size
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                parts = list(executor.map(upload_part, range(1, part_count + 1)))
+            manifest = ''.join(f'<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>'
+                               for number, etag in parts)
+            body = f'<CompleteMultipartUpload>{manifest}</CompleteMultipartUpload>'.encode('utf-8')
+            _, _, data = self.client.request('POST', key, query={'uploadId': upload_id}, body=body)
+            # S3 can report a failed completion inside a 200 response
+            if b'<Error>' in data:
+                root = ElementTree.fromstring(data)
+                raise S3Error(200, _findtext(root, 'Code'), _findtext(root, 'Message'))
+        except Exception:
+            try:
+                self.client.request('DELETE', key, query={'uploadId': upload_id})
+            except (OSError, S3Error):
+                pass
+            raise
+
+    def open(self, key, start=0, stop=None):
+        headers = {}
+        if start or stop is not None:
+            headers['Range'] = f"bytes={start}-{'' if stop is None else stop - 1}"
+        _, _, body = self.client.request('GET', self._key(key), headers=headers, stream=True)
+        return io.BufferedReader(body, buffer_size=64 * 1024)
+
+    def open_seekable(self, key):
+        stat = self.stat(key)
+        if stat is None:
+            raise FileNotFoundError(key)
+        return io.BufferedReader(_RangeReader(self.client, self._key(key), stat.size, self.read_block_size))
+
+    def stat(self, key):
+        try:
+            _, headers, _ = self.client.request('HEAD', self._key(key))
+        except FileNotFoundError:
+            return None
+        modified = headers.get('Last-Modified')
+        return BlobStat(int(headers['Content-Length']),
+                        parsedate_to_datetime(modified).timestamp() if modified else None)
+
+    def delete(self, key):
+        self.client.request('DELETE', self._key(key))
+
+    def iter_keys(self, start_after=''):
+        # ListObjectsV2 returns keys in UTF-8 byte order, a page at a time
+        query = {'list-type': '2', 'prefix': self.prefix}
+        if start_after:
+            query['start-after'] = self._key(start_after)
+        while True:
+            _, _, data = self.client.request('GET', '', query=query)
+            root = ElementTree.fromstring(data)
+            for contents in _findall(root, 'Contents'):
+                key = _findtext(contents, 'Key')[len(self.prefix):]
+                # Keys under a "directory" are not blobs (the quarantine among them)
+                if not key.startswith('.') and '/' not in key:
+                    yield key
+            token = _findtext(root, 'NextContinuationToken')
+            if _findtext(root, 'IsTruncated') != 'true' or not token:
+                return
+            query.pop('start-after', None)
+            query['continuation-token'] = token
+
+    def quarantine(self, key):
+        # Objects cannot be renamed: copy server-side, then delete the original
+        source = f'/{self.client.bucket}/{self._key(key)}'
+        try:
+            _, _, data = self.client.request('PUT', f'{self.prefix}{QUARANTINE_DIR}/{key}',
+                                             headers={'x-amz-copy-source': _quote(source, safe='/-_.~')})
+        except S3Error as e:
+            if e.status == 404:
+                return False
+            raise
+        if b'<Error>' in data:
+            root = ElementTree.fromstring(data)
+            raise S3Error(200, _findtext(root, 'Code'), _findtext(root, 'Message'))
+        self.delete(key)
+        return True
+
+    def presigned_url(self, key, expires_in, filename=None, content_type=None):
+        query = {}
+        if filename:
+            query['response-content-disposition'] = f"attachment; filename*=UTF-8''{_quote(filename)}"
+        if content_type:
+            query['response-content-type'] = content_type
+        return self.client.presigned_url(self._key(key), expires_in, query)
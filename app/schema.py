@@ -0,0 +1,155 @@
+"""Database schema setup and versioning, run once per deployment rather than per process."""
+import os
+from flask import current_app
+from sqlalchemy import inspect
+from app import db
+from app.models import DocumentStats, SchemaVersion
+from app.stats import fill_stats
+
+# Bump when the models change, and add an upgrade step to _UPGRADES
+SCHEMA_VERSION = 2
+
+def _add_missing_columns(connection):
+    """
+    Add model columns missing from existing tables.
+
+    Databases created before schema versioning were set up by create_all,
+    which never alters a table that already exists.
+    """
+    inspector = inspect(connection)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(f'Cannot add required column {table.name}.{column.name} to existing rows')
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+
+def _create_missing_indexes(connection):
+    """Create model indexes missing from existing tables, which create_all also leaves alone."""
+    inspector = inspect(connection)
+    for table in db.metadata.sorted_tables:
+        if inspector.has_table(table.name):
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+def _rebuild_documents(connection):
+    """Recreate the documents table from the model, keeping its rows (SQLite cannot drop constraints)."""
+    inspector = inspect(connection)
+    table = db.metadata.tables['documents']
+    columns = ', '.join(column['name'] for column in inspector.get_columns('documents')
+                        if column['name'] in table.columns)
+    # Renamed tables keep their indexes, whose names the new table needs
+    for index in inspector.get_indexes('documents'):
+        connection.exec_driver_sql(f"DROP INDEX {index['name']}")
+    connection.exec_driver_sql('ALTER TABLE documents RENAME TO documents_before_upgrade')
+    table.create(connection)
+    connection.exec_driver_sql(f'INSERT INTO documents ({columns}) SELECT {columns} FROM documents_before_upgrade')
+    connection.exec_driver_sql('DROP TABLE documents_before_upgrade')
+
+def _drop_unique_filename(connection):
+    """
+    Let several documents share one stored filename.
+
+    Before deduplication every document had a file of its own, and those
+    databases reject a second document referring to the same blob.
+    """
+    inspector = inspect(connection)
+    if not inspector.has_table('documents'):
+        return
+    for index in inspector.get_indexes('documents'):
+        if index['unique'] and index['column_names'] == ['filename']:
+            connection.exec_driver_sql(f"DROP INDEX {index['name']}")
+    constraints = [constraint for constraint in inspector.get_unique_constraints('documents')
+                   if constraint['column_names'] == ['filename']]
+    if not constraints:
+        return
+    if connection.dialect.name == 'sqlite':
+        _rebuild_documents(connection)
+        return
+    for constraint in constraints:
+        connection.exec_driver_sql(f"ALTER TABLE documents DROP CONSTRAINT {constraint['name']}")
+
+def _create_stats(connection):
+    """Create the document counters on a database that predates them, counting its documents."""
+    if inspect(connection).has_table(DocumentStats.__tablename__):
+        return
+    DocumentStats.__table__.create(connection)
+    fill_stats(connection)
+
+def _upgrade_unversioned(connection):
+    _drop_unique_filename(connection)
+    _add_missing_columns(connection)
+    _create_missing_indexes(connection)
+    _create_stats(connection)
+
+# Steps that bring a database at the key's version up to the next one
+_UPGRADES = {
+    0: _upgrade_unversioned,
+    # Missing-file markers set by the reconciliation scan
+    1: _add_missing_columns,
+}
+
+def _recorded_version(connection):
+    inspector = inspect(connection)
+    if not inspector.has_table(SchemaVersion.__tablename__):
+        return 0 if inspector.has_table('documents') else None
+    version = connection.execute(db.select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+    return version if version is not None else 0
+
+def schema_version():
+    """Return the version recorded in the database: None if uninitialized, 0 if unversioned."""
+    with db.engine.connect() as connection:
+        return _recorded_version(connection)
+
+def init_schema():
+    """
+    Create or upgrade the database schema and the upload folder.
+
+    Safe to run repeatedly; it does nothing when the schema is current.
+
+    Returns:
+        Tuple of (previous version or None, current version).
+
+    Raises:
+        RuntimeError: If the database was set up by a newer release.
+    """
+    from app.search import create_text_table, search_available
+    versions = SchemaVersion.__table__
+
+    with db.engine.begin() as connection:
+        previous = _recorded_version(connection)
+        if previous is not None and previous > SCHEMA_VERSION:
+            raise RuntimeError(f'Database schema version {previous} is newer than this release ({SCHEMA_VERSION})')
+        if previous is not None:
+            for version in range(previous, SCHEMA_VERSION):
+                if version in _UPGRADES:
+                    _UPGRADES[version](connection)
+        db.metadata.create_all(connection)
+        if search_available():
+            # Tables that predate full-text search never fired its after_create hook
+            connection.execute(create_text_table)
+        if connection.execute(db.update(versions).values(version=SCHEMA_VERSION)).rowcount == 0:
+            connection.execute(db.insert(versions).values(id=1, version=SCHEMA_VERSION))
+
+    os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return previous, SCHEMA_VERSION
+
+def check_schema():
+    """
+    Verify the database is at this release's schema version, without changing it.
+
+    Raises:
+        RuntimeError: If the schema is missing, outdated or newer, or the upload folder is missing.
+    """
+    version = schema_version()
+    if version != SCHEMA_VERSION:
+        found = 'not initialized' if version is None else f'at version {version}'
+        raise RuntimeError(f'Database schema is {found}, expected version {SCHEMA_VERSION}; run "flask init-db"')
+    if not os.path.isdir(current_app.config['UPLOAD_FOLDER']):
+        raise RuntimeError(f"Upload folder {current_app.config['UPLOAD_FOLDER']} does not exist; "
+                           f'run "flask init-db"')
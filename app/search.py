@@ -0,0 +1,159 @@
+"""Full-text search over extracted document content."""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import DDL, column, event, table, text
+from app import db
+from app.models import Blob, Document
+from app.blobstore import get_backend
+from app.storage import hash_legacy_documents, open_stored
+
+logger = logging.getLogger(__name__)
+
+document_text = table('document_text', column('content_hash'), column('content'))
+
+# Text is indexed once per blob, so duplicate uploads are never re-extracted
+create_text_table = DDL(
+    'CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5('
+    'content_hash UNINDEXED, content, tokenize="unicode61")'
+).execute_if(dialect='sqlite')
+event.listen(Blob.__table__, 'after_create', create_text_table)
+event.listen(
+    Blob.__table__, 'before_drop',
+    DDL('DROP TABLE IF EXISTS document_text').execute_if(dialect='sqlite')
+)
+
+def extract_text(filename, file_type, codec, backend):
+    """
+    Extract plain text from a stored PDF, DOCX or TXT file.
+
+    Kept free of Flask and database state so it can run in a worker process.
+    """
+    with open_stored(filename, codec, backend) as f:
+        if file_type == 'txt':
+            return f.read().decode('utf-8', errors='replace')
+        if file_type == 'pdf':
+            from PyPDF2 import PdfReader
+            reader = PdfReader(f)
+            return '\n'.join(page.extract_text() or '' for page in reader.pages)
+        if file_type == 'docx':
+            import docx
+            return '\n'.join(paragraph.text for paragraph in docx.Document(f).paragraphs)
+    raise ValueError(f'Unsupported file type: {file_type}')
+
+# Storage backend of an extraction worker process, set by _init_worker
+_worker_backend = None
+
+def _init_worker(backend):
+    global _worker_backend
+    _worker_backend = backend
+
+def _extract(job, backend):
+    content_hash, filename, file_type, codec = job
+    try:
+        return content_hash, extract_text(filename, file_type, codec, backend), None
+    except Exception as e:
+        return content_hash, '', str(e)
+
+def _extract_job(job):
+    return _extract(job, _worker_backend)
+
+def search_available():
+    """Return True if the configured database supports the FTS5 index."""
+    return db.engine.dialect.name == 'sqlite'
+
+def _store_text(content_hash, content):
+    db.session.execute(document_text.insert().values(content_hash=content_hash, content=content))
+
+def index_blob(blob, file_type):
+    """
+    Extract and index the text of a newly stored blob.
+
+    Failures are logged and indexed as empty text so the reindex command
+    does not retry unreadable files forever; the caller commits.
+    """
+    if not search_available():
+        return
+    _, content, error = _extract((blob.content_hash, blob.filename, file_type, blob.codec), get_backend())
+    if error:
+        logger.warning('Text extraction failed for blob %s: %s', blob.content_hash, error)
+    _store_text(blob.content_hash, content)
+
+def reindex(rebuild=False, workers=None, batch_size=100):
+    """
+    Index every blob that has no entry yet, extracting text in a process pool.
+
+    Documents stored before content hashing are first moved into blobs,
+    since the index is keyed by content hash.
+
+    Args:
+        rebuild (bool): Drop all indexed text and extract everything again
+        workers (int): Worker processes (default: CPU count)
+        batch_size (int): Rows written per commit
+
+    Returns:
+        Tuple of (indexed, failed) counts.
+    """
+    hashed, missing = hash_legacy_documents(batch_size)
+    if hashed or missing:
+        logger.info('Hashed %d legacy document(s) into blobs, %d with missing files', hashed, missing)
+
+    if rebuild:
+        db.session.execute(document_text.delete())
+        db.session.commit()
+
+    pending = db.session.execute(
+        db.select(Blob.content_hash, Blob.filename, Blob.codec, db.func.min(Document.file_type))
+        .join(Document, Document.content_hash == Blob.content_hash)
+        .where(Blob.content_hash.not_in(db.select(document_text.c.content_hash)))
+        .group_by(Blob.content_hash, Blob.filename, Blob.codec)
+    ).all()
+
+    jobs = [(content_hash, filename, file_type, codec) for content_hash, filename, codec, file_type in pending]
+
+    indexed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(get_backend(),)) as executor:
+        for content_hash, content, error in executor.map(_extract_job, jobs, chunksize=8):
+            if error:
+                failed += 1
+                logger.warning('Text extraction failed for blob %s: %s', content_hash, error)
+            _store_text(content_hash, content)
+            indexed += 1
+            if indexed % batch_size == 0:
+                db.session.commit()
+    db.session.commit()
+    return indexed, failed
+
+def _match_expression(query):
+    # Quote every term so user input cannot inject FTS5 query syntax
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+def search_documents(query, page, per_page):
+    """
+    Run a ranked full-text search.
+
+    Returns:
+        List of dicts with the document fields, a snippet and the bm25 rank.
+    """
+    rows = db.session.execute(
+        text(
+            "SELECT d.id, snippet(document_text, 1, '<b>', '</b>', '...', 12) AS snippet, "
+            "bm25(document_text) AS rank "
+            "FROM document_text JOIN documents d ON d.content_hash = document_text.content_hash "
+            "WHERE document_text MATCH :match "
+            "ORDER BY rank, d.id DESC LIMIT :limit OFFSET :offset"
+        ),
+        {'match': _match_expression(query), 'limit': per_page, 'offset': (page - 1) * per_page}
+    ).all()
+
+    documents = {doc.id: doc for doc in db.session.execute(
+        db.select(Document).where(Document.id.in_([row.id for row in rows]))
+    ).scalars()}
+
+    results = []
+    for row in rows:
+        result = documents[row.id].to_dict()
+        result['snippet'] = row.snippet
+        result['rank'] = row.rank
+        results.append(result)
+    return results
@@ -0,0 +1,51 @@
+"""JSON encoding for API responses."""
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional: responses fall back to the standard library encoder
+    orjson = None
+
+def json_default(obj):
+    """Encode values the json module does not handle; datetimes become ISO 8601 like orjson's."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that encodes responses with orjson when it is installed.
+
+    orjson serializes datetimes natively, so rows can be returned without
+    calling isoformat() per value. Without orjson, the standard library is
+    used with the same datetime format. Keys are not sorted.
+    """
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault('default', json_default)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=json_default, option=orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype
+        )
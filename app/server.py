@@ -0,0 +1,324 @@
+"""
+Production server: worker processes sharing one listening socket.
+
+Run ``flask --app run init-db`` once, then::
+
+    python -m app.server --bind 0.0.0.0:8000 --workers 4 --threads 8
+
+The master process binds the socket and supervises the workers. It never
+creates the application itself and workers are fresh interpreters, so the
+workers started by a reload (SIGHUP) run the current code. SIGTERM or SIGINT
+stops the server gracefully.
+
+Workers write their metrics to a shared directory (METRICS_DIR, or a
+temporary one) so that a scrape of any of them reports the totals.
+"""
+import argparse
+import logging
+import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+
+logger = logging.getLogger(__name__)
+
+class WorkerServer(BaseWSGIServer):
+    """
+    HTTP server of one worker process, handling requests on a fixed thread pool.
+
+    A thread is reserved before a connection is accepted, so while every
+    thread is busy the connections wait in the shared listen queue for
+    whichever worker can take them.
+    """
+
+    multithread = True
+
+    # Seconds to wait for a free thread before checking for shutdown again
+    slot_wait = 0.5
+
+    def __init__(self, host, port, app, fd, threads):
+        super().__init__(host, port, app, fd=fd)
+        # Every worker is woken for a new connection; the losers' accept must not block
+        self.socket.setblocking(False)
+        self._slots = threading.Semaphore(threads)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='request')
+
+    def _handle_request_noblock(self):
+        if not self._slots.acquire(timeout=self.slot_wait):
+            return
+        try:
+            request, client_address = self.get_request()
+        except OSError:
+            self._slots.release()
+            return
+        if not self.verify_request(request, client_address):
+            self.shutdown_request(request)
+            self._slots.release()
+            return
+        try:
+            self._executor.submit(self._process_request_thread, request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def drain(self):
+        """Wait for the requests in progress to finish."""
+        self._executor.shutdown(wait=True)
+
+def run_worker(fd, host, port, threads, ready_fd):
+    """
+    Serve requests on an inherited listening socket until SIGTERM.
+
+    On SIGTERM the worker stops accepting connections, finishes the
+    requests it has already accepted (uploads and downloads included),
+    and exits.
+    """
+    # The master decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from app import create_app
+    from app.schema import check_schema
+    app = create_app()
+    with app.app_context():
+        check_schema()
+    upload_limit = app.config['UPLOAD_MAX_CONCURRENT']
+    if upload_limit is not None and upload_limit + app.config['UPLOAD_QUEUE_SIZE'] >= threads:
+        logger.warning('UPLOAD_MAX_CONCURRENT + UPLOAD_QUEUE_SIZE leaves no request threads '
+                       'for downloads and metadata reads; raise --threads above %d',
+                       upload_limit + app.config['UPLOAD_QUEUE_SIZE'])
+
+    server = WorkerServer(host, port, app, fd, threads)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+    server.serve_forever()
+    server.drain()
+
+class _Worker:
+    """A worker process and the pipe it reports readiness on."""
+
+    def __init__(self, process, ready_fd):
+        self.process = process
+        self.ready_fd = ready_fd
+        self.ready = False
+        self.deadline = None  # Set once asked to stop
+
+class Master:
+    """
+    Start, supervise and gracefully replace the worker processes.
+
+    Workers that exit unexpectedly are replaced. A reload starts a full
+    new set of workers and only stops the old ones, which drain their
+    requests, once every new worker is ready, so no request is refused.
+    If the new workers fail to start, the old ones keep serving.
+    """
+
+    def __init__(self, bind, workers, threads, graceful_timeout=30, startup_timeout=60, metrics_dir=None):
+        host, _, port = bind.rpartition(':')
+        self.host = host.strip('[]') or '0.0.0.0'
+        self.port = int(port)
+        self.worker_count = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.startup_timeout = startup_timeout
+        self.metrics_dir = metrics_dir
+        self.workers = []
+        self._retiring = []
+        self._reload = False
+        self._stop = False
+
+    def _prepare_metrics_dir(self):
+        """Point the workers at an empty metrics directory; return it if it is temporary."""
+        if self.metrics_dir is None:
+            self.metrics_dir = tempfile.mkdtemp(prefix='docapi-metrics-')
+            created = self.metrics_dir
+        else:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            created = None
+            # Totals start again with the server; stale snapshots would inflate them
+            for name in os.listdir(self.metrics_dir):
+                if name.startswith('metrics-'):
+                    os.remove(os.path.join(self.metrics_dir, name))
+        os.environ['METRICS_DIR'] = self.metrics_dir
+        return created
+
+    def _spawn(self):
+        ready_read, ready_write = os.pipe()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'app.server', '--worker', '--fd', str(self.socket.fileno()),
+             '--ready-fd', str(ready_write), '--bind', f'{self.host}:{self.port}', '--threads', str(self.threads)],
+            pass_fds=(self.socket.fileno(), ready_write)
+        )
+        os.close(ready_write)
+        logger.info('Started worker %d', process.pid)
+        return _Worker(process, ready_read)
+
+    def _read_ready(self, worker):
+        if os.read(worker.ready_fd, 1):
+            worker.ready = True
+        os.close(worker.ready_fd)
+        worker.ready_fd = None
+
+    def _wait_ready(self, workers):
+        """Return True once every worker is ready, False if one exits or the startup timeout passes."""
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            pending = {worker.ready_fd: worker for worker in workers if worker.ready_fd is not None}
+            if not pending:
+                return all(worker.ready for worker in workers)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                readable, _, _ = select.select(list(pending), [], [], remaining)
+            except InterruptedError:
+                continue
+            for fd in readable:
+                self._read_ready(pending[fd])
+
+    def _retire(self, workers):
+        for worker in workers:
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+                worker.ready_fd = None
+            worker.deadline = time.monotonic() + self.graceful_timeout
+            if worker.process.poll() is None:
+                worker.process.terminate()
+        self._retiring.extend(workers)
+
+    def _reap_retiring(self):
+        for worker in list(self._retiring):
+            if worker.process.poll() is not None:
+                self._retiring.remove(worker)
+            elif time.monotonic() > worker.deadline:
+                logger.warning('Worker %d did not finish within %ds; killing it',
+                               worker.process.pid, self.graceful_timeout)
+                worker.process.kill()
+
+    def _replace_exited(self):
+        for index, worker in enumerate(self.workers):
+            if worker.process.poll() is None:
+                continue
+            if not worker.ready:
+                raise RuntimeError(f'Worker {worker.process.pid} failed to start '
+                                   f'(exit status {worker.process.returncode})')
+            logger.warning('Worker %d exited with status %d; replacing it',
+                           worker.process.pid, worker.process.returncode)
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+            self.workers[index] = replacement = self._spawn()
+            self._wait_ready([replacement])
+
+    def reload(self):
+        """Replace every worker with one running the current code."""
+        logger.info('Reloading %d worker(s)', self.worker_count)
+        new = [self._spawn() for _ in range(self.worker_count)]
+        if not self._wait_ready(new):
+            logger.error('New workers failed to start; keeping the current ones')
+            self._retire(new)
+            return False
+        self._retire(self.workers)
+        self.workers = new
+        logger.info('Reload complete; old workers are finishing their requests')
+        return True
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._reload = True
+        elif signum in (signal.SIGTERM, signal.SIGINT):
+            self._stop = True
+
+    def run(self):
+        """Serve until SIGTERM/SIGINT; return the process exit status."""
+        self.socket = socket.create_server((self.host, self.port), backlog=2048,
+                                           family=socket.AF_INET6 if ':' in self.host else socket.AF_INET)
+        self.port = self.socket.getsockname()[1]
+        temporary_metrics_dir = self._prepare_metrics_dir()
+        wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_write, False)
+        signal.set_wakeup_fd(wakeup_write)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        try:
+            logger.info('Listening on %s:%d with %d worker(s) x %d thread(s)',
+                        self.host, self.port, self.worker_count, self.threads)
+            self.workers = [self._spawn() for _ in range(self.worker_count)]
+            if not self._wait_ready(self.workers):
+                logger.error('Workers failed to start')
+                return 1
+            while not self._stop:
+                try:
+                    select.select([wakeup_read], [], [], 1.0)
+                    os.read(wakeup_read, 512)
+                except (InterruptedError, BlockingIOError):
+                    pass
+                if self._reload:
+                    self._reload = False
+                    self.reload()
+                self._replace_exited()
+                self._reap_retiring()
+            logger.info('Shutting down')
+            return 0
+        except RuntimeError as e:
+            logger.error('%s', e)
+            return 1
+        finally:
+            self.socket.close()
+            self._retire(self.workers)
+            while self._retiring:
+                self._reap_retiring()
+                time.sleep(0.1)
+            signal.set_wakeup_fd(-1)
+            os.close(wakeup_read)
+            os.close(wakeup_write)
+            if temporary_metrics_dir is not None:
+                shutil.rmtree(temporary_metrics_dir, ignore_errors=True)
+
+def main(argv=None):
+    from app.config import Config
+    parser = argparse.ArgumentParser(prog='python -m app.server', description='Run the API with worker processes.')
+    parser.add_argument('--bind', default=Config.SERVER_BIND, help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS, help='Worker processes')
+    parser.add_argument('--threads', type=int, default=Config.SERVER_THREADS, help='Request threads per worker')
+    parser.add_argument('--graceful-timeout', type=int, default=Config.SERVER_GRACEFUL_TIMEOUT,
+                        help='Seconds a stopping worker may spend finishing its requests')
+    # Used by the master to start workers
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(levelname)s %(message)s')
+    if args.worker:
+        host, _, port = args.bind.rpartition(':')
+        try:
+            run_worker(args.fd, host.strip('[]'), int(port), args.threads, args.ready_fd)
+        except RuntimeError as e:
+            logger.error('%s', e)
+            return 1
+        return 0
+    return Master(args.bind, args.workers, args.threads, args.graceful_timeout,
+                  metrics_dir=Config.METRICS_DIR).run()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Aggregate document statistics maintained incrementally."""
+from collections import defaultdict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Document, DocumentStats
+
+def _upsert_statement(dialect_name, file_type, count, size):
+    """Build an atomic add-to-counters statement for dialects with ON CONFLICT."""
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    statement = insert(DocumentStats).values(file_type=file_type, document_count=count, total_bytes=size)
+    return statement.on_conflict_do_update(
+        index_elements=[DocumentStats.file_type],
+        set_={
+            'document_count': DocumentStats.document_count + statement.excluded.document_count,
+            'total_bytes': DocumentStats.total_bytes + statement.excluded.total_bytes
+        }
+    )
+
+def apply_deltas(connection, deltas):
+    """
+    Add per-type (count, bytes) deltas to the stats rows in the current transaction.
+
+    The increments are relative, so concurrent writers never overwrite
+    each other's updates.
+    """
+    for file_type, (count, size) in sorted(deltas.items()):
+        if not count and not size:
+            continue
+        statement = _upsert_statement(connection.dialect.name, file_type, count, size)
+        if statement is not None:
+            connection.execute(statement)
+            continue
+        updated = connection.execute(
+            db.update(DocumentStats)
+            .where(DocumentStats.file_type == file_type)
+            .values(document_count=DocumentStats.document_count + count,
+                    total_bytes=DocumentStats.total_bytes + size)
+        )
+        if updated.rowcount == 0:
+            connection.execute(db.insert(DocumentStats).values(
+                file_type=file_type, document_count=count, total_bytes=size))
+
+@event.listens_for(Session, 'after_flush')
+def _track_document_changes(session, flush_context):
+    # Counted at flush time so the update commits or rolls back with the rows
+    deltas = defaultdict(lambda: [0, 0])
+    for obj in session.new:
+        if isinstance(obj, Document):
+            deltas[obj.file_type][0] += 1
+            deltas[obj.file_type][1] += obj.file_size
+    for obj in session.deleted:
+        if isinstance(obj, Document):
+            deltas[obj.file_type][0] -= 1
+            deltas[obj.file_type][1] -= obj.file_size
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+def get_stats():
+    """
+    Return document totals overall and per file type, read from the counters.
+
+    Returns:
+        Dict with total_documents, total_bytes and by_type.
+    """
+    rows = db.session.execute(db.select(DocumentStats).order_by(DocumentStats.file_type)).scalars().all()
+    by_type = {
+        row.file_type: {'documents': row.document_count, 'bytes': row.total_bytes}
+        for row in rows if row.document_count
+    }
+    return {
+        'total_documents': sum(stats['documents'] for stats in by_type.values()),
+        'total_bytes': sum(stats['bytes'] for stats in by_type.values()),
+        'by_type': by_type
+    }
+
+def rebuild_stats():
+    """
+    Recompute the counters from the documents table in one pass.
+
+    Needed after rows are written without the ORM session (bulk loads)
+    or when adopting the counters on an existing database.
+
+    Returns:
+        The rebuilt stats, as from get_stats().
+    """
+    db.session.execute(db.delete(DocumentStats))
+    fill_stats(db.session)
+    db.session.commit()
+    return get_stats()
+
+def fill_stats(connection):
+    """Insert counters computed from the documents table into an empty stats table."""
+    totals = db.select(
+        Document.file_type, db.func.count(), db.func.coalesce(db.func.sum(Document.file_size), 0)
+    ).group_by(Document.file_type)
+    connection.execute(db.insert(DocumentStats).from_select(
+        ['file_type', 'document_count', 'total_bytes'], totals))
@@ -0,0 +1,565 @@
+"""Storage helpers for ingesting uploaded files and reading them back from the storage backend."""
+import gzip
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import Request, current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Blob, Document
+from app.blobstore import LocalBackend, get_backend
+from app.cache import mark_stale
+from app.preview import count_pages
+
+logger = logging.getLogger(__name__)
+
+# Chunk size used when copying a stream that was not ingested directly
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Codec of files stored gzip-compressed; None means the bytes are stored as uploaded
+CODEC_GZIP = 'gzip'
+
+# Content that has been hashed and, if new, put in the storage backend.
+# size is the logical (uncompressed) size; stored_size is the size stored;
+# page_count counts PDF pages or DOCX paragraphs for previews.
+StoredFile = namedtuple('StoredFile', ['content_hash', 'size', 'written', 'codec', 'stored_size', 'page_count'],
+                        defaults=(None, None, None))
+
+def _local_layout():
+    return LocalBackend.from_config(current_app.config)
+
+def storage_path(filename):
+    """Return where a stored file lives in the upload folder's sharded layout."""
+    return _local_layout().path(filename)
+
+def find_stored_file(filename):
+    """
+    Locate a file in the upload folder, or return None if it is missing.
+
+    Only meaningful with the local backend; files not yet moved by the
+    layout migration are still found in the flat layout.
+    """
+    return _local_layout().local_path(filename)
+
+def storage_codec(file_type):
+    """Return the codec new files of this type are stored with, or None."""
+    if current_app.config['STORAGE_COMPRESSION'] and file_type in current_app.config['COMPRESS_FILE_TYPES']:
+        return CODEC_GZIP
+    return None
+
+def compress_file(path, level, min_saving):
+    """
+    Replace a file with its gzip-compressed form if that saves enough space.
+
+    The compressed copy is written beside the original and swapped in with
+    an atomic rename. Output is deterministic (no embedded name or mtime).
+
+    Args:
+        path (str): File to compress
+        level (int): zlib compression level
+        min_saving (float): Fraction of the size that must be saved, else
+            the file is left as is
+
+    Returns:
+        The compressed size, or None if the file was left uncompressed.
+    """
+    size = os.path.getsize(path)
+    temp_path = f'{path}.gz.part'
+    try:
+        with open(path, 'rb') as source, open(temp_path, 'wb') as raw:
+            with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=level, mtime=0) as target:
+                for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                    target.write(chunk)
+            raw.flush()
+            os.fsync(raw.fileno())
+            stored_size = raw.tell()
+        if stored_size > size * (1 - min_saving):
+            os.remove(temp_path)
+            return None
+        os.replace(temp_path, path)
+        return stored_size
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def decode_stream(f, codec):
+    """
+    Wrap a binary file holding stored bytes so reads return the original bytes.
+
+    Closing the returned file closes f.
+    """
+    if codec == CODEC_GZIP:
+        decoded = gzip.GzipFile(fileobj=f, mode='rb')
+        # GzipFile only closes files it opened itself
+        decoded.myfileobj = f
+        return decoded
+    if codec is not None:
+        f.close()
+        raise ValueError(f'Unknown storage codec: {codec}')
+    return f
+
+def open_stored(filename, codec=None, backend=None):
+    """
+    Open a stored blob for random-access reading of its original (decoded) bytes.
+
+    Args:
+        filename (str): Blob filename (the backend key)
+        codec (str): Storage codec recorded for the blob
+        backend: Storage backend (default: the current app's)
+
+    Raises:
+        FileNotFoundError: If the blob is missing from the backend.
+    """
+    backend = backend if backend is not None else get_backend()
+    return decode_stream(backend.open_seekable(filename), codec)
+
+def page_count(file_path, file_type, codec=None):
+    """
+    Count the preview pages of a file about to be stored, or return None.
+
+    Unreadable files are logged and get no count rather than failing the
+    upload. Safe to call from worker threads.
+    """
+    try:
+        with decode_stream(open(file_path, 'rb'), codec) as f:
+            return count_pages(f, file_type)
+    except Exception as e:
+        logger.warning('Page count failed for %s: %s', os.path.basename(file_path), e)
+        return None
+
+class IngestFile:
+    """
+    Writable temp file in the upload folder that hashes and counts bytes.
+
+    The multipart parser writes each chunk straight into this file, so the
+    upload lands on disk in a single pass. commit() then hands it to the
+    storage backend (an atomic rename for local storage); an uncommitted
+    file is removed on close.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, f'.upload-{uuid.uuid4().hex}.part')
+        self._file = open(self.path, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+        # Seconds spent hashing and writing, not waiting for the network
+        self.elapsed = 0.0
+
+    def write(self, data):
+        started = time.perf_counter()
+        self._hash.update(data)
+        self.size += len(data)
+        written = self._file.write(data)
+        self.elapsed += time.perf_counter() - started
+        return written
+
+    def hexdigest(self):
+        """Return the SHA-256 digest of everything written so far."""
+        return self._hash.hexdigest()
+
+    def compress(self, level, min_saving):
+        """
+        Gzip the received bytes in place before commit().
+
+        Returns:
+            The compressed size, or None if compression did not pay off.
+        """
+        self._file.flush()
+        stored_size = compress_file(self.path, level, min_saving)
+        if stored_size is not None:
+            self._file.close()
+            self._file = open(self.path, 'rb')
+        return stored_size
+
+    def page_count(self, file_type, codec=None):
+        """Count the preview pages of the received bytes (see page_count())."""
+        self._file.flush()
+        return page_count(self.path, file_type, codec)
+
+    def commit(self, backend, key):
+        """Flush the file to disk and put it in the backend under key."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        backend.put(key, self.path)
+        self.committed = True
+
+    def close(self):
+        """Close the file, discarding it unless it was committed."""
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read(), seek(), tell() etc. are served by the underlying file
+        if name == '_file':
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+class IngestRequest(Request):
+    """Request class that streams file uploads into the upload folder."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestFile(current_app.config['UPLOAD_FOLDER'])
+
+def _ingest(file):
+    """Return the IngestFile holding an uploaded file's bytes."""
+    stream = file.stream
+    if isinstance(stream, IngestFile):
+        return stream
+
+    # Stream was not produced by IngestRequest; copy it in chunks
+    ingest = IngestFile(current_app.config['UPLOAD_FOLDER'])
+    try:
+        for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+            ingest.write(chunk)
+    except Exception:
+        ingest.close()
+        raise
+    return ingest
+
+def ingest_elapsed(file):
+    """Return the seconds already spent hashing and writing an uploaded file as it streamed in."""
+    return file.stream.elapsed if isinstance(file.stream, IngestFile) else 0.0
+
+def _compression_settings():
+    return current_app.config['COMPRESSION_LEVEL'], current_app.config['COMPRESSION_MIN_SAVING']
+
+def _is_stored(content_hash):
+    blob = db.session.get(Blob, content_hash)
+    return blob is not None and blob.missing_at is None
+
+def prepare_blob(file, file_type=None):
+    """
+    Put an uploaded file's bytes in place without touching the transaction.
+
+    The SHA-256 computed while the upload streamed in is looked up in the
+    blobs table, so existing files never need rehashing. Known content has
+    its temp file discarded; new content, and content whose file the
+    reconciliation scan found missing, is compressed if its type is
+    eligible, has its pages counted and is put in the storage backend
+    under its hash.
+
+    Args:
+        file: werkzeug FileStorage from the request
+        file_type (str): Extension deciding the storage codec and page counting
+
+    Returns:
+        StoredFile describing the content.
+    """
+    return _store_ingest(_ingest(file), file_type)
+
+def _store_ingest(ingest, file_type):
+    content_hash = ingest.hexdigest()
+
+    if _is_stored(content_hash):
+        ingest.close()
+        return StoredFile(content_hash, ingest.size, False)
+
+    try:
+        codec, stored_size = None, ingest.size
+        if storage_codec(file_type) == CODEC_GZIP:
+            compressed_size = ingest.compress(*_compression_settings())
+            if compressed_size is not None:
+                codec, stored_size = CODEC_GZIP, compressed_size
+        pages = ingest.page_count(file_type, codec)
+        ingest.commit(get_backend(), content_hash)
+    finally:
+        ingest.close()
+    return StoredFile(content_hash, ingest.size, True, codec, stored_size, pages)
+
+def prepare_blob_from_path(path, file_type=None):
+    """
+    Hash a fully written local file and put it in the storage backend.
+
+    Used when the bytes arrived outside a single request (resumable
+    uploads), so the digest is computed with one sequential read. New
+    content is compressed first if its type is eligible.
+
+    Returns:
+        StoredFile describing the content.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    content_hash = digest.hexdigest()
+
+    if _is_stored(content_hash):
+        os.remove(path)
+        return StoredFile(content_hash, size, False)
+
+    codec, stored_size = None, size
+    if storage_codec(file_type) == CODEC_GZIP:
+        compressed_size = compress_file(path, *_compression_settings())
+        if compressed_size is not None:
+            codec, stored_size = CODEC_GZIP, compressed_size
+
+    pages = page_count(path, file_type, codec)
+    get_backend().put(content_hash, path)
+    return StoredFile(content_hash, size, True, codec, stored_size, pages)
+
+def hash_legacy_documents(batch_size=100):
+    """
+    Move documents stored before content hashing into content-addressed blobs.
+
+    Each file is copied through a hashing temp file and stored like a new
+    upload (so duplicates share a blob); the document is pointed at the
+    blob and its old file deleted once that is committed. Documents whose
+    file is missing keep their row as it is.
+
+    Returns:
+        Tuple of (hashed, missing) counts.
+    """
+    backend = get_backend()
+    hashed = missing = 0
+    last_id = 0
+    while True:
+        documents = db.session.execute(
+            db.select(Document).where(Document.content_hash.is_(None), Document.id > last_id)
+            .order_by(Document.id).limit(batch_size)
+        ).scalars().all()
+        if not documents:
+            return hashed, missing
+
+        for document in documents:
+            last_id = document.id
+            ingest = IngestFile(current_app.config['UPLOAD_FOLDER'])
+            try:
+                with backend.open(document.filename) as source:
+                    for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                        ingest.write(chunk)
+            except FileNotFoundError:
+                ingest.close()
+                logger.warning('Stored file of document %d is missing; not hashed', document.id)
+                missing += 1
+                continue
+            except Exception:
+                ingest.close()
+                raise
+
+            blob, _ = register_blob(_store_ingest(ingest, document.file_type))
+            legacy_key = document.filename
+            document.filename = blob.filename
+            document.content_hash = blob.content_hash
+            document.storage_codec = blob.codec
+            document.stored_size = blob.stored_size
+            document.page_count = blob.page_count
+            db.session.commit()
+            if db.session.execute(db.select(Document.id).where(Document.filename == legacy_key).limit(1)).first() is None:
+                backend.delete(legacy_key)
+            hashed += 1
+
+def register_blob(stored):
+    """
+    Record a reference to prepared content in the blobs table.
+
+    A blob marked missing that was just written again is restored. The
+    caller owns the database transaction.
+
+    Returns:
+        Tuple of (Blob, created) where created is True if the row was inserted.
+    """
+    blob = db.session.get(Blob, stored.content_hash)
+    if blob is None:
+        blob = Blob(content_hash=stored.content_hash, filename=stored.content_hash,
+                    size=stored.size, codec=stored.codec,
+                    stored_size=stored.stored_size if stored.stored_size is not None else stored.size,
+                    page_count=stored.page_count, ref_count=1)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+            return blob, True
+        except IntegrityError:
+            # A concurrent upload registered the same content first
+            blob = db.session.get(Blob, stored.content_hash)
+    elif stored.written and blob.missing_at is not None:
+        restore_blob(blob, stored.codec, stored.stored_size, stored.page_count)
+
+    blob.ref_count = Blob.ref_count + 1
+    db.session.flush()
+    db.session.refresh(blob)
+    return blob, False
+
+def restore_blob(blob, codec, stored_size, page_count):
+    """
+    Point a blob marked missing, and its documents, at content written again.
+
+    The new file may be encoded differently from the lost one, so the
+    storage details copied to the documents are updated too.
+    """
+    blob.codec, blob.stored_size, blob.page_count, blob.missing_at = codec, stored_size, page_count, None
+    document_ids = db.session.execute(
+        db.select(Document.id).where(Document.content_hash == blob.content_hash)
+    ).scalars().all()
+    db.session.execute(
+        db.update(Document).where(Document.content_hash == blob.content_hash)
+        .values(storage_codec=codec, stored_size=stored_size, page_count=page_count, file_missing_at=None)
+    )
+    mark_stale(db.session, document_ids)
+
+def store_blobs(files, max_workers=None):
+    """
+    Store a batch of uploaded files in the blob store.
+
+    Existing blobs are found with a single IN query and duplicates within
+    the batch share one blob. New files are fsynced and put in the
+    storage backend in parallel. The caller owns the database transaction.
+
+    Args:
+        files: List of werkzeug FileStorage objects
+        max_workers (int): Threads used to finalize new files
+
+    Returns:
+        List aligned with files holding a (Blob, created) tuple, or the
+        exception raised for that file.
+    """
+    results = [None] * len(files)
+    ingests = {}
+    for index, file in enumerate(files):
+        try:
+            ingests[index] = _ingest(file)
+        except Exception as e:
+            results[index] = e
+
+    hashes = {index: ingest.hexdigest() for index, ingest in ingests.items()}
+    blobs = {blob.content_hash: blob for blob in db.session.execute(
+        db.select(Blob).where(Blob.content_hash.in_(set(hashes.values())))
+    ).scalars()}
+
+    # The first file with new (or missing) content provides the blob; the rest are discarded
+    pending = {}
+    for index, content_hash in hashes.items():
+        if (content_hash in blobs and blobs[content_hash].missing_at is None) or content_hash in pending:
+            ingests[index].close()
+        else:
+            pending[content_hash] = ingests[index]
+
+    # Pool threads have no app context, so settings are resolved up front
+    level, min_saving = _compression_settings()
+    backend = get_backend()
+
+    def finalize(item):
+        content_hash, ingest, file_type, codec = item
+        try:
+            stored_size = ingest.compress(level, min_saving) if codec == CODEC_GZIP else None
+            if stored_size is None:
+                codec, stored_size = None, ingest.size
+            pages = ingest.page_count(file_type, codec)
+            ingest.commit(backend, content_hash)
+        except Exception as e:
+            ingest.close()
+            return content_hash, None, e
+        return content_hash, (codec, stored_size, pages), None
+
+    # The file providing a blob decides its codec
+    file_types = {}
+    for index, content_hash in hashes.items():
+        file_types.setdefault(content_hash, files[index].filename.rsplit('.', 1)[-1].lower())
+
+    failed, encodings = {}, {}
+    work = [(content_hash, ingest, file_types[content_hash], storage_codec(file_types[content_hash]))
+            for content_hash, ingest in pending.items()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for content_hash, encoding, error in executor.map(finalize, work):
+            if error is not None:
+                failed[content_hash] = error
+            else:
+                encodings[content_hash] = encoding
+
+    references = Counter(content_hash for content_hash in hashes.values() if content_hash not in failed)
+    # Content whose row this batch did not insert, so its first file is not reported as created
+    not_inserted = set()
+    for content_hash, count in references.items():
+        if content_hash in pending and content_hash in blobs:
+            restore_blob(blobs[content_hash], *encodings[content_hash])
+            blobs[content_hash].ref_count = Blob.ref_count + count
+            not_inserted.add(content_hash)
+        elif content_hash in pending:
+            ingest = pending[content_hash]
+            codec, stored_size, pages = encodings[content_hash]
+            blob = Blob(content_hash=content_hash, filename=content_hash, size=ingest.size,
+                        codec=codec, stored_size=stored_size, page_count=pages, ref_count=count)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(blob)
+            except IntegrityError:
+                # A concurrent upload registered the same content first
+                blob = db.session.get(Blob, content_hash)
+                blob.ref_count = Blob.ref_count + count
+                not_inserted.add(content_hash)
+            blobs[content_hash] = blob
+        else:
+            blobs[content_hash].ref_count = Blob.ref_count + count
+
+    created = set(not_inserted)
+    for index, content_hash in hashes.items():
+        if content_hash in failed:
+            results[index] = failed[content_hash]
+        else:
+            results[index] = (blobs[content_hash], content_hash in pending and content_hash not in created)
+            created.add(content_hash)
+    return results
+
+def migrate_layout(batch_size=1000, pause=0.0, progress=None):
+    """
+    Move files from the flat upload folder into the sharded layout.
+
+    Works in batches and only touches files still at the top level, so it
+    can be stopped and re-run at any time and resumes where it left off.
+    Each move is an atomic rename, and readers fall back to the flat path
+    until a file has moved, so the service stays online throughout.
+
+    Args:
+        batch_size (int): Files moved per batch
+        pause (float): Seconds to sleep between batches to limit I/O load
+        progress: Optional callable receiving the running total after each batch
+
+    Returns:
+        Number of files moved.
+
+    Raises:
+        RuntimeError: If blobs are not kept in the local upload folder.
+    """
+    backend = get_backend()
+    if not isinstance(backend, LocalBackend):
+        raise RuntimeError('Only the local storage backend has a directory layout')
+    upload_folder = backend.root
+    moved = 0
+    while True:
+        batch = []
+        with os.scandir(upload_folder) as entries:
+            for entry in entries:
+                # Skip shard directories and in-flight .upload-*.part temp files
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                if backend.path(entry.name) != entry.path:
+                    batch.append(entry.name)
+                if len(batch) >= batch_size:
+                    break
+
+        if not batch:
+            return moved
+
+        for filename in batch:
+            destination = backend.path(filename)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            try:
+                os.replace(backend.legacy_path(filename), destination)
+            except FileNotFoundError:
+                continue  # Removed or moved by someone else meanwhile
+            moved += 1
+
+        if progress is not None:
+            progress(moved)
+        if pause:
+            time.sleep(pause)
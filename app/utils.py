@@ -2,6 +2,10 @@
 import os
 from werkzeug.utils import secure_filename
 from flask import current_app
+from datetime import datetime, timezone
+import base64
+import binascii
+import json
 import uuid
 import unicodedata
 
@@ -25,6 +29,16 @@ def sanitize_filename(filename):
         filename = 'document'
     return filename
 
+def safe_original_filename(original_filename):
+    """Sanitize a client-supplied filename for storage in document metadata."""
+    safe_original = secure_filename(sanitize_filename(original_filename))
+    
+    # If sanitization results in empty or just extension, use a default
+    if not safe_original or safe_original.startswith('.'):
+        ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'txt'
+        safe_original = f'document.{ext}'
+    return safe_original
+
 def generate_unique_filename(original_filename):
     """Generate a unique filename to avoid conflicts."""
     # First sanitize the filename
@@ -63,4 +77,67 @@ def validate_pagination_params(page, per_page):
         
         return page, per_page
     except (ValueError, TypeError):
-        return 1, current_app.config['DEFAULT_PAGE_SIZE']
\ No newline at end of file
+        return 1, current_app.config['DEFAULT_PAGE_SIZE']
+
+def validate_limit(limit):
+    """Validate and sanitize the page size for cursor pagination."""
+    try:
+        limit = int(limit) if limit else current_app.config['DEFAULT_PAGE_SIZE']
+        return max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    except (ValueError, TypeError):
+        return current_app.config['DEFAULT_PAGE_SIZE']
+
+def parse_utc_datetime(value):
+    """
+    Parse an ISO 8601 timestamp into the naive UTC datetimes the database stores.
+
+    Timestamps with an offset are converted to UTC; naive ones are taken
+    to be UTC already.
+
+    Raises:
+        ValueError: If the value is not ISO 8601.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def encode_cursor(value, document_id, sort=None):
+    """
+    Encode a keyset position as an opaque, URL-safe cursor.
+
+    Args:
+        value: Value of the sort column for the last row (datetimes are
+            stored as ISO 8601 strings)
+        document_id (int): ID of the last row, the tie-breaker
+        sort (str): Sort the cursor belongs to; None for the default order
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    position = [value, document_id] if sort is None else [value, document_id, sort]
+    payload = json.dumps(position, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor().
+
+    Returns:
+        Tuple of (value, document_id, sort), with sort None for the default
+        order. The value is returned as encoded (datetimes as strings).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(position, list) or len(position) not in (2, 3):
+            raise ValueError('Invalid cursor')
+        value, document_id = position[:2]
+        sort = position[2] if len(position) == 3 else None
+        if not isinstance(document_id, int) or isinstance(document_id, bool):
+            raise ValueError('Invalid cursor')
+        return value, document_id, sort
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
@@ -0,0 +1 @@
+"""Seeding, load generation and regression comparison for the document API."""
@@ -0,0 +1,148 @@
+"""
+Benchmark command line.
+
+    python -m benchmarks seed --documents 10000
+    python -m benchmarks run --documents 10000 --concurrency 16 --duration 10
+    python -m benchmarks compare results/base.json results/new.json
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from benchmarks.compare import compare, format_comparison
+from benchmarks.load import SCENARIOS, environment, run_scenario
+from benchmarks.seed import ensure_seeded, seed
+from benchmarks.server import ServerProcess, wait_until_ready
+
+def _config_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def _parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise SystemExit(f'--config expects KEY=VALUE, got {pair!r}')
+        overrides[key] = _config_value(value)
+    return overrides
+
+def _progress(total):
+    print(f'  seeded {total} documents', file=sys.stderr)
+
+def seed_command(args):
+    manifest = seed(args.workdir, args.documents, blobs=args.blobs, progress=_progress)
+    print(f"Seeded {manifest['documents']} documents over {manifest['blobs']} blobs in {args.workdir}")
+
+def run_command(args):
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}. Available: {', '.join(SCENARIOS)}")
+
+    if args.reuse_seed:
+        context = ensure_seeded(args.workdir, args.documents, blobs=args.blobs, progress=_progress)
+    else:
+        context = seed(args.workdir, args.documents, blobs=args.blobs, progress=_progress)
+
+    overrides = _parse_overrides(args.config)
+    results = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(),
+            'documents': context['documents'],
+            'blobs': context['blobs'],
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'server': args.url or 'werkzeug-threaded',
+            'config': overrides,
+            'environment': environment()
+        },
+        'scenarios': {}
+    }
+
+    def run_all(base_url):
+        for name in names:
+            summary = run_scenario(base_url, SCENARIOS[name], context, args.concurrency,
+                                   args.duration, warmup=args.warmup)
+            results['scenarios'][name] = summary
+            latency = summary['latency_ms']
+            print(f"{name:<22} {summary['throughput_rps']:>9.1f} req/s  p50 {latency['p50']} ms  "
+                  f"p95 {latency['p95']} ms  p99 {latency['p99']} ms  errors {summary['errors']}")
+
+    if args.url:
+        # An external server (e.g. gunicorn) must serve the same working directory
+        host, _, port = args.url.split('://', 1)[-1].partition(':')
+        wait_until_ready(host, int(port or 80))
+        run_all(args.url)
+    else:
+        with ServerProcess(args.workdir, overrides) as server:
+            run_all(server.url)
+
+    output = args.output or os.path.join(
+        'benchmark-results', f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {output}')
+
+def compare_command(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, threshold=args.threshold)
+    print(format_comparison(rows))
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f'{len(regressions)} regression(s) beyond {args.threshold:.0%}')
+        return 1
+    print('No regressions')
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Document API benchmarks.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_seed_options(subparser):
+        subparser.add_argument('--workdir', default='benchmark-data',
+                               help='Directory holding the benchmark database and uploads')
+        subparser.add_argument('--documents', type=int, default=10000, help='Documents to seed')
+        subparser.add_argument('--blobs', type=int, default=None,
+                               help='Distinct stored files (default: min(documents, 1000))')
+
+    seed_parser = subparsers.add_parser('seed', help='Seed a benchmark database and upload folder')
+    add_seed_options(seed_parser)
+    seed_parser.set_defaults(handler=seed_command)
+
+    run_parser = subparsers.add_parser('run', help='Seed, start a server and measure every scenario')
+    add_seed_options(run_parser)
+    run_parser.add_argument('--reuse-seed', action='store_true',
+                            help='Keep an existing seed of the same size instead of reseeding')
+    run_parser.add_argument('--scenarios', help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    run_parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads')
+    run_parser.add_argument('--duration', type=float, default=10.0, help='Measured seconds per scenario')
+    run_parser.add_argument('--warmup', type=float, default=1.0, help='Unmeasured seconds per scenario')
+    run_parser.add_argument('--config', action='append', default=[], metavar='KEY=VALUE',
+                            help='App config override for the server (JSON values), repeatable')
+    run_parser.add_argument('--url', help='Benchmark an already running server instead of starting one')
+    run_parser.add_argument('--output', help='Results file (default: benchmark-results/<timestamp>.json)')
+    run_parser.set_defaults(handler=run_command)
+
+    compare_parser = subparsers.add_parser('compare', help='Flag regressions between two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='Allowed slowdown as a fraction (default: 0.10)')
+    compare_parser.set_defaults(handler=compare_command)
+
+    args = parser.parse_args(argv)
+    return args.handler(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Compare two benchmark result files and flag regressions."""
+
+# Metrics checked for each scenario, and whether a higher value is worse
+METRICS = (
+    ('p50', True),
+    ('p95', True),
+    ('p99', True),
+    ('throughput_rps', False),
+)
+
+def _metric(summary, name):
+    if name == 'throughput_rps':
+        return summary['throughput_rps']
+    return summary['latency_ms'][name]
+
+def compare(baseline, candidate, threshold=0.10):
+    """
+    Compare the scenarios two runs have in common.
+
+    A metric regresses when it is worse than the baseline by more than
+    ``threshold`` (a fraction: 0.10 is 10%). Scenarios that recorded errors
+    in the candidate but not the baseline also count as regressions.
+
+    Returns:
+        List of row dicts (scenario, metric, baseline, candidate, change,
+        regression), in the baseline's scenario order.
+    """
+    rows = []
+    for scenario, before in baseline['scenarios'].items():
+        after = candidate['scenarios'].get(scenario)
+        if after is None:
+            continue
+        for name, higher_is_worse in METRICS:
+            old, new = _metric(before, name), _metric(after, name)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change if higher_is_worse else -change
+            rows.append({
+                'scenario': scenario,
+                'metric': name,
+                'baseline': old,
+                'candidate': new,
+                'change': round(change, 4),
+                'regression': worse > threshold
+            })
+        if after['errors'] and not before['errors']:
+            rows.append({
+                'scenario': scenario,
+                'metric': 'errors',
+                'baseline': before['errors'],
+                'candidate': after['errors'],
+                'change': None,
+                'regression': True
+            })
+    return rows
+
+def format_comparison(rows):
+    """Render comparison rows as a fixed-width text table."""
+    lines = [f"{'scenario':<22} {'metric':<15} {'baseline':>12} {'candidate':>12} {'change':>9}"]
+    for row in rows:
+        change = f"{row['change']:+.1%}" if row['change'] is not None else '-'
+        flag = '  REGRESSION' if row['regression'] else ''
+        lines.append(f"{row['scenario']:<22} {row['metric']:<15} {row['baseline']:>12} "
+                     f"{row['candidate']:>12} {change:>9}{flag}")
+    return '\n'.join(lines)
@@ -0,0 +1,241 @@
+"""Concurrent HTTP load generator and latency statistics."""
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from benchmarks.seed import WORDS
+
+class UnexpectedResponse(Exception):
+    """Raised when a benchmark request gets a status it did not expect."""
+
+class Client:
+    """Minimal keep-alive HTTP client; one per load generator thread."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self._connection = None
+
+    def request(self, method, path, body=None, headers=None, expect=(200,)):
+        """Send a request, read the whole response and check its status."""
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self._connection.request(method, path, body=body, headers=headers or {})
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; retry once on a new one
+                self.close()
+                if attempt:
+                    raise
+        if response.will_close:
+            self.close()
+        if response.status not in expect:
+            raise UnexpectedResponse(f'{method} {path} returned {response.status}')
+        return response, data
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def _multipart(files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, filename, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + content + b'\r\n'
+        )
+    body = b''.join(parts) + f'--{boundary}--\r\n'.encode('ascii')
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+def _random_text(rng, size=4096):
+    return (' '.join(rng.choice(WORDS) for _ in range(size // 8)) + uuid.uuid4().hex).encode('utf-8')
+
+def _random_id(context, rng):
+    low, high = context['id_range']
+    return rng.randint(low, high)
+
+# Each scenario performs one logical operation (one or more requests)
+
+def list_page(client, context, rng):
+    client.request('GET', f'/api/documents?page={rng.randint(1, 10)}&per_page=20')
+
+def list_deep_page(client, context, rng):
+    last_page = max(1, context['documents'] // 20)
+    client.request('GET', f'/api/documents?page={rng.randint(max(1, last_page - 10), last_page)}&per_page=20')
+
+def list_cursor(client, context, rng):
+    client.request('GET', '/api/documents?limit=100')
+
+def list_cursor_count(client, context, rng):
+    client.request('GET', '/api/documents?limit=100&count=exact')
+
+def list_filtered(client, context, rng):
+    client.request('GET', f'/api/documents?limit=20&file_type=txt&min_size={rng.randint(0, 2000)}'
+                          f'&filename_prefix=document{rng.randint(1, 9)}')
+
+def stats(client, context, rng):
+    client.request('GET', '/api/documents/stats')
+
+def metadata(client, context, rng):
+    client.request('GET', f'/api/documents/{_random_id(context, rng)}/metadata')
+
+def metadata_batch(client, context, rng):
+    ids = [_random_id(context, rng) for _ in range(100)]
+    client.request('POST', '/api/documents/metadata:batch', body=json.dumps({'ids': ids}),
+                   headers={'Content-Type': 'application/json'})
+
+def download(client, context, rng):
+    client.request('GET', f'/api/documents/{_random_id(context, rng)}')
+
+def download_range(client, context, rng):
+    client.request('GET', f'/api/documents/{_random_id(context, rng)}',
+                   headers={'Range': 'bytes=0-1023'}, expect=(206,))
+
+def download_conditional(client, context, rng):
+    sample = rng.choice(context['samples'])
+    client.request('GET', f"/api/documents/{sample['id']}",
+                   headers={'If-None-Match': f"\"{sample['content_hash']}\""}, expect=(304,))
+
+def search(client, context, rng):
+    client.request('GET', f'/api/documents/search?q={rng.choice(WORDS)}')
+
+def export(client, context, rng):
+    since_id = max(0, context['id_range'][1] - 1000)
+    client.request('GET', f'/api/documents/export?since_id={since_id}')
+
+def archive(client, context, rng):
+    ids = ','.join(str(_random_id(context, rng)) for _ in range(50))
+    client.request('GET', f'/api/documents/archive?ids={ids}')
+
+def cache_stats(client, context, rng):
+    client.request('GET', '/api/cache/stats')
+
+def upload(client, context, rng):
+    body, headers = _multipart([('file', 'bench.txt', _random_text(rng))])
+    client.request('POST', '/api/documents', body=body, headers=headers, expect=(201,))
+
+def upload_duplicate(client, context, rng):
+    body, headers = _multipart([('file', 'bench.txt', b'identical benchmark content\n')])
+    client.request('POST', '/api/documents', body=body, headers=headers, expect=(201,))
+
+def upload_batch(client, context, rng):
+    body, headers = _multipart([('files', f'bench{i}.txt', _random_text(rng)) for i in range(10)])
+    client.request('POST', '/api/documents/batch', body=body, headers=headers, expect=(201,))
+
+def upload_resumable(client, context, rng):
+    content = _random_text(rng, size=64 * 1024)
+    response, _ = client.request('POST', '/api/uploads', expect=(201,),
+                                 body=json.dumps({'filename': 'bench.txt', 'size': len(content)}),
+                                 headers={'Content-Type': 'application/json'})
+    path = urlsplit(response.getheader('Location')).path
+    for offset in range(0, len(content), 16 * 1024):
+        client.request('PATCH', path, body=content[offset:offset + 16 * 1024], expect=(204,), headers={
+            'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': str(offset)
+        })
+    client.request('POST', f'{path}/complete', expect=(201,))
+
+# Read scenarios run first so uploads do not change the data they measure
+SCENARIOS = {scenario.__name__: scenario for scenario in (
+    list_page, list_deep_page, list_cursor, list_cursor_count, list_filtered, stats,
+    metadata, metadata_batch, download, download_range, download_conditional, search,
+    export, archive, cache_stats,
+    upload, upload_duplicate, upload_batch, upload_resumable,
+)}
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+def summarize(latencies, errors, elapsed):
+    """Reduce raw latencies (seconds) to throughput and millisecond percentiles."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': _ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': _ms(percentile(latencies, 0.50)),
+            'p95': _ms(percentile(latencies, 0.95)),
+            'p99': _ms(percentile(latencies, 0.99)),
+            'max': _ms(latencies[-1] if latencies else None)
+        }
+    }
+
+def run_scenario(base_url, scenario, context, concurrency, duration, warmup=1.0, random_seed=0):
+    """
+    Drive one scenario from ``concurrency`` threads for ``duration`` seconds.
+
+    Operations completed during the warmup period are not recorded. Only
+    successful operations contribute latencies; failures are counted.
+
+    Returns:
+        Summary dict as produced by summarize(), plus the first error seen.
+    """
+    start = time.perf_counter()
+    record_from = start + warmup
+    stop_at = record_from + duration
+    lock = threading.Lock()
+    latencies, failures = [], []
+
+    def worker(index):
+        rng = random.Random(random_seed * 1000 + index)
+        client = Client(base_url)
+        local_latencies, local_failures = [], []
+        try:
+            while True:
+                began = time.perf_counter()
+                if began >= stop_at:
+                    break
+                try:
+                    scenario(client, context, rng)
+                except Exception as e:
+                    client.close()
+                    if began >= record_from:
+                        local_failures.append(repr(e))
+                    continue
+                if began >= record_from:
+                    local_latencies.append(time.perf_counter() - began)
+        finally:
+            client.close()
+            with lock:
+                latencies.extend(local_latencies)
+                failures.extend(local_failures)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = summarize(latencies, len(failures), time.perf_counter() - record_from)
+    if failures:
+        summary['first_error'] = failures[0]
+    return summary
+
+def environment():
+    """Describe the machine a run happened on, for reading results later."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
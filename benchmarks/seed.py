@@ -0,0 +1,150 @@
+"""Seed a benchmark database and upload folder with synthetic documents."""
+import hashlib
+import json
+import os
+import random
+import shutil
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Blob, Document
+from app.search import document_text, search_available
+from app.stats import rebuild_stats
+from app.schema import init_schema
+from app.storage import storage_path
+
+MANIFEST_NAME = 'seed.json'
+
+# Vocabulary for generated text; search scenarios query these words
+WORDS = [f'term{i:03d}' for i in range(500)]
+
+def app_config(workdir, overrides=None):
+    """Config overrides pointing an app at a benchmark working directory."""
+    config = {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(os.path.abspath(workdir), 'bench.db')}",
+        'UPLOAD_FOLDER': os.path.join(os.path.abspath(workdir), 'uploads'),
+    }
+    config.update(overrides or {})
+    return config
+
+def load_manifest(workdir):
+    """Return the manifest of a seeded working directory, or None."""
+    try:
+        with open(os.path.join(workdir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _blob_content(index, rng):
+    words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(50, 400)))
+    return f'Benchmark document {index}\n{words}\n'.encode('utf-8')
+
+def seed(workdir, documents, blobs=None, batch_size=5000, random_seed=0, progress=None):
+    """
+    Create a fresh database and upload folder holding synthetic documents.
+
+    Documents reference ``blobs`` distinct text files round-robin, so large
+    tables do not need one file per row. Rows are bulk inserted with Core
+    statements, and the search index is filled from the generated text.
+
+    Args:
+        workdir (str): Directory receiving bench.db, uploads/ and seed.json
+        documents (int): Number of Document rows
+        blobs (int): Distinct stored files (default: min(documents, 1000))
+        batch_size (int): Rows inserted per transaction
+        random_seed (int): Seed making the generated content reproducible
+        progress: Optional callable receiving the running document count
+
+    Returns:
+        The manifest dict written to seed.json.
+    """
+    blobs = max(1, min(documents, blobs or 1000))
+    rng = random.Random(random_seed)
+
+    for path in (os.path.join(workdir, 'uploads'), os.path.join(workdir, 'bench.db')):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(os.path.join(workdir, 'bench.db' + suffix)):
+            os.remove(os.path.join(workdir, 'bench.db' + suffix))
+    os.makedirs(workdir, exist_ok=True)
+
+    app = create_app(app_config(workdir))
+    with app.app_context():
+        init_schema()
+        now = datetime.utcnow()
+        blob_rows, text_rows = [], []
+        for index in range(blobs):
+            content = _blob_content(index, rng)
+            content_hash = hashlib.sha256(content).hexdigest()
+            path = storage_path(content_hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            blob_rows.append({
+                'content_hash': content_hash,
+                'filename': content_hash,
+                'size': len(content),
+                # Documents take blobs round-robin
+                'ref_count': documents // blobs + (1 if index < documents % blobs else 0),
+                'created_at': now
+            })
+            text_rows.append({'content_hash': content_hash, 'content': content.decode('utf-8')})
+
+        for start in range(0, blobs, batch_size):
+            db.session.execute(db.insert(Blob), blob_rows[start:start + batch_size])
+            if search_available():
+                db.session.execute(document_text.insert(), text_rows[start:start + batch_size])
+            db.session.commit()
+
+        # Spread upload times over the past year, oldest first
+        start_time = now - timedelta(days=365)
+        step = timedelta(days=365) / documents if documents else timedelta(0)
+        for start in range(0, documents, batch_size):
+            rows = []
+            for index in range(start, min(start + batch_size, documents)):
+                blob = blob_rows[index % blobs]
+                rows.append({
+                    'filename': blob['filename'],
+                    'original_filename': f'document{index}.txt',
+                    'file_size': blob['size'],
+                    'file_type': 'txt',
+                    'content_hash': blob['content_hash'],
+                    'upload_timestamp': start_time + step * index
+                })
+            db.session.execute(db.insert(Document), rows)
+            db.session.commit()
+            if progress is not None:
+                progress(start + len(rows))
+
+        # Bulk inserts bypass the ORM events that maintain the counters
+        rebuild_stats()
+
+        id_low, id_high = db.session.execute(
+            db.select(db.func.min(Document.id), db.func.max(Document.id))
+        ).one()
+
+    manifest = {
+        'documents': documents,
+        'blobs': blobs,
+        'random_seed': random_seed,
+        'id_range': [id_low, id_high] if documents else [0, 0],
+        # Known validators for conditional download scenarios
+        'samples': [
+            {'id': id_low + i, 'content_hash': blob_rows[i % blobs]['content_hash']}
+            for i in range(min(documents, 100))
+        ],
+        'seeded_at': now.isoformat()
+    }
+    with open(os.path.join(workdir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def ensure_seeded(workdir, documents, blobs=None, progress=None):
+    """Reuse an existing seed of the same size, or create a fresh one."""
+    manifest = load_manifest(workdir)
+    expected_blobs = max(1, min(documents, blobs or 1000))
+    if manifest and manifest['documents'] == documents and manifest['blobs'] == expected_blobs:
+        return manifest
+    return seed(workdir, documents, blobs=blobs, progress=progress)
@@ -0,0 +1,68 @@
+"""Run the application under a real WSGI server in a child process."""
+import http.client
+import logging
+import multiprocessing
+import socket
+import time
+from werkzeug.serving import make_server
+from app import create_app
+from benchmarks.seed import app_config
+
+def _serve(workdir, port, overrides):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app(app_config(workdir, overrides))
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(host, port, timeout=30.0):
+    """Poll the server until it answers HTTP requests."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=1)
+            connection.request('GET', '/api/cache/stats')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'Server on {host}:{port} did not start within {timeout}s')
+            time.sleep(0.1)
+
+class ServerProcess:
+    """
+    Threaded Werkzeug server for the seeded app, in its own process.
+
+    Keeping the server out of the load generator's process means the two
+    do not compete for the same GIL.
+    """
+
+    def __init__(self, workdir, overrides=None):
+        self.workdir = workdir
+        self.overrides = overrides or {}
+        self.port = _free_port()
+        self._process = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        self._process = context.Process(target=_serve, args=(self.workdir, self.port, self.overrides),
+                                        daemon=True)
+        self._process.start()
+        try:
+            wait_until_ready('127.0.0.1', self.port)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._process.terminate()
+        self._process.join(timeout=10)
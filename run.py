@@ -1,12 +1,13 @@
 """Application entry point."""
 from app import create_app
-import os
 
 app = create_app()
 
 if __name__ == '__main__':
-    # Create uploads directory if it doesn't exist
-    os.makedirs('uploads', exist_ok=True)
+    # Development convenience; deployments run "flask --app run init-db" once
+    from app.schema import init_schema
+    with app.app_context():
+        init_schema()
     
     print("=" * 50)
     print("Document Management REST API")
@@ -17,6 +18,7 @@ if __name__ == '__main__':
     print("  GET    /api/documents/<id>   - Retrieve a specific document")
     print("=" * 50)
     print("Server running on http://127.0.0.1:5000")
+    print("Development server; run production with: python -m app.server")
     print("=" * 50)
     
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
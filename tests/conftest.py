@@ -14,8 +14,7 @@ def app():
     # Create a temporary upload folder
     upload_folder = tempfile.mkdtemp()
     
-    app = create_app()
-    app.config.update({
+    app = create_app({
         'TESTING': True,
         'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
         'UPLOAD_FOLDER': upload_folder,
@@ -30,7 +29,9 @@ def app():
     
     # Cleanup
     os.close(db_fd)
-    os.unlink(db_path)
+    for path in (db_path, f'{db_path}-wal', f'{db_path}-shm'):
+        if os.path.exists(path):
+            os.unlink(path)
     shutil.rmtree(upload_folder, ignore_errors=True)
 
 @pytest.fixture
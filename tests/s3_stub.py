@@ -0,0 +1,197 @@
+"""In-memory stand-in for an S3-compatible server, for tests."""
+import hashlib
+import re
+import threading
+import time
+import uuid
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer, make_server
+from urllib.parse import unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from werkzeug.http import http_date
+from werkzeug.wrappers import Request, Response
+from app.s3 import UNSIGNED_PAYLOAD, canonical_request, sign
+
+_AUTHORIZATION = re.compile(
+    r'AWS4-HMAC-SHA256 Credential=(?P<key>[^/]+)/(?P<scope>[^,]+), '
+    r'SignedHeaders=(?P<headers>[^,]+), Signature=(?P<signature>[0-9a-f]+)'
+)
+
+class _ServerHandler(ServerHandler):
+    http_version = '1.1'
+
+class _KeepAliveHandler(WSGIRequestHandler):
+    """Serve requests on one connection until the client closes it."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, delayed ACKs
+    # stall every response on a reused connection
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.close_connection = False
+        while not self.close_connection:
+            self.raw_requestline = self.rfile.readline(65537)
+            if not self.parse_request():
+                return
+            handler = _ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                                     multithread=True)
+            handler.request_handler = self
+            handler.run(self.server.get_app())
+
+    def get_environ(self):
+        environ = super().get_environ()
+        environ['REMOTE_PORT'] = str(self.client_address[1])
+        return environ
+
+    def log_message(self, format, *args):
+        pass
+
+class _ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+def _error(status, code):
+    body = f'<?xml version="1.0"?><Error><Code>{code}</Code><Message>{code}</Message></Error>'
+    return Response(body, status=status, mimetype='application/xml')
+
+class S3Stub:
+    """
+    Serve PUT/GET/HEAD/DELETE, ranged reads, multipart uploads, copies,
+    ListObjectsV2 and presigned GETs.
+
+    Every request's Signature Version 4 signature is checked against the
+    configured credentials. Objects are kept in memory, keyed by
+    (bucket, key), with their modification times in modified; requests
+    and client connections are recorded.
+    """
+
+    def __init__(self, access_key='test-key', secret_key='test-secret', region='us-east-1'):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.objects = {}
+        self.modified = {}
+        self.uploads = {}
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        self._server = make_server('127.0.0.1', 0, self, server_class=_ThreadingServer,
+                                   handler_class=_KeepAliveHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _verify(self, request, body):
+        query = {name: value for name, value in request.args.items(multi=True)}
+        if 'X-Amz-Signature' in query:
+            signature = query.pop('X-Amz-Signature')
+            timestamp = query['X-Amz-Date']
+            headers = {'host': request.host}
+            payload_hash = UNSIGNED_PAYLOAD
+        else:
+            match = _AUTHORIZATION.match(request.headers.get('Authorization', ''))
+            if match is None or match['key'] != self.access_key:
+                return False
+            signature = match['signature']
+            timestamp = request.headers['X-Amz-Date']
+            headers = {name: request.headers.get(name, '') for name in match['headers'].split(';')}
+            payload_hash = request.headers['X-Amz-Content-Sha256']
+            if payload_hash != hashlib.sha256(body).hexdigest():
+                return False
+        canonical, _ = canonical_request(request.method, request.path, query, headers, payload_hash)
+        return sign(self.secret_key, self.region, timestamp, canonical)[0] == signature
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        body = request.get_data()
+        with self._lock:
+            self.connections.add(environ.get('REMOTE_PORT'))
+            self.requests.append((request.method, request.path, dict(request.args)))
+        if not self._verify(request, body):
+            return _error(403, 'SignatureDoesNotMatch')(environ, start_response)
+        bucket, _, key = request.path.lstrip('/').partition('/')
+        return self._handle(request, (bucket, key), body)(environ, start_response)
+
+    def _store(self, name, data):
+        self.objects[name] = data
+        self.modified[name] = time.time()
+
+    def _list(self, bucket, args, page_size=2):
+        # Small pages, so clients must follow continuation tokens
+        prefix = args.get('prefix', '')
+        after = args.get('continuation-token') or args.get('start-after', '')
+        keys = sorted(key for stored_bucket, key in self.objects
+                      if stored_bucket == bucket and key.startswith(prefix) and key > after)
+        page = keys[:min(page_size, int(args.get('max-keys', 1000)))]
+        truncated = len(keys) > len(page)
+        contents = ''.join(f'<Contents><Key>{escape(key)}</Key><Size>{len(self.objects[(bucket, key)])}</Size>'
+                           f'</Contents>' for key in page)
+        token = f'<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>' if truncated else ''
+        return Response(f'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{contents}'
+                        f'<IsTruncated>{str(truncated).lower()}</IsTruncated>{token}</ListBucketResult>',
+                        mimetype='application/xml')
+
+    def _handle(self, request, name, body):
+        args = request.args
+        if request.method == 'GET' and args.get('list-type') == '2':
+            return self._list(name[0], args)
+        if request.method == 'PUT' and 'x-amz-copy-source' in request.headers:
+            source_bucket, _, source_key = unquote(request.headers['x-amz-copy-source']).lstrip('/').partition('/')
+            data = self.objects.get((source_bucket, source_key))
+            if data is None:
+                return _error(404, 'NoSuchKey')
+            self._store(name, data)
+            return Response('<CopyObjectResult/>', mimetype='application/xml')
+        if request.method == 'POST' and 'uploads' in args:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            return Response(f'<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId>'
+                            f'</InitiateMultipartUploadResult>', mimetype='application/xml')
+        if request.method == 'PUT' and 'uploadId' in args:
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            self.uploads[args['uploadId']][int(args['partNumber'])] = (etag, body)
+            return Response(headers={'ETag': etag})
+        if request.method == 'POST' and 'uploadId' in args:
+            parts = self.uploads.pop(args['uploadId'])
+            manifest = [(int(part.findtext('PartNumber')), part.findtext('ETag'))
+                        for part in ElementTree.fromstring(body).iter('Part')]
+            if any(parts[number][0] != etag for number, etag in manifest):
+                return _error(400, 'InvalidPart')
+            self._store(name, b''.join(parts[number][1] for number, _ in manifest))
+            return Response('<CompleteMultipartUploadResult/>', mimetype='application/xml')
+        if request.method == 'DELETE' and 'uploadId' in args:
+            self.uploads.pop(args['uploadId'], None)
+            return Response(status=204)
+        if request.method == 'PUT':
+            self._store(name, body)
+            return Response(headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+        if request.method == 'DELETE':
+            self.objects.pop(name, None)
+            return Response(status=204)
+
+        data = self.objects.get(name)
+        if data is None:
+            return _error(404, 'NoSuchKey')
+        if request.method == 'HEAD':
+            response = Response(status=200)
+            response.headers['Content-Length'] = str(len(data))
+            response.headers['Last-Modified'] = http_date(self.modified.get(name, time.time()))
+            return response
+        headers = {}
+        if 'response-content-disposition' in args:
+            headers['Content-Disposition'] = args['response-content-disposition']
+        http_range = request.range
+        if http_range is not None:
+            start, stop = http_range.range_for_length(len(data))
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{len(data)}'
+            return Response(data[start:stop], status=206, headers=headers,
+                            content_type=args.get('response-content-type', 'application/octet-stream'))
+        return Response(data, headers=headers,
+                        content_type=args.get('response-content-type', 'application/octet-stream'))
@@ -1,8 +1,23 @@
 """API endpoint tests."""
 import pytest
+import base64
+import csv
+import fcntl
+import gzip
+import hashlib
 import io
+import json
 import os
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+from app import db, resumable, serialization
 from app.models import Document
+from app.storage import find_stored_file
+
+def stored_files(folder):
+    """Return the names of all files under the upload folder."""
+    return sorted(name for _, _, names in os.walk(folder) for name in names)
 
 class TestDocumentUpload:
     """Test document upload endpoint."""
@@ -73,6 +88,560 @@ class TestDocumentUpload:
         json_data = response.get_json()
         assert 'Invalid file type' in json_data['error']
 
+    def test_upload_records_size_and_hash(self, client, app):
+        """Test size and SHA-256 are recorded from the streamed upload."""
+        content = b'Streamed content ' * 1000
+        data = {
+            'file': (io.BytesIO(content), 'big.txt')
+        }
+        response = client.post('/api/documents', data=data, content_type='multipart/form-data')
+        
+        assert response.status_code == 201
+        document = response.get_json()['document']
+        assert document['file_size'] == len(content)
+        assert document['content_hash'] == hashlib.sha256(content).hexdigest()
+        assert stored_files(app.config['UPLOAD_FOLDER']) == [document['filename']]
+    
+    def test_rejected_upload_leaves_no_temp_file(self, client, app):
+        """Test temp files from rejected uploads are discarded."""
+        data = {
+            'file': (io.BytesIO(b'content'), 'test.exe')
+        }
+        response = client.post('/api/documents', data=data, content_type='multipart/form-data')
+        
+        assert response.status_code == 400
+        assert stored_files(app.config['UPLOAD_FOLDER']) == []
+
+class TestDeduplication:
+    """Test content-addressed storage of uploads."""
+    
+    def test_duplicate_upload_shares_blob(self, client, app):
+        """Test identical content is stored once and reference-counted."""
+        content = b'Same bytes every time'
+        first = client.post('/api/documents', data={
+            'file': (io.BytesIO(content), 'first.pdf')
+        }, content_type='multipart/form-data').get_json()
+        second = client.post('/api/documents', data={
+            'file': (io.BytesIO(content), 'second.pdf')
+        }, content_type='multipart/form-data').get_json()
+        
+        assert first['storage']['deduplicated'] is False
+        assert second['storage']['deduplicated'] is True
+        assert first['document']['id'] != second['document']['id']
+        assert first['document']['filename'] == second['document']['filename']
+        assert stored_files(app.config['UPLOAD_FOLDER']) == [first['document']['filename']]
+        
+        response = client.get(f"/api/documents/{second['document']['id']}")
+        assert response.data == content
+    
+    def test_metadata_reports_storage_saved(self, client):
+        """Test metadata includes the bytes saved by deduplication."""
+        content = b'x' * 100
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            response = client.post('/api/documents', data={
+                'file': (io.BytesIO(content), name)
+            }, content_type='multipart/form-data')
+        document_id = response.get_json()['document']['id']
+        
+        storage = client.get(f'/api/documents/{document_id}/metadata').get_json()['storage']
+        
+        assert storage['references'] == 3
+        assert storage['bytes_saved'] == 200
+
+class TestBatchUpload:
+    """Test batch upload endpoint."""
+    
+    def test_batch_upload_success(self, client, app):
+        """Test many files are stored in one request."""
+        data = {
+            'files': [(io.BytesIO(f'Batch {i}'.encode()), f'batch{i}.txt') for i in range(5)]
+        }
+        response = client.post('/api/documents/batch', data=data, content_type='multipart/form-data')
+        
+        assert response.status_code == 201
+        json_data = response.get_json()
+        assert json_data['succeeded'] == 5
+        assert [r['original_filename'] for r in json_data['results']] == [f'batch{i}.txt' for i in range(5)]
+        assert all(r['status'] == 201 for r in json_data['results'])
+        assert len(stored_files(app.config['UPLOAD_FOLDER'])) == 5
+        assert client.get('/api/documents').get_json()['pagination']['total_items'] == 5
+    
+    def test_batch_races_concurrent_upload(self, client, app, monkeypatch):
+        """Test a blob registered by another upload mid-batch is shared, not a failure."""
+        from app.models import Blob
+        from app.storage import IngestFile
+        commit = IngestFile.commit
+        engine = db.engine
+        
+        def commit_then_race(self, backend, key):
+            commit(self, backend, key)
+            # Another request inserts the same content before this batch does
+            with engine.begin() as connection:
+                connection.execute(db.insert(Blob).values(
+                    content_hash=key, filename=key, size=self.size, stored_size=self.size, ref_count=1,
+                    created_at=datetime.utcnow()))
+        
+        monkeypatch.setattr(IngestFile, 'commit', commit_then_race)
+        data = {'files': [(io.BytesIO(b'raced'), 'raced.txt'), (io.BytesIO(b'raced'), 'copy.txt')]}
+        response = client.post('/api/documents/batch', data=data, content_type='multipart/form-data')
+        
+        assert response.status_code == 201
+        assert response.get_json()['succeeded'] == 2
+        assert db.session.get(Blob, hashlib.sha256(b'raced').hexdigest()).ref_count == 3
+    
+    def test_batch_partial_failure(self, client, app):
+        """Test invalid files fail individually and leave no files behind."""
+        data = {
+            'files': [
+                (io.BytesIO(b'good'), 'good.txt'),
+                (io.BytesIO(b'bad'), 'bad.exe'),
+                (io.BytesIO(b'good'), 'copy.txt')
+            ]
+        }
+        response = client.post('/api/documents/batch', data=data, content_type='multipart/form-data')
+        
+        assert response.status_code == 207
+        results = response.get_json()['results']
+        assert [r['status'] for r in results] == [201, 400, 201]
+        assert 'Invalid file type' in results[1]['error']
+        assert results[0]['document']['filename'] == results[2]['document']['filename']
+        assert len(stored_files(app.config['UPLOAD_FOLDER'])) == 1
+        
+        metadata = client.get(f"/api/documents/{results[2]['document']['id']}/metadata").get_json()
+        assert metadata['storage']['references'] == 2
+    
+    def test_batch_no_files(self, client):
+        """Test a batch without files is rejected."""
+        response = client.post('/api/documents/batch', data={}, content_type='multipart/form-data')
+        
+        assert response.status_code == 400
+
+class TestDatabaseEngine:
+    """Test engine configuration and group commit."""
+    
+    def test_sqlite_pragmas(self, app):
+        """Test SQLite connections use WAL and a busy timeout."""
+        from app import db
+        with db.engine.connect() as connection:
+            assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+    
+    def test_group_commit_concurrent_uploads(self, client, app):
+        """Test concurrent uploads are committed through the group committer."""
+        from concurrent.futures import ThreadPoolExecutor
+        app.config['DB_GROUP_COMMIT'] = True
+        
+        def upload(i):
+            data = {
+                'file': (io.BytesIO(f'Grouped {i}'.encode()), f'group{i}.txt')
+            }
+            return app.test_client().post('/api/documents', data=data, content_type='multipart/form-data')
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(upload, range(16)))
+        
+        assert [r.status_code for r in responses] == [201] * 16, [r.get_json() for r in responses if r.status_code != 201]
+        assert len({r.get_json()['document']['id'] for r in responses}) == 16
+        assert client.get('/api/documents?limit=1&count=exact').get_json()['pagination']['total_items'] == 16
+
+class TestResumableUpload:
+    """Test resumable chunked upload endpoints."""
+    
+    def _create(self, client, content, filename='large.txt'):
+        response = client.post('/api/uploads', json={'filename': filename, 'size': len(content)})
+        assert response.status_code == 201
+        return response.headers['Location']
+    
+    def _patch(self, client, location, offset, chunk):
+        return client.patch(location, data=chunk, headers={
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': str(offset)
+        })
+    
+    def test_chunked_upload_creates_document(self, client, app):
+        """Test uploading in chunks and finalizing into a document."""
+        content = b'resumable ' * 1000
+        location = self._create(client, content)
+        
+        for offset in range(0, len(content), 4096):
+            response = self._patch(client, location, offset, content[offset:offset + 4096])
+            assert response.status_code == 204
+            assert int(response.headers['Upload-Offset']) == min(offset + 4096, len(content))
+        
+        response = client.post(f'{location}/complete')
+        assert response.status_code == 201
+        document = response.get_json()['document']
+        assert document['original_filename'] == 'large.txt'
+        assert document['file_size'] == len(content)
+        assert document['content_hash'] == hashlib.sha256(content).hexdigest()
+        
+        download = client.get(f"/api/documents/{document['id']}")
+        assert download.data == content
+        assert client.get(location).status_code == 404
+        assert not os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], '.resumable'))
+    
+    def test_resume_reports_offset(self, client):
+        """Test that HEAD and GET report the bytes received so far."""
+        content = b'0123456789' * 10
+        location = self._create(client, content)
+        self._patch(client, location, 0, content[:30])
+        
+        head = client.head(location)
+        assert head.status_code == 200
+        assert head.headers['Upload-Offset'] == '30'
+        assert head.headers['Upload-Length'] == '100'
+        assert client.get(location).get_json()['upload']['upload_offset'] == 30
+    
+    def test_offset_mismatch_conflict(self, client):
+        """Test that a chunk at the wrong offset is rejected."""
+        content = b'0123456789' * 10
+        location = self._create(client, content)
+        self._patch(client, location, 0, content[:30])
+        
+        response = self._patch(client, location, 10, content[10:40])
+        assert response.status_code == 409
+        assert response.headers['Upload-Offset'] == '30'
+    
+    def test_chunk_beyond_length_rejected(self, client):
+        """Test that bytes past the declared length are refused."""
+        location = self._create(client, b'12345')
+        response = self._patch(client, location, 0, b'1234567890')
+        assert response.status_code == 413
+    
+    def test_complete_incomplete_upload(self, client):
+        """Test that finalizing before all bytes arrive fails."""
+        location = self._create(client, b'0123456789')
+        self._patch(client, location, 0, b'01234')
+        
+        response = client.post(f'{location}/complete')
+        assert response.status_code == 409
+        assert response.get_json()['upload_offset'] == 5
+    
+    def test_complete_failure_keeps_session(self, client, app, monkeypatch):
+        """Test that a failed finalize leaves the upload in place to retry."""
+        content = b'retry me ' * 100
+        location = self._create(client, content)
+        self._patch(client, location, 0, content)
+        
+        def fail(*args, **kwargs):
+            raise RuntimeError('database unavailable')
+        
+        with monkeypatch.context() as m:
+            m.setattr('app.routes.register_blob', fail)
+            response = client.post(f'{location}/complete')
+        assert response.status_code == 500
+        assert client.head(location).headers['Upload-Offset'] == str(len(content))
+        
+        response = client.post(f'{location}/complete')
+        assert response.status_code == 201
+        assert response.get_json()['document']['file_size'] == len(content)
+        assert client.get(location).status_code == 404
+        assert not os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], '.resumable'))
+    
+    def test_complete_during_chunk_conflict(self, client, app):
+        """Test that finalizing while a chunk is being written is refused."""
+        content = b'0123456789'
+        location = self._create(client, content)
+        self._patch(client, location, 0, content)
+        
+        session_id = location.rsplit('/', 1)[-1]
+        with app.app_context():
+            with open(resumable.session_path(session_id), 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                response = client.post(f'{location}/complete')
+        assert response.status_code == 409
+        assert response.headers['Upload-Offset'] == '10'
+        assert client.post(f'{location}/complete').status_code == 201
+    
+    def test_tus_headers_create(self, client):
+        """Test creating a session with tus Upload-Length and Upload-Metadata headers."""
+        response = client.post('/api/uploads', headers={
+            'Upload-Length': '3',
+            'Upload-Metadata': 'filename ' + base64.b64encode(b'notes.txt').decode()
+        })
+        assert response.status_code == 201
+        assert response.headers['Tus-Resumable'] == '1.0.0'
+        assert response.get_json()['upload']['original_filename'] == 'notes.txt'
+    
+    def test_create_invalid_type(self, client):
+        """Test that disallowed extensions are rejected up front."""
+        response = client.post('/api/uploads', json={'filename': 'evil.exe', 'size': 10})
+        assert response.status_code == 400
+    
+    def test_create_too_large(self, client, app):
+        """Test that sizes above RESUMABLE_MAX_SIZE are rejected."""
+        size = app.config['RESUMABLE_MAX_SIZE'] + 1
+        response = client.post('/api/uploads', json={'filename': 'big.pdf', 'size': size})
+        assert response.status_code == 413
+    
+    def test_cancel_and_expire(self, client, app):
+        """Test deleting a session and sweeping expired ones."""
+        location = self._create(client, b'abc')
+        assert client.delete(location).status_code == 204
+        assert client.get(location).status_code == 404
+        
+        app.config['RESUMABLE_SESSION_TTL'] = -1
+        location = self._create(client, b'abc')
+        assert client.get(location).status_code == 404
+        result = app.test_cli_runner().invoke(args=['expire-uploads'])
+        assert 'Removed 1 expired upload session(s)' in result.output
+
+class TestCompressedStorage:
+    """Test gzip storage of eligible file types and encoded downloads."""
+    
+    content = b'compressible line of text\n' * 200
+    
+    def _upload(self, client, content=None, name='notes.txt'):
+        response = client.post('/api/documents', data={
+            'file': (io.BytesIO(content or self.content), name)
+        }, content_type='multipart/form-data')
+        assert response.status_code == 201
+        return response.get_json()
+    
+    def test_txt_stored_compressed(self, client, app):
+        """Test that text is gzipped on disk and the sizes are recorded."""
+        json_data = self._upload(client)
+        document = json_data['document']
+        
+        assert document['storage_codec'] == 'gzip'
+        assert document['file_size'] == len(self.content)
+        assert document['stored_size'] < len(self.content)
+        assert document['content_hash'] == hashlib.sha256(self.content).hexdigest()
+        assert json_data['storage']['compression_saved'] == len(self.content) - document['stored_size']
+        
+        with app.app_context():
+            path = find_stored_file(document['filename'])
+        assert os.path.getsize(path) == document['stored_size']
+        with gzip.open(path) as f:
+            assert f.read() == self.content
+    
+    def test_incompressible_and_ineligible_stored_raw(self, client):
+        """Test that PDFs and content that does not shrink are stored as uploaded."""
+        pdf = self._upload(client, name='doc.pdf')['document']
+        assert pdf['storage_codec'] is None
+        assert pdf['stored_size'] == pdf['file_size']
+        
+        random_text = self._upload(client, content=os.urandom(2048), name='random.txt')['document']
+        assert random_text['storage_codec'] is None
+    
+    def test_download_with_gzip_accepted(self, client):
+        """Test that clients accepting gzip get the stored bytes with Content-Encoding."""
+        document = self._upload(client)['document']
+        
+        response = client.get(f"/api/documents/{document['id']}", headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert int(response.headers['Content-Length']) == document['stored_size']
+        assert gzip.decompress(response.data) == self.content
+    
+    def test_download_decoded_without_gzip(self, client):
+        """Test that other clients get the original bytes, streamed."""
+        document = self._upload(client)['document']
+        
+        response = client.get(f"/api/documents/{document['id']}")
+        assert 'Content-Encoding' not in response.headers
+        assert int(response.headers['Content-Length']) == len(self.content)
+        assert response.data == self.content
+    
+    def test_range_on_compressed_document(self, client):
+        """Test that ranges address the original bytes even when gzip is accepted."""
+        document = self._upload(client)['document']
+        
+        response = client.get(f"/api/documents/{document['id']}", headers={
+            'Range': 'bytes=100-199', 'Accept-Encoding': 'gzip'
+        })
+        assert response.status_code == 206
+        assert 'Content-Encoding' not in response.headers
+        assert response.data == self.content[100:200]
+    
+    def test_codings_have_distinct_etags(self, client):
+        """Test that gzip and identity responses never share a validator."""
+        document = self._upload(client)['document']
+        url = f"/api/documents/{document['id']}"
+        
+        identity_etag = client.get(url).headers['ETag']
+        gzip_etag = client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        assert identity_etag == f'"{document["content_hash"]}"'
+        assert gzip_etag == f'"{document["content_hash"]}-gzip"'
+        
+        assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag}).status_code == 304
+        assert client.get(url, headers={'If-None-Match': gzip_etag}).status_code == 200
+        
+        # Resuming with the gzip validator must not splice original bytes onto it
+        response = client.get(url, headers={
+            'Range': 'bytes=100-199', 'If-Range': gzip_etag, 'Accept-Encoding': 'gzip'
+        })
+        assert response.status_code == 200
+        assert response.headers['ETag'] == identity_etag
+        assert response.data == self.content
+    
+    def test_compression_disabled(self, client, app):
+        """Test that STORAGE_COMPRESSION=False stores text as uploaded."""
+        app.config['STORAGE_COMPRESSION'] = False
+        assert self._upload(client)['document']['storage_codec'] is None
+    
+    def test_search_reads_compressed_text(self, client):
+        """Test that compressed text is still indexed for search."""
+        self._upload(client, content=b'zebra quartz ' * 100)
+        
+        response = client.get('/api/documents/search?q=quartz')
+        assert len(response.get_json()['documents']) == 1
+
+class TestShardedLayout:
+    """Test the sharded upload folder layout and its migration."""
+    
+    def test_upload_is_sharded(self, client, app):
+        """Test new files are stored under two levels of hex prefixes."""
+        data = {
+            'file': (io.BytesIO(b'sharded'), 'sharded.txt')
+        }
+        filename = client.post('/api/documents', data=data, content_type='multipart/form-data').get_json()['document']['filename']
+        
+        assert os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename[:2], filename[2:4], filename))
+    
+    def test_migrate_flat_files(self, client, app, runner):
+        """Test legacy flat files stay readable and are moved by the migration."""
+        from app import db
+        upload_folder = app.config['UPLOAD_FOLDER']
+        for i in range(3):
+            filename = f'{i:032x}.txt'
+            with open(os.path.join(upload_folder, filename), 'wb') as f:
+                f.write(f'legacy {i}'.encode())
+            db.session.add(Document(filename=filename, original_filename=f'legacy{i}.txt',
+                                    file_size=8, file_type='txt'))
+        db.session.commit()
+        legacy_id = db.session.execute(db.select(Document.id).where(Document.filename == f'{1:032x}.txt')).scalar()
+        
+        assert client.get(f'/api/documents/{legacy_id}').data == b'legacy 1'
+        
+        result = runner.invoke(args=['migrate-layout', '--batch-size', '2'])
+        
+        assert 'Migration complete: 3 file(s) moved' in result.output
+        assert [e.name for e in os.scandir(upload_folder) if e.is_file()] == []
+        assert client.get(f'/api/documents/{legacy_id}').data == b'legacy 1'
+        
+        result = runner.invoke(args=['migrate-layout'])
+        assert 'Migration complete: 0 file(s) moved' in result.output
+
+class TestReconciliation:
+    """Test the storage reconciliation scan and the download path trusting its marks."""
+    
+    def _upload(self, client, content, name='doc.txt'):
+        data = {
+            'file': (io.BytesIO(content), name)
+        }
+        return client.post('/api/documents', data=data, content_type='multipart/form-data').get_json()['document']
+    
+    def test_missing_file_is_marked_and_healed(self, client, app, runner, monkeypatch):
+        """Test missing files are marked, served as 404 and restored by a re-upload."""
+        kept = self._upload(client, os.urandom(100), 'kept.pdf')
+        content = os.urandom(100)
+        lost = self._upload(client, content, 'lost.pdf')
+        os.remove(find_stored_file(lost['filename']))
+        
+        result = runner.invoke(args=['reconcile'])
+        assert 'Pass complete: 1 file(s) and 0 legacy document(s) checked, 1 missing' in result.output
+        assert db.session.get(Document, lost['id']).file_missing_at is not None
+        
+        # Neither download asks the filesystem whether the file exists
+        def no_exists_check(path):
+            raise AssertionError(f'exists() called for {path}')
+        with monkeypatch.context() as patch:
+            patch.setattr('app.blobstore.os.path.exists', no_exists_check)
+            assert client.get(f"/api/documents/{lost['id']}").status_code == 404
+            assert client.get(f"/api/documents/{kept['id']}").status_code == 200
+        
+        again = self._upload(client, content, 'again.pdf')
+        assert client.get(f"/api/documents/{lost['id']}").data == content
+        assert client.get(f"/api/documents/{again['id']}").data == content
+        assert db.session.get(Document, lost['id']).file_missing_at is None
+    
+    def test_orphans_are_quarantined(self, client, app, runner):
+        """Test unreferenced files are moved aside once older than the grace period."""
+        upload_folder = app.config['UPLOAD_FOLDER']
+        document = self._upload(client, b'referenced')
+        old_orphan = os.path.join(upload_folder, 'ab', 'cd', 'abcd' + '0' * 60)
+        new_orphan = os.path.join(upload_folder, 'ab', 'ce', 'abce' + '0' * 60)
+        for path in (old_orphan, new_orphan):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'orphan')
+        long_ago = time.time() - 2 * app.config['RECONCILE_ORPHAN_GRACE']
+        os.utime(old_orphan, (long_ago, long_ago))
+        with open(os.path.join(upload_folder, '.upload-inflight.part'), 'wb') as f:
+            f.write(b'temp file of an upload in progress')
+        
+        result = runner.invoke(args=['reconcile'])
+        
+        assert '3 file(s)' in result.output
+        assert '1 quarantined' in result.output
+        assert not os.path.exists(old_orphan)
+        assert os.path.isfile(os.path.join(upload_folder, '.quarantine', 'abcd' + '0' * 60))
+        assert os.path.isfile(new_orphan)
+        assert os.path.isfile(os.path.join(upload_folder, '.upload-inflight.part'))
+        assert client.get(f"/api/documents/{document['id']}").data == b'referenced'
+    
+    def test_failed_upload_leaves_file_for_scan(self, client, app, runner, monkeypatch):
+        """Test a failed upload keeps the blob file it wrote, which the scan later quarantines."""
+        def fail(*args):
+            raise RuntimeError('database unavailable')
+        monkeypatch.setattr('app.routes._record_document', fail)
+        content = b'written but never registered'
+        response = client.post('/api/documents', data={'file': (io.BytesIO(content), 'failed.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 500
+        
+        # Another upload of the same content may still be registering this file
+        content_hash = hashlib.sha256(content).hexdigest()
+        assert stored_files(app.config['UPLOAD_FOLDER']) == [content_hash]
+        
+        app.config['RECONCILE_ORPHAN_GRACE'] = 0
+        assert '1 quarantined' in runner.invoke(args=['reconcile']).output
+        assert os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], '.quarantine', content_hash))
+    
+    def test_stale_upload_temp_files_removed(self, app, runner):
+        """Test temp files of crashed uploads are deleted once past the grace period."""
+        upload_folder = app.config['UPLOAD_FOLDER']
+        stale, fresh = (os.path.join(upload_folder, f'.upload-{i:032x}.part') for i in (1, 2))
+        for path in (stale, fresh):
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+        an_hour_ago = time.time() - 3600
+        os.utime(stale, (an_hour_ago, an_hour_ago))
+        
+        app.config['RECONCILE_ORPHAN_GRACE'] = 60
+        assert '1 stale temp file(s) removed' in runner.invoke(args=['reconcile']).output
+        assert not os.path.exists(stale)
+        assert os.path.exists(fresh)
+    
+    def test_resumes_from_checkpoint(self, client, app):
+        """Test the scan checkpoints each batch and picks up where it stopped."""
+        from app.models import ReconcileState
+        from app.reconcile import reconcile, reconcile_batch
+        documents = [self._upload(client, os.urandom(50), f'doc{i}.pdf') for i in range(5)]
+        for document in documents[1::2]:
+            os.remove(find_stored_file(document['filename']))
+        db.session.add(Document(filename=f'{1:032x}.txt', original_filename='legacy.txt',
+                                file_size=6, file_type='txt'))
+        db.session.commit()
+        
+        first, completed = reconcile_batch(batch_size=2)
+        assert not completed
+        assert db.session.get(ReconcileState, 1).cursor is not None
+        
+        rest = reconcile(batch_size=2)
+        assert first['files'] + rest['files'] == 3
+        assert first['missing'] + rest['missing'] == 3
+        assert rest['documents'] == 1
+        state = db.session.get(ReconcileState, 1)
+        assert (state.passes_completed, state.cursor, state.phase) == (1, None, 'files')
+        assert [client.get(f"/api/documents/{document['id']}").status_code
+                for document in documents] == [200, 404, 200, 404, 200]
+        
+        # A new pass finds nothing more to do
+        assert reconcile(batch_size=2)['missing'] == 0
+
 class TestDocumentList:
     """Test document listing endpoint."""
     
@@ -142,6 +711,395 @@ class TestDocumentList:
         assert json_data['pagination']['has_next'] is True
         assert json_data['pagination']['has_prev'] is True
 
+class TestCursorPagination:
+    """Test keyset (cursor) pagination on the listing endpoint."""
+    
+    def _upload(self, client, count):
+        for i in range(count):
+            data = {
+                'file': (io.BytesIO(f'Content {i}'.encode()), f'test{i}.txt')
+            }
+            client.post('/api/documents', data=data, content_type='multipart/form-data')
+    
+    def test_cursor_walks_all_documents(self, client):
+        """Test following next_cursor visits every document exactly once."""
+        self._upload(client, 5)
+        
+        seen = []
+        response = client.get('/api/documents?limit=2')
+        while True:
+            json_data = response.get_json()
+            assert response.status_code == 200
+            assert 'total_items' not in json_data['pagination']
+            seen.extend(doc['id'] for doc in json_data['documents'])
+            if not json_data['pagination']['has_next']:
+                assert json_data['pagination']['next_cursor'] is None
+                break
+            cursor = json_data['pagination']['next_cursor']
+            response = client.get(f'/api/documents?limit=2&cursor={cursor}')
+        
+        assert seen == sorted(seen, reverse=True)
+        assert len(set(seen)) == 5
+    
+    def test_cursor_matches_page_mode(self, client):
+        """Test the first cursor page matches the first offset page."""
+        self._upload(client, 3)
+        
+        by_cursor = client.get('/api/documents?limit=3').get_json()['documents']
+        by_page = client.get('/api/documents?page=1&per_page=3').get_json()['documents']
+        
+        assert [d['id'] for d in by_cursor] == [d['id'] for d in by_page]
+    
+    def test_cursor_counts(self, client):
+        """Test opt-in exact and estimated totals."""
+        self._upload(client, 3)
+        
+        exact = client.get('/api/documents?limit=1&count=exact').get_json()
+        assert exact['pagination']['total_items'] == 3
+        
+        estimate = client.get('/api/documents?limit=1&count=estimate').get_json()
+        assert estimate['pagination']['total_items'] == 3
+        assert estimate['pagination']['total_is_estimate'] is True
+    
+    def test_invalid_cursor(self, client):
+        """Test a malformed cursor is rejected."""
+        response = client.get('/api/documents?cursor=not-a-cursor')
+        
+        assert response.status_code == 400
+        assert 'Invalid cursor' in response.get_json()['error']
+
+class TestExport:
+    """Test streaming metadata export."""
+    
+    def _upload(self, client, count):
+        for i in range(count):
+            data = {
+                'file': (io.BytesIO(f'Export {i}'.encode()), f'export{i}.txt')
+            }
+            client.post('/api/documents', data=data, content_type='multipart/form-data')
+    
+    def test_export_ndjson(self, client, app):
+        """Test that every document is streamed oldest first as NDJSON."""
+        app.config['EXPORT_BATCH_SIZE'] = 2
+        self._upload(client, 5)
+        
+        response = client.get('/api/documents/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert response.is_streamed
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [row['original_filename'] for row in rows] == [f'export{i}.txt' for i in range(5)]
+        assert set(rows[0]) == {'id', 'filename', 'original_filename', 'file_size',
+                                'file_type', 'content_hash', 'upload_timestamp'}
+    
+    def test_export_csv(self, client):
+        """Test the CSV format with a header row."""
+        self._upload(client, 3)
+        
+        response = client.get('/api/documents/export?format=csv')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+        assert len(rows) == 3
+        assert rows[0]['file_type'] == 'txt'
+    
+    def test_export_since(self, client):
+        """Test resuming an incremental sync from the last exported row."""
+        self._upload(client, 4)
+        rows = [json.loads(line) for line in client.get('/api/documents/export').data.decode().splitlines()]
+        last = rows[1]
+        
+        response = client.get('/api/documents/export', query_string={
+            'since': last['upload_timestamp'], 'since_id': last['id']
+        })
+        later = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [row['id'] for row in later] == [row['id'] for row in rows[2:]]
+        
+        response = client.get(f"/api/documents/export?since_id={rows[-1]['id']}")
+        assert response.data == b''
+    
+    def test_export_since_with_offset(self, client):
+        """Test that a since timestamp with a UTC offset is converted, not truncated."""
+        self._upload(client, 3)
+        rows = [json.loads(line) for line in client.get('/api/documents/export').data.decode().splitlines()]
+        since = datetime.fromisoformat(rows[0]['upload_timestamp']).replace(tzinfo=timezone.utc)
+        
+        response = client.get('/api/documents/export', query_string={
+            'since': since.astimezone(timezone(timedelta(hours=2))).isoformat(), 'since_id': rows[0]['id']
+        })
+        later = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [row['id'] for row in later] == [row['id'] for row in rows[1:]]
+    
+    def test_export_invalid_params(self, client):
+        """Test validation of format and since parameters."""
+        assert client.get('/api/documents/export?format=xml').status_code == 400
+        assert client.get('/api/documents/export?since=yesterday').status_code == 400
+        assert client.get('/api/documents/export?since_id=abc').status_code == 400
+
+class TestArchiveDownload:
+    """Test streaming ZIP downloads of several documents."""
+    
+    def _upload(self, client, content, name):
+        data = {'file': (io.BytesIO(content), name)}
+        return client.post('/api/documents', data=data, content_type='multipart/form-data').get_json()['document']['id']
+    
+    def test_archive_by_ids(self, client):
+        """Test entries keep the original bytes, request order and compression choice."""
+        text = b'Archived text ' * 500
+        pdf = b'%PDF-1.4 ' + os.urandom(2000)
+        text_id = self._upload(client, text, 'notes.txt')
+        pdf_id = self._upload(client, pdf, 'report.pdf')
+        
+        response = client.get(f'/api/documents/archive?ids={pdf_id},{text_id}')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        assert response.is_streamed
+        assert 'documents.zip' in response.headers['Content-Disposition']
+        
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            assert archive.testzip() is None
+            assert archive.namelist() == ['report.pdf', 'notes.txt']
+            assert archive.read('notes.txt') == text
+            assert archive.read('report.pdf') == pdf
+            assert archive.getinfo('report.pdf').compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo('notes.txt').compress_type == zipfile.ZIP_DEFLATED
+    
+    def test_duplicate_names(self, client):
+        """Test that repeated original filenames get numbered entries."""
+        ids = [self._upload(client, f'Version {i}'.encode(), name)
+               for i, name in enumerate(['draft.txt', 'draft.txt', 'DRAFT.txt'])]
+        
+        response = client.post('/api/documents/archive', json={'ids': ids})
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            assert archive.namelist() == ['draft.txt', 'draft (1).txt', 'DRAFT (2).txt']
+            assert archive.read('draft (1).txt') == b'Version 1'
+    
+    def test_single_document_filename_quoted(self, client, app):
+        """Test that the archive filename is quoted in Content-Disposition."""
+        document_id = self._upload(client, b'Quarterly', 'report.txt')
+        # Rows stored before filenames were sanitized may hold any name
+        with app.app_context():
+            db.session.get(Document, document_id).original_filename = 'q3 report; final.txt'
+            db.session.commit()
+        
+        response = client.get(f'/api/documents/archive?ids={document_id}')
+        assert response.headers['Content-Disposition'] == 'attachment; filename="q3 report; final.zip"'
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            assert archive.namelist() == ['q3 report; final.txt']
+    
+    def test_compression_level_applied(self, client, app):
+        """Test that COMPRESSION_LEVEL sets how hard entries are deflated."""
+        document_id = self._upload(client, b''.join(b'line %d of text\n' % i for i in range(5000)), 'long.txt')
+        
+        sizes = []
+        for level in (1, 9):
+            app.config['COMPRESSION_LEVEL'] = level
+            response = client.get(f'/api/documents/archive?ids={document_id}')
+            with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+                sizes.append(archive.getinfo('long.txt').compress_size)
+        assert sizes[1] < sizes[0]
+    
+    def test_archive_by_filter(self, client, app):
+        """Test selecting documents with the listing filters, capped per archive."""
+        self._upload(client, b'One', 'a.txt')
+        self._upload(client, b'%PDF-1.4 two', 'b.pdf')
+        self._upload(client, b'Three', 'c.txt')
+        
+        response = client.get('/api/documents/archive?file_type=txt')
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            assert archive.namelist() == ['a.txt', 'c.txt']
+        
+        app.config['MAX_ARCHIVE_DOCUMENTS'] = 1
+        assert client.get('/api/documents/archive?file_type=txt').status_code == 400
+    
+    def test_archive_errors(self, client, app, runner):
+        """Test validation and missing documents or files."""
+        document_id = self._upload(client, b'Present', 'present.txt')
+        
+        assert client.get('/api/documents/archive').status_code == 400
+        assert client.get('/api/documents/archive?ids=abc').status_code == 400
+        assert client.post('/api/documents/archive', json={'ids': 'x'}).status_code == 400
+        
+        response = client.get(f'/api/documents/archive?ids={document_id},99999')
+        assert response.status_code == 404
+        assert response.get_json()['missing'] == [99999]
+        
+        with app.app_context():
+            os.remove(find_stored_file(db.session.get(Document, document_id).filename))
+        # Archives trust the missing-file marks kept by the reconciliation scan
+        runner.invoke(args=['reconcile'])
+        response = client.get(f'/api/documents/archive?ids={document_id}')
+        assert response.status_code == 404
+        assert response.get_json()['missing'] == [document_id]
+
+class TestFilteringAndStats:
+    """Test listing filters, sort orders and aggregate stats."""
+    
+    def _upload(self, client, name, size):
+        # Random bytes keep each file unique and stored uncompressed
+        data = {
+            'file': (io.BytesIO(os.urandom(size)), name)
+        }
+        return client.post('/api/documents', data=data, content_type='multipart/form-data').get_json()['document']
+    
+    def _seed(self, client):
+        return [
+            self._upload(client, 'alpha.pdf', 500),
+            self._upload(client, 'beta.txt', 100),
+            self._upload(client, 'alphabet.pdf', 2000),
+            self._upload(client, 'gamma.docx', 800),
+        ]
+    
+    def test_filter_by_type_and_size(self, client):
+        """Test file_type and size range filters in both pagination modes."""
+        self._seed(client)
+        
+        names = [d['original_filename'] for d in client.get(
+            '/api/documents?file_type=pdf&min_size=600').get_json()['documents']]
+        assert names == ['alphabet.pdf']
+        
+        names = [d['original_filename'] for d in client.get(
+            '/api/documents?limit=10&file_type=pdf,docx&max_size=900').get_json()['documents']]
+        assert names == ['gamma.docx', 'alpha.pdf']
+    
+    def test_filter_by_prefix_and_date(self, client):
+        """Test filename prefix and upload date range filters."""
+        documents = self._seed(client)
+        
+        response = client.get('/api/documents?filename_prefix=alpha&sort=original_filename')
+        names = [d['original_filename'] for d in response.get_json()['documents']]
+        assert names == ['alpha.pdf', 'alphabet.pdf']
+        assert response.get_json()['pagination']['total_items'] == 2
+        
+        since = documents[2]['upload_timestamp']
+        response = client.get('/api/documents', query_string={'uploaded_after': since})
+        ids = {d['id'] for d in response.get_json()['documents']}
+        assert ids == {documents[2]['id'], documents[3]['id']}
+        
+        response = client.get('/api/documents', query_string={'uploaded_before': since})
+        ids = {d['id'] for d in response.get_json()['documents']}
+        assert ids == {documents[0]['id'], documents[1]['id']}
+    
+    def test_prefix_ending_in_highest_code_point(self, client):
+        """Test a prefix whose last character cannot be incremented."""
+        self._seed(client)
+        
+        for prefix in ('alpha\U0010ffff', '\U0010ffff'):
+            response = client.get('/api/documents', query_string={'filename_prefix': prefix})
+            assert response.status_code == 200
+            assert response.get_json()['documents'] == []
+    
+    def test_date_filter_with_offset(self, client):
+        """Test that filter timestamps with a UTC offset are converted to UTC."""
+        documents = self._seed(client)
+        since = datetime.fromisoformat(documents[2]['upload_timestamp']).replace(tzinfo=timezone.utc)
+        
+        response = client.get('/api/documents', query_string={
+            'uploaded_after': since.astimezone(timezone(timedelta(hours=2))).isoformat()
+        })
+        ids = {d['id'] for d in response.get_json()['documents']}
+        assert ids == {documents[2]['id'], documents[3]['id']}
+    
+    def test_cursor_with_custom_sort(self, client):
+        """Test keyset pagination over a non-default sort order."""
+        self._seed(client)
+        
+        sizes = []
+        response = client.get('/api/documents?limit=1&sort=-file_size')
+        while True:
+            json_data = response.get_json()
+            sizes.extend(d['file_size'] for d in json_data['documents'])
+            if not json_data['pagination']['has_next']:
+                break
+            cursor = json_data['pagination']['next_cursor']
+            response = client.get(f'/api/documents?limit=1&sort=-file_size&cursor={cursor}')
+        assert sizes == [2000, 800, 500, 100]
+        
+        # A cursor only continues the sort it was issued for
+        response = client.get(f'/api/documents?limit=1&cursor={cursor}')
+        assert response.status_code == 400
+    
+    def test_invalid_filters(self, client):
+        """Test rejection of malformed filters and sorts."""
+        assert client.get('/api/documents?min_size=-1').status_code == 400
+        assert client.get('/api/documents?max_size=big').status_code == 400
+        assert client.get('/api/documents?uploaded_after=yesterday').status_code == 400
+        assert client.get('/api/documents?sort=owner').status_code == 400
+    
+    def test_stats_maintained_on_upload(self, client, runner):
+        """Test that stats follow single, batch and duplicate uploads."""
+        self._seed(client)
+        client.post('/api/documents/batch', data={
+            'files': [(io.BytesIO(b'one'), 'one.txt'), (io.BytesIO(b'one'), 'again.txt')]
+        }, content_type='multipart/form-data')
+        
+        stats = client.get('/api/documents/stats').get_json()
+        assert stats['total_documents'] == 6
+        assert stats['total_bytes'] == 500 + 100 + 2000 + 800 + 3 + 3
+        assert stats['by_type']['pdf'] == {'documents': 2, 'bytes': 2500}
+        assert stats['by_type']['txt'] == {'documents': 3, 'bytes': 106}
+        
+        result = runner.invoke(args=['rebuild-stats'])
+        assert 'Counted 6 document(s), 3406 byte(s)' in result.output
+        assert client.get('/api/documents/stats').get_json() == stats
+
+class TestSparseFields:
+    """Test fields= projections and the JSON encoding of projected rows."""
+    
+    def _upload(self, client, count):
+        for i in range(count):
+            data = {
+                'file': (io.BytesIO(f'Sparse {i}'.encode()), f'sparse{i}.txt')
+            }
+            client.post('/api/documents', data=data, content_type='multipart/form-data')
+    
+    def test_list_fields_projection(self, client):
+        """Test that both pagination modes return only the requested fields."""
+        self._upload(client, 3)
+        
+        documents = client.get('/api/documents?fields=id,original_filename').get_json()['documents']
+        assert documents[0] == {'id': documents[0]['id'], 'original_filename': 'sparse2.txt'}
+        
+        response = client.get('/api/documents?limit=2&fields=file_size').get_json()
+        assert response['documents'] == [{'file_size': 8}, {'file_size': 8}]
+        next_page = client.get(
+            f"/api/documents?limit=2&fields=file_size&cursor={response['pagination']['next_cursor']}"
+        ).get_json()
+        assert len(next_page['documents']) == 1
+    
+    def test_projection_matches_to_dict(self, client, app):
+        """Test that projected rows serialize exactly like Document.to_dict()."""
+        self._upload(client, 1)
+        listed = client.get('/api/documents').get_json()['documents'][0]
+        
+        with app.app_context():
+            document = db.session.get(Document, listed['id'])
+            assert listed == document.to_dict()
+    
+    def test_metadata_fields(self, client):
+        """Test the fields parameter on the metadata endpoint."""
+        self._upload(client, 1)
+        document_id = client.get('/api/documents').get_json()['documents'][0]['id']
+        
+        response = client.get(f'/api/documents/{document_id}/metadata?fields=upload_timestamp')
+        document = response.get_json()['document']
+        assert list(document) == ['upload_timestamp']
+        assert datetime.fromisoformat(document['upload_timestamp'])
+    
+    def test_invalid_fields(self, client):
+        """Test that unknown fields are rejected."""
+        assert client.get('/api/documents?fields=id,owner').status_code == 400
+        assert client.get('/api/documents/1/metadata?fields=,').status_code == 400
+    
+    def test_stdlib_encoder_fallback(self, client, monkeypatch):
+        """Test that responses are identical without orjson installed."""
+        self._upload(client, 2)
+        fast = client.get('/api/documents').get_json()
+        
+        monkeypatch.setattr(serialization, 'orjson', None)
+        assert client.get('/api/documents').get_json() == fast
+
 class TestDocumentRetrieval:
     """Test document retrieval endpoint."""
     
@@ -189,6 +1147,582 @@ class TestDocumentRetrieval:
         assert json_data['document']['file_type'] == 'txt'
         assert 'upload_timestamp' in json_data['document']
 
+class TestBatchMetadata:
+    """Test batch metadata lookup."""
+    
+    def _upload(self, client, count):
+        ids = []
+        for i in range(count):
+            data = {
+                'file': (io.BytesIO(f'Batch metadata {i}'.encode()), f'meta{i}.txt')
+            }
+            response = client.post('/api/documents', data=data, content_type='multipart/form-data')
+            ids.append(response.get_json()['document']['id'])
+        return ids
+    
+    def test_post_preserves_order_and_marks_missing(self, client, app):
+        """Test results follow request order across chunks, with not-found markers."""
+        app.config['METADATA_BATCH_CHUNK_SIZE'] = 2
+        ids = self._upload(client, 4)
+        requested = [ids[3], 9999, ids[0], ids[2], ids[3]]
+        
+        response = client.post('/api/documents/metadata:batch', json={'ids': requested})
+        assert response.status_code == 200
+        json_data = response.get_json()
+        results = json_data['documents']
+        
+        assert [result['id'] for result in results] == requested
+        assert results[1] == {'id': 9999, 'error': 'Document not found'}
+        assert results[0]['original_filename'] == 'meta3.txt'
+        assert set(results[0]) == set(Document.FIELDS)
+        assert json_data['found'] == 4
+        assert json_data['missing'] == [9999]
+    
+    def test_get_with_field_projection(self, client):
+        """Test the GET form with a fields projection."""
+        ids = self._upload(client, 2)
+        
+        response = client.get(f'/api/documents/metadata:batch?ids={ids[1]},{ids[0]}&fields=original_filename,stored_size')
+        results = response.get_json()['documents']
+        assert results == [
+            {'original_filename': 'meta1.txt', 'stored_size': len(b'Batch metadata 1')},
+            {'original_filename': 'meta0.txt', 'stored_size': len(b'Batch metadata 0')}
+        ]
+    
+    def test_invalid_requests(self, client, app):
+        """Test validation of ids, fields and the batch size limit."""
+        url = '/api/documents/metadata:batch'
+        assert client.post(url, json={}).status_code == 400
+        assert client.post(url, json={'ids': ['a']}).status_code == 400
+        assert client.post(url, json={'ids': [1], 'fields': ['secret']}).status_code == 400
+        assert client.get(url).status_code == 400
+        
+        app.config['MAX_METADATA_BATCH'] = 2
+        assert client.post(url, json={'ids': [1, 2, 3]}).status_code == 400
+
+class TestConditionalDownload:
+    """Test ETag, conditional GET and Range support on downloads."""
+    
+    content = b'0123456789abcdefghij'
+    
+    def _upload(self, client):
+        data = {
+            'file': (io.BytesIO(self.content), 'ranges.pdf')
+        }
+        response = client.post('/api/documents', data=data, content_type='multipart/form-data')
+        return response.get_json()['document']
+    
+    def test_etag_is_content_hash(self, client):
+        """Test downloads carry a strong ETag from the stored hash."""
+        document = self._upload(client)
+        
+        response = client.get(f"/api/documents/{document['id']}")
+        
+        assert response.status_code == 200
+        assert response.headers['ETag'] == f'"{document["content_hash"]}"'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        assert response.data == self.content
+    
+    def test_if_none_match_returns_304(self, client, app):
+        """Test revalidation does not need the file on disk."""
+        document = self._upload(client)
+        filename = document['filename']
+        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], filename[:2], filename[2:4], filename))
+        
+        response = client.get(f"/api/documents/{document['id']}",
+                              headers={'If-None-Match': f'"{document["content_hash"]}"'})
+        
+        assert response.status_code == 304
+        assert response.data == b''
+    
+    def test_single_range(self, client):
+        """Test a single byte range returns 206."""
+        document = self._upload(client)
+        
+        response = client.get(f"/api/documents/{document['id']}", headers={'Range': 'bytes=5-9'})
+        
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 5-9/20'
+        assert response.data == b'56789'
+    
+    def test_multiple_ranges(self, client):
+        """Test multiple ranges return multipart/byteranges."""
+        document = self._upload(client)
+        
+        response = client.get(f"/api/documents/{document['id']}", headers={'Range': 'bytes=0-1,-3'})
+        
+        assert response.status_code == 206
+        assert response.mimetype == 'multipart/byteranges'
+        assert int(response.headers['Content-Length']) == len(response.data)
+        assert b'Content-Range: bytes 0-1/20\r\n\r\n01' in response.data
+        assert b'Content-Range: bytes 17-19/20\r\n\r\nhij' in response.data
+    
+    def test_unsatisfiable_range(self, client):
+        """Test a range past the end returns 416."""
+        document = self._upload(client)
+        
+        response = client.get(f"/api/documents/{document['id']}", headers={'Range': 'bytes=50-60'})
+        
+        assert response.status_code == 416
+        assert response.headers['Content-Range'] == 'bytes */20'
+    
+    def test_offload_headers(self, client, app):
+        """Test proxy offload emits X-Accel-Redirect instead of the body."""
+        document = self._upload(client)
+        app.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+        
+        response = client.get(f"/api/documents/{document['id']}")
+        
+        assert response.status_code == 200
+        filename = document['filename']
+        assert response.headers['X-Accel-Redirect'] == f"/protected-uploads/{filename[:2]}/{filename[2:4]}/{filename}"
+        assert response.data == b''
+
+    def test_compressed_documents_not_offloaded(self, client, app):
+        """Test gzip-stored documents are sent by the app, never through the proxy."""
+        content = b'compressible line of text\n' * 200
+        document = client.post('/api/documents', data={'file': (io.BytesIO(content), 'notes.txt')},
+                               content_type='multipart/form-data').get_json()['document']
+        assert document['storage_codec'] == 'gzip'
+        app.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+        
+        response = client.get(f"/api/documents/{document['id']}", headers={'Accept-Encoding': 'gzip'})
+        
+        assert 'X-Accel-Redirect' not in response.headers
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data) == content
+
+def make_pdf(pages):
+    """Build a minimal PDF with one line of text per page."""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None,
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for text in pages:
+        content = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'
+        objects.append(f'<< /Length {len(content)} >>\nstream\n{content}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R '
+                       f'/Resources << /Font << /F1 3 0 R >> >> >>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>"
+    
+    pdf, offsets = b'%PDF-1.4\n', []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f'{number} 0 obj\n{body}\nendobj\n'.encode()
+    xref = len(pdf)
+    pdf += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    pdf += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode()
+    pdf += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return pdf
+
+def make_docx(paragraphs):
+    """Build a DOCX with the given paragraphs and a table after the first."""
+    import docx
+    document = docx.Document()
+    for index, text in enumerate(paragraphs):
+        document.add_paragraph(text)
+        if index == 0:
+            document.add_table(rows=1, cols=1).cell(0, 0).text = 'Table cell'
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+class TestPreview:
+    """Test page counts and page-level text previews."""
+    
+    def _upload(self, client, content, name):
+        data = {'file': (io.BytesIO(content), name)}
+        return client.post('/api/documents', data=data, content_type='multipart/form-data').get_json()['document']
+    
+    def test_pdf_page_text(self, client):
+        """Test the page count is recorded on upload and one page is extracted."""
+        document = self._upload(client, make_pdf(['Page one', 'Page two', 'Page three']), 'long.pdf')
+        assert document['page_count'] == 3
+        
+        response = client.get(f"/api/documents/{document['id']}/pages/2/text")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['page'] == 2
+        assert data['page_count'] == 3
+        assert 'Page two' in data['text']
+        
+        assert client.get(f"/api/documents/{document['id']}/pages/4/text").status_code == 404
+        assert client.get(f"/api/documents/{document['id']}/pages/0/text").status_code == 404
+    
+    def test_page_text_cached(self, client, app):
+        """Test repeated previews are served from the cache without opening the file."""
+        document = self._upload(client, make_pdf(['Cached page']), 'cached.pdf')
+        assert client.get(f"/api/documents/{document['id']}/pages/1/text").status_code == 200
+        
+        with app.app_context():
+            os.remove(find_stored_file(document['filename']))
+        response = client.get(f"/api/documents/{document['id']}/pages/1/text")
+        assert response.status_code == 200
+        assert 'Cached page' in response.get_json()['text']
+        
+        stats = client.get('/api/cache/stats').get_json()['preview_cache']
+        assert stats['hits'] == 1
+        assert stats['bytes'] > 0
+    
+    def test_docx_paragraphs(self, client, app):
+        """Test paragraph ranges, counting only body paragraphs."""
+        document = self._upload(client, make_docx([f'Paragraph {i}' for i in range(1, 31)]), 'notes.docx')
+        assert document['page_count'] == 30
+        
+        url = f"/api/documents/{document['id']}/paragraphs/text"
+        data = client.get(url, query_string={'start': 3, 'end': 5}).get_json()
+        assert data['paragraphs'] == ['Paragraph 3', 'Paragraph 4', 'Paragraph 5']
+        assert data['paragraph_count'] == 30
+        
+        data = client.get(url, query_string={'start': 29, 'end': 40}).get_json()
+        assert data['paragraphs'] == ['Paragraph 29', 'Paragraph 30']
+        assert data['end'] == 30
+        
+        assert client.get(url, query_string={'start': 31}).status_code == 404
+        assert client.get(url, query_string={'start': 5, 'end': 4}).status_code == 400
+        app.config['PREVIEW_MAX_PARAGRAPHS'] = 2
+        assert client.get(url, query_string={'start': 1, 'end': 3}).status_code == 400
+    
+    def test_preview_wrong_type(self, client):
+        """Test types without previews have no page count and are rejected."""
+        document = self._upload(client, b'Plain text', 'plain.txt')
+        assert document['page_count'] is None
+        assert client.get(f"/api/documents/{document['id']}/pages/1/text").status_code == 400
+        assert client.get(f"/api/documents/{document['id']}/paragraphs/text").status_code == 400
+        assert client.get('/api/documents/99999/pages/1/text').status_code == 404
+    
+    def test_cache_bounded_by_size(self):
+        """Test least recently used entries are evicted past max_bytes."""
+        from app.cache import MemoryCache
+        cache = MemoryCache(max_entries=100, ttl=60, max_bytes=25)
+        cache.set('a', 'x' * 10)
+        cache.set('b', 'y' * 10)
+        cache.get('a')
+        cache.set('c', 'z' * 10)
+        
+        assert cache.get('b') is None
+        assert cache.get('a') == 'x' * 10
+        assert cache.stats()['bytes'] == 20
+        cache.set('huge', 'w' * 30)
+        assert cache.get('huge') is None
+
+class TestSearch:
+    """Test full-text search endpoint."""
+    
+    def _upload(self, client, content, name):
+        data = {
+            'file': (io.BytesIO(content), name)
+        }
+        return client.post('/api/documents', data=data, content_type='multipart/form-data').get_json()
+    
+    def test_search_finds_uploaded_text(self, client):
+        """Test text is indexed on upload and returned with a snippet."""
+        match = self._upload(client, b'The quarterly invoice for acme corp', 'invoice.txt')
+        self._upload(client, b'Meeting notes about the roadmap', 'notes.txt')
+        
+        response = client.get('/api/documents/search?q=invoice acme')
+        
+        assert response.status_code == 200
+        results = response.get_json()['documents']
+        assert [r['id'] for r in results] == [match['document']['id']]
+        assert '<b>invoice</b>' in results[0]['snippet']
+    
+    def test_search_ignores_query_syntax(self, client):
+        """Test FTS operators in user input do not cause errors."""
+        self._upload(client, b'plain text', 'plain.txt')
+        
+        response = client.get('/api/documents/search?q="unbalanced AND (')
+        
+        assert response.status_code == 200
+        assert response.get_json()['documents'] == []
+    
+    def test_search_requires_query(self, client):
+        """Test an empty query is rejected."""
+        response = client.get('/api/documents/search?q=')
+        
+        assert response.status_code == 400
+    
+    def test_reindex_command(self, client, runner):
+        """Test the reindex command rebuilds the index."""
+        self._upload(client, b'searchable words', 'words.txt')
+        
+        result = runner.invoke(args=['reindex', '--rebuild', '--workers', '1'])
+        
+        assert 'Indexed 1 blob(s)' in result.output
+        results = client.get('/api/documents/search?q=searchable').get_json()['documents']
+        assert len(results) == 1
+
+    def test_reindex_hashes_legacy_documents(self, client, app, runner):
+        """Test documents stored before content hashing are moved into blobs and indexed."""
+        upload_folder = app.config['UPLOAD_FOLDER']
+        for i, words in enumerate([b'ancient ledger', b'ancient ledger', b'forgotten memo']):
+            with open(os.path.join(upload_folder, f'{i:032x}.txt'), 'wb') as f:
+                f.write(words)
+            db.session.add(Document(filename=f'{i:032x}.txt', original_filename=f'old{i}.txt',
+                                    file_size=len(words), file_type='txt'))
+        db.session.add(Document(filename=f'{9:032x}.txt', original_filename='lost.txt', file_size=4, file_type='txt'))
+        db.session.commit()
+        
+        result = runner.invoke(args=['reindex', '--workers', '1'])
+        
+        assert 'Indexed 2 blob(s)' in result.output
+        results = client.get('/api/documents/search?q=ledger').get_json()['documents']
+        assert sorted(r['original_filename'] for r in results) == ['old0.txt', 'old1.txt']
+        assert results[0]['content_hash'] == hashlib.sha256(b'ancient ledger').hexdigest()
+        assert client.get(f"/api/documents/{results[0]['id']}").data == b'ancient ledger'
+        assert not os.path.exists(os.path.join(upload_folder, f'{0:032x}.txt'))
+        assert db.session.execute(db.select(Document.content_hash).where(
+            Document.original_filename == 'lost.txt')).scalar() is None
+    
+class TestCache:
+    """Test metadata and listing cache."""
+    
+    def _upload(self, client, content, name):
+        data = {
+            'file': (io.BytesIO(content), name)
+        }
+        return client.post('/api/documents', data=data, content_type='multipart/form-data').get_json()
+    
+    def test_list_cache_invalidated_by_upload(self, client):
+        """Test a cached listing page is refreshed after an upload commits."""
+        self._upload(client, b'one', 'one.txt')
+        assert client.get('/api/documents').get_json()['pagination']['total_items'] == 1
+        assert client.get('/api/documents').get_json()['pagination']['total_items'] == 1
+        
+        self._upload(client, b'two', 'two.txt')
+        
+        assert client.get('/api/documents').get_json()['pagination']['total_items'] == 2
+    
+    def test_metadata_cache_hits(self, client):
+        """Test repeated metadata reads are served from the cache."""
+        document_id = self._upload(client, b'cached', 'cached.txt')['document']['id']
+        
+        client.get(f'/api/documents/{document_id}/metadata')
+        before = client.get('/api/cache/stats').get_json()['cache']
+        client.get(f'/api/documents/{document_id}/metadata')
+        after = client.get('/api/cache/stats').get_json()['cache']
+        
+        assert after['hits'] == before['hits'] + 2
+        assert after['misses'] == before['misses']
+    
+    def test_storage_info_invalidated_by_duplicate(self, client):
+        """Test cached storage info reflects a later duplicate upload."""
+        document_id = self._upload(client, b'same', 'a.txt')['document']['id']
+        assert client.get(f'/api/documents/{document_id}/metadata').get_json()['storage']['references'] == 1
+        
+        self._upload(client, b'same', 'b.txt')
+        
+        assert client.get(f'/api/documents/{document_id}/metadata').get_json()['storage']['references'] == 2
+    
+    def test_metadata_without_blob(self, client, app):
+        """Test a cached document whose blob row is gone is served without storage info."""
+        from app.cache import blob_key, get_cache
+        from app.models import Blob
+        document = self._upload(client, b'discarded', 'gone.txt')['document']
+        client.get(f"/api/documents/{document['id']}/metadata")
+        
+        get_cache().delete(blob_key(document['content_hash']))
+        db.session.execute(db.delete(Blob).where(Blob.content_hash == document['content_hash']))
+        db.session.commit()
+        response = client.get(f"/api/documents/{document['id']}/metadata")
+        
+        assert response.status_code == 200
+        assert response.get_json()['document']['id'] == document['id']
+        assert 'storage' not in response.get_json()
+    
+    def test_lru_eviction(self):
+        """Test the memory cache evicts least recently used entries."""
+        from app.cache import MemoryCache
+        cache = MemoryCache(max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.stats()['evictions'] == 1
+
+class TestMetrics:
+    """Test the Prometheus metrics endpoint and slow-request profiling."""
+    
+    def test_metrics_record_requests(self, client):
+        """Test that latency, SQL, byte and file-save metrics are exposed."""
+        data = {
+            'file': (io.BytesIO(b'metrics content'), 'metrics.txt')
+        }
+        document_id = client.post('/api/documents', data=data,
+                                  content_type='multipart/form-data').get_json()['document']['id']
+        client.get(f'/api/documents/{document_id}')
+        
+        response = client.get('/api/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        body = response.data.decode()
+        assert '# TYPE docapi_http_request_duration_seconds histogram' in body
+        assert ('docapi_http_request_duration_seconds_count'
+                '{method="POST",route="/api/documents",status="201"} 1') in body
+        assert 'docapi_http_response_bytes_total{route="/api/documents/<int:document_id>"} 15' in body
+        assert 'docapi_file_save_duration_seconds_count 1' in body
+        assert 'docapi_http_request_sql_queries_count{route="/api/documents"} 1' in body
+    
+    def test_metrics_count_streamed_bytes(self, client, app):
+        """Test that generated response bodies are counted as they are sent."""
+        client.post('/api/documents', data={'file': (io.BytesIO(b'abc'), 'a.txt')},
+                    content_type='multipart/form-data')
+        exported = client.get('/api/documents/export').data
+        
+        metrics = app.extensions['metrics']
+        assert metrics.bytes_sent.value(route='/api/documents/export') == len(exported)
+    
+    def test_metrics_summed_across_workers(self, client, app, tmp_path):
+        """Test that snapshots written by other workers are added to the scraped one."""
+        from app.metrics import Metrics
+        app.config['METRICS_DIR'] = str(tmp_path)
+        client.get('/api/documents')
+        
+        other = Metrics()
+        other.request_duration.observe(0.01, method='GET', route='/api/documents', status='200')
+        other.uploads_active.set(2)
+        # A live worker, and one that exited (above the largest Linux pid)
+        for pid in (os.getppid(), 4194305):
+            with open(tmp_path / f'metrics-{pid}.json', 'w') as f:
+                json.dump(other.snapshot(), f)
+        
+        body = client.get('/api/metrics').data.decode()
+        assert ('docapi_http_request_duration_seconds_count'
+                '{method="GET",route="/api/documents",status="200"} 3') in body
+        assert 'docapi_uploads_active 2' in body
+    
+    def test_file_save_includes_streamed_ingest(self, client, app, monkeypatch):
+        """Test that hashing and writing done while the body streams in is timed."""
+        sha256 = hashlib.sha256
+        
+        class SlowHash:
+            def __init__(self):
+                self._hash = sha256()
+            
+            def update(self, data):
+                time.sleep(0.05)
+                self._hash.update(data)
+            
+            def hexdigest(self):
+                return self._hash.hexdigest()
+        
+        monkeypatch.setattr('app.storage.hashlib.sha256', SlowHash)
+        client.post('/api/documents', data={'file': (io.BytesIO(b'timed content'), 'timed.txt')},
+                    content_type='multipart/form-data')
+        
+        body = client.get('/api/metrics').data.decode()
+        total = next(line for line in body.splitlines() if line.startswith('docapi_file_save_duration_seconds_sum'))
+        assert float(total.split()[-1]) >= 0.05
+    
+    def test_failed_statement_drops_start_time(self, app):
+        """Test that a statement that raises does not leave its start time behind."""
+        with app.app_context(), db.engine.connect() as connection:
+            with pytest.raises(Exception):
+                connection.exec_driver_sql('SELECT * FROM no_such_table')
+            assert connection.info['query_start'] == []
+    
+    def test_slow_request_profile(self, client, app, tmp_path):
+        """Test that requests over the threshold dump a cProfile."""
+        app.config['PROFILE_SLOW_REQUESTS'] = 0
+        app.config['PROFILE_DIR'] = str(tmp_path)
+        
+        client.get('/api/documents')
+        
+        profiles = os.listdir(tmp_path)
+        assert len(profiles) == 1
+        assert profiles[0].endswith('.prof')
+        assert 'GET-api_documents' in profiles[0]
+
+class TestAdmissionControl:
+    """Test upload admission limits and their rejections."""
+    
+    def _install(self, app, **limits):
+        from app.admission import AdmissionController
+        controller = AdmissionController(metrics=app.extensions['metrics'], **limits)
+        app.extensions['upload_admission'] = controller
+        return controller
+    
+    def _upload(self, client, content=b'admitted content', name='admitted.txt'):
+        return client.post('/api/documents', data={'file': (io.BytesIO(content), name)},
+                           content_type='multipart/form-data')
+    
+    def test_queue_full_rejects_with_retry_after(self, client, app):
+        """Test that uploads beyond the limit and queue get a fast 429."""
+        controller = self._install(app, max_concurrent=1, queue_size=0)
+        ticket = controller.acquire(0)
+        
+        response = self._upload(client)
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+        assert 'retry later' in response.get_json()['error']
+        
+        controller.release(ticket)
+        assert self._upload(client).status_code == 201
+        
+        stats = client.get('/api/admission/stats').get_json()['admission']
+        assert stats['admitted'] == 2
+        assert stats['active'] == 0
+        assert stats['rejected'] == {'queue_full': 1, 'timeout': 0}
+    
+    def test_queued_upload_times_out(self, client, app):
+        """Test that uploads waiting too long get a 503."""
+        controller = self._install(app, max_concurrent=1, queue_size=1, queue_timeout=0.05)
+        controller.acquire(0)
+        
+        response = self._upload(client)
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+        assert controller.stats()['queued'] == 0
+    
+    def test_queued_upload_runs_when_slot_frees(self, app):
+        """Test that a queued upload proceeds once an earlier one finishes."""
+        from concurrent.futures import ThreadPoolExecutor
+        controller = self._install(app, max_concurrent=1, queue_size=1, queue_timeout=10)
+        ticket = controller.acquire(0)
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._upload, app.test_client())
+            while controller.stats()['queued'] == 0:
+                time.sleep(0.01)
+            controller.release(ticket)
+            assert future.result().status_code == 201
+        
+        assert controller.stats()['peak_queued'] == 1
+    
+    def test_byte_limit_leaves_reads_unaffected(self, client, app):
+        """Test the in-flight byte limit, and that reads are never held back."""
+        document_id = self._upload(client).get_json()['document']['id']
+        controller = self._install(app, max_bytes=10000, queue_size=0)
+        ticket = controller.acquire(9000)
+        
+        assert self._upload(client, b'x' * 2000, 'large.txt').status_code == 429
+        assert client.get(f'/api/documents/{document_id}').status_code == 200
+        assert client.get(f'/api/documents/{document_id}/metadata').status_code == 200
+        
+        controller.release(ticket)
+        # A single upload over the limit is admitted when nothing else is in flight
+        controller.max_bytes = 100
+        assert self._upload(client, b'y' * 2000, 'alone.txt').status_code == 201
+    
+    def test_admission_metrics(self, client, app):
+        """Test that queue depth and rejections are exported."""
+        controller = self._install(app, max_concurrent=1, queue_size=0)
+        controller.acquire(0)
+        self._upload(client)
+        
+        body = client.get('/api/metrics').data.decode()
+        assert 'docapi_uploads_rejected_total{reason="queue_full"} 1' in body
+        assert 'docapi_uploads_active 1' in body
+        assert '# TYPE docapi_uploads_queued gauge' in body
+    
+    def test_disabled_by_default(self, client):
+        """Test that no limits apply unless configured."""
+        assert client.get('/api/admission/stats').get_json() == {'admission': None}
+        assert self._upload(client).status_code == 201
+
 class TestErrorHandling:
     """Test error handling."""
     
@@ -0,0 +1,94 @@
+"""Benchmark suite tests."""
+import copy
+import json
+import os
+from app import create_app, db
+from app.models import Blob, Document
+from benchmarks.__main__ import main
+from benchmarks.compare import compare
+from benchmarks.load import percentile, summarize
+from benchmarks.seed import app_config, seed
+
+def _result(p95=10.0, throughput=100.0, errors=0):
+    return {'scenarios': {'metadata': {
+        'errors': errors,
+        'throughput_rps': throughput,
+        'latency_ms': {'p50': 5.0, 'p95': p95, 'p99': 20.0}
+    }}}
+
+class TestSeed:
+    """Test benchmark data seeding."""
+
+    def test_seed_creates_documents_and_files(self, tmp_path):
+        """Test that seeding fills the database and the upload folder."""
+        manifest = seed(str(tmp_path), 250, blobs=20)
+
+        assert manifest['documents'] == 250
+        assert manifest['id_range'] == [1, 250]
+        assert json.loads((tmp_path / 'seed.json').read_text()) == manifest
+
+        app = create_app(app_config(str(tmp_path)))
+        with app.app_context():
+            assert db.session.execute(db.select(db.func.count()).select_from(Document)).scalar() == 250
+            assert db.session.execute(db.select(db.func.sum(Blob.ref_count))).scalar() == 250
+            db.session.remove()
+            db.engine.dispose()
+        stored = [name for _, _, names in os.walk(tmp_path / 'uploads') for name in names]
+        assert len(stored) == 20
+
+class TestStatistics:
+    """Test latency summaries and run comparison."""
+
+    def test_percentiles(self):
+        """Test nearest-rank percentiles."""
+        values = list(range(1, 101))
+        assert percentile(values, 0.50) == 50
+        assert percentile(values, 0.99) == 99
+        assert percentile([7], 0.95) == 7
+        assert percentile([], 0.5) is None
+
+    def test_summarize(self):
+        """Test throughput and millisecond conversion."""
+        summary = summarize([0.002, 0.001, 0.003, 0.004], errors=1, elapsed=2.0)
+        assert summary['requests'] == 4
+        assert summary['throughput_rps'] == 2.0
+        assert summary['latency_ms']['p50'] == 2.0
+        assert summary['latency_ms']['max'] == 4.0
+
+    def test_compare_flags_regressions(self):
+        """Test that slowdowns beyond the threshold are flagged."""
+        rows = compare(_result(), _result(p95=10.5, throughput=95.0), threshold=0.10)
+        assert not any(row['regression'] for row in rows)
+
+        rows = compare(_result(), _result(p95=12.0, throughput=80.0), threshold=0.10)
+        flagged = {row['metric'] for row in rows if row['regression']}
+        assert flagged == {'p95', 'throughput_rps'}
+
+        rows = compare(_result(), _result(errors=3))
+        assert [row['metric'] for row in rows if row['regression']] == ['errors']
+
+    def test_compare_command_exit_code(self, tmp_path):
+        """Test that the compare command fails when a regression is found."""
+        baseline, candidate = tmp_path / 'base.json', tmp_path / 'new.json'
+        baseline.write_text(json.dumps(_result()))
+        candidate.write_text(json.dumps(copy.deepcopy(_result(p95=20.0))))
+
+        assert main(['compare', str(baseline), str(baseline)]) == 0
+        assert main(['compare', str(baseline), str(candidate)]) == 1
+
+class TestRun:
+    """Test a short end-to-end run against a real server."""
+
+    def test_run_writes_results(self, tmp_path):
+        """Test that a run measures the chosen scenarios and saves JSON."""
+        output = tmp_path / 'results.json'
+        main(['run', '--workdir', str(tmp_path / 'data'), '--documents', '50',
+              '--scenarios', 'metadata,upload', '--duration', '0.3', '--warmup', '0',
+              '--concurrency', '2', '--output', str(output)])
+
+        results = json.loads(output.read_text())
+        assert results['meta']['documents'] == 50
+        assert set(results['scenarios']) == {'metadata', 'upload'}
+        for summary in results['scenarios'].values():
+            assert summary['requests'] > 0
+            assert summary['errors'] == 0
@@ -0,0 +1,266 @@
+"""Tests for schema setup and the multi-process production server."""
+import http.client
+import io
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+import pytest
+from app import create_app, db
+from app.models import SchemaVersion
+from app.schema import SCHEMA_VERSION, check_schema, init_schema, schema_version
+from app.server import WorkerServer
+
+class TestSchema:
+    """Test the one-time schema setup and the startup version check."""
+
+    def test_init_db(self, tmp_path):
+        """Test that init-db creates the schema once and workers can then start."""
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads')
+        })
+        runner = app.test_cli_runner()
+        with app.app_context():
+            assert schema_version() is None
+            with pytest.raises(RuntimeError, match='not initialized'):
+                check_schema()
+
+            assert 'Created schema version' in runner.invoke(args=['init-db']).output
+            assert 'Schema is up to date' in runner.invoke(args=['init-db']).output
+            check_schema()
+            assert os.path.isdir(tmp_path / 'uploads')
+            db.engine.dispose()
+
+    def test_upgrade_unversioned_database(self, tmp_path):
+        """Test that databases created before versioning gain missing columns and indexes."""
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads')
+        })
+        with app.app_context():
+            db.create_all()
+            SchemaVersion.__table__.drop(db.engine)
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql('ALTER TABLE documents DROP COLUMN page_count')
+                connection.exec_driver_sql('DROP INDEX ix_documents_upload_timestamp_id')
+                connection.exec_driver_sql('DROP INDEX ix_documents_content_hash')
+            assert schema_version() == 0
+
+            assert init_schema() == (0, SCHEMA_VERSION)
+            columns = [row[1] for row in db.session.execute(db.text('PRAGMA table_info(documents)'))]
+            assert 'page_count' in columns
+            indexes = {index['name'] for index in db.inspect(db.engine).get_indexes('documents')}
+            assert {'ix_documents_upload_timestamp_id', 'ix_documents_content_hash'} <= indexes
+            check_schema()
+            db.session.remove()
+            db.engine.dispose()
+
+    def test_upgrade_baseline_database_accepts_duplicates(self, tmp_path):
+        """Test that the unique filename of the original schema is dropped, so duplicates share a blob."""
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads')
+        })
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    'CREATE TABLE documents (id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL, '
+                    'original_filename VARCHAR(255) NOT NULL, file_size INTEGER NOT NULL, '
+                    'file_type VARCHAR(10) NOT NULL, upload_timestamp DATETIME NOT NULL, '
+                    'PRIMARY KEY (id), UNIQUE (filename))'
+                )
+                connection.exec_driver_sql(
+                    "INSERT INTO documents VALUES (1, 'old_report.pdf', 'report.pdf', 3, 'pdf', "
+                    "'2024-01-01 00:00:00.000000')"
+                )
+
+            assert init_schema() == (0, SCHEMA_VERSION)
+            client = app.test_client()
+            for _ in range(2):
+                response = client.post('/api/documents', data={'file': (io.BytesIO(b'same bytes'), 'same.txt')},
+                                       content_type='multipart/form-data')
+                assert response.status_code == 201
+            assert response.get_json()['storage']['references'] == 2
+            assert client.get('/api/documents/1/metadata').get_json()['document']['original_filename'] == 'report.pdf'
+            # Counters created by the upgrade include the documents already there
+            stats = client.get('/api/documents/stats').get_json()
+            assert stats['by_type']['pdf'] == {'documents': 1, 'bytes': 3}
+            assert stats['total_documents'] == 3
+            db.session.remove()
+            db.engine.dispose()
+
+    def test_newer_database_is_refused(self, tmp_path):
+        """Test that an older release does not touch a newer schema."""
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads')
+        })
+        with app.app_context():
+            init_schema()
+            with db.engine.begin() as connection:
+                connection.execute(db.update(SchemaVersion).values(version=SCHEMA_VERSION + 1))
+
+            result = app.test_cli_runner().invoke(args=['init-db'])
+            assert result.exit_code != 0
+            assert 'newer than this release' in result.output
+            db.engine.dispose()
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class Server:
+    """The production server in a subprocess, logging to a file."""
+
+    def __init__(self, tmp_path, initialize=True, graceful_timeout=30):
+        self.port = _free_port()
+        self.log_path = tmp_path / 'server.log'
+        self.env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'app.db'}",
+                        UPLOAD_FOLDER=str(tmp_path / 'uploads'), METRICS_ENABLED='false')
+        if initialize:
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'run', 'init-db'],
+                           env=self.env, check=True, capture_output=True)
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'app.server', '--bind', f'127.0.0.1:{self.port}',
+                 '--workers', '2', '--threads', '2', '--graceful-timeout', str(graceful_timeout)],
+                env=self.env, stdout=log, stderr=subprocess.STDOUT
+            )
+
+    @property
+    def log(self):
+        return self.log_path.read_text()
+
+    def wait_for_log(self, text, count=1, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self.log.count(text) < count:
+            assert time.monotonic() < deadline, f'{text!r} not logged:\n{self.log}'
+            time.sleep(0.05)
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        data = response.read()
+        connection.close()
+        return response.status, data
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+        return self.process.wait(timeout=30)
+
+def _start_upload(server, name, content):
+    """Send an upload's headers and the first half of its body, leaving it in flight."""
+    boundary = 'test-boundary'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    sock = socket.create_connection(('127.0.0.1', server.port), timeout=10)
+    sock.sendall((f'POST /api/documents HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+                  f'Content-Type: multipart/form-data; boundary={boundary}\r\n'
+                  f'Content-Length: {len(body)}\r\n\r\n').encode() + body[:len(body) // 2])
+    return sock, body[len(body) // 2:]
+
+def _finish_upload(sock, rest):
+    sock.sendall(rest)
+    response = http.client.HTTPResponse(sock)
+    response.begin()
+    data = json.loads(response.read())
+    sock.close()
+    return response.status, data
+
+@pytest.fixture
+def server(tmp_path):
+    server = Server(tmp_path)
+    server.wait_for_log('Listening on')
+    # Wait until both workers accept requests
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            server.request('GET', '/api/documents')
+            break
+        except OSError:
+            assert time.monotonic() < deadline, server.log
+            time.sleep(0.1)
+    yield server
+    server.stop()
+
+class TestServer:
+    """Test the multi-process server."""
+
+    def test_busy_worker_leaves_connections_queued(self, app):
+        """Test that a worker with no free thread does not accept connections."""
+        listener = socket.create_server(('127.0.0.1', 0))
+        worker = WorkerServer('127.0.0.1', listener.getsockname()[1], app, listener.fileno(), threads=1)
+        worker.slot_wait = 0.1
+        client = socket.create_connection(listener.getsockname(), timeout=10)
+        try:
+            worker._slots.acquire()
+            worker._handle_request_noblock()
+            assert select.select([listener], [], [], 0)[0]
+
+            worker._slots.release()
+            worker._handle_request_noblock()
+            assert not select.select([listener], [], [], 0)[0]
+            client.sendall(b'GET /api/documents HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+            response = http.client.HTTPResponse(client)
+            response.begin()
+            assert response.status == 200
+        finally:
+            client.close()
+            worker.drain()
+            worker.server_close()
+            listener.close()
+
+    def test_serves_requests(self, server):
+        """Test uploads and downloads are served by the workers."""
+        status, data = server.request('POST', '/api/documents', body=b'--b\r\nContent-Disposition: form-data; '
+                                      b'name="file"; filename="a.txt"\r\n\r\nserved text\r\n--b--\r\n',
+                                      headers={'Content-Type': 'multipart/form-data; boundary=b'})
+        assert status == 201
+        document_id = json.loads(data)['document']['id']
+
+        for _ in range(4):
+            assert server.request('GET', f'/api/documents/{document_id}') == (200, b'served text')
+        assert server.log.count('Started worker') == 2
+
+    def test_reload_drains_in_flight_requests(self, server):
+        """Test that a reload replaces the workers without dropping an upload in progress."""
+        sock, rest = _start_upload(server, 'inflight.txt', b'uploaded across a reload ' * 1000)
+        time.sleep(0.5)
+
+        server.process.send_signal(signal.SIGHUP)
+        server.wait_for_log('Reload complete')
+        # The new workers serve while the old one finishes the upload
+        assert server.request('GET', '/api/documents')[0] == 200
+
+        status, data = _finish_upload(sock, rest)
+        assert status == 201
+        assert data['document']['original_filename'] == 'inflight.txt'
+        assert server.log.count('Started worker') == 4
+        assert server.stop() == 0
+
+    def test_stop_drains_in_flight_requests(self, server):
+        """Test that SIGTERM lets accepted requests finish before exiting."""
+        sock, rest = _start_upload(server, 'stopping.txt', b'uploaded while stopping ' * 1000)
+        time.sleep(0.5)
+
+        server.process.send_signal(signal.SIGTERM)
+        server.wait_for_log('Shutting down')
+        status, _ = _finish_upload(sock, rest)
+
+        assert status == 201
+        assert server.process.wait(timeout=30) == 0
+
+    def test_refuses_uninitialized_database(self, tmp_path):
+        """Test that workers do not start until init-db has run."""
+        server = Server(tmp_path, initialize=False)
+
+        assert server.process.wait(timeout=30) == 1
+        assert 'run "flask init-db"' in server.log